@@ -1,13 +1,54 @@
 from agents import Agent, Runner, OpenAIChatCompletionsModel, AsyncOpenAI, ModelSettings
 from Sql_Tool.Calling_Able import ChatMemoryManager, MemoryType
+from Sql_Tool.Run_Metrics import RunMetricsManager
 from Sql_Tool.MsSQL_Tool import Show_Tables, Query_SQL
-from Rag_Tool.Retrieval import Retrieval_Tool_Text
+from Rag_Tool.Retrieval import Retrieval_Tool_Text, retrieval_prefetcher
+from Quote_Tool.Quote_Tool import Quote_Tool
+from VisionTool.Vision_Tool import Vision_Tool, Vision_Document_Tool
+from VisionTool.Base64Tool import Image_Reference
+from File_Tool.Ingestion import file_ingestor
+from State_Store import get_state_store
+from Agent_Registry import AgentRegistry, tool_name
+from Model_Catalog import ModelCatalog
+from Model_Router import ModelRouter
+from Model_Warmup import ModelWarmer
+from Run_Accounting import RunAccounting
+from Tracing import span, traced_tool
+from Tool_Concurrency import tool_slots, bounded_tool, TOOL_CONCURRENCY
+from Intent_Router import intent_router
 from dotenv import load_dotenv
+from pathlib import Path
+import threading
+import hashlib
 import logging
 import asyncio
+import queue
+import json
+import time
 import os
 from datetime import datetime
 
+PROMPT_PATH = Path(__file__).resolve().parent / "Prompt" / "Prompt.txt"
+
+def normalize_prompt(text: str) -> str:
+    """
+    系統提示詞正規化：去除 BOM、統一換行為 \n、去除行尾空白
+    確保不同平台或編輯器存檔後，送給模型的前綴逐位元組相同（推論服務的 KV cache 才能命中）
+    """
+    text = text.lstrip("\ufeff").replace("\r\n", "\n").replace("\r", "\n")
+    return "\n".join(line.rstrip() for line in text.split("\n")).strip()
+
+def tool_schema(tool) -> dict:
+    """工具的 OpenAI function 定義（與 Agents SDK 送出的格式相同）"""
+    return {
+        "type": "function",
+        "function": {
+            "name": tool.name,
+            "description": tool.description or "",
+            "parameters": tool.params_json_schema,
+        },
+    }
+
 class CustomAgent:
     def __init__(self, logger):
         load_dotenv()
@@ -20,21 +61,49 @@ class CustomAgent:
         self.Connect_Models()
 
         self.name = "Assistant"
-        self.model_ = "gpt-oss:20b"
-        self.Prompt_Path = r"Prompt\Prompt.txt"
-        self.System_Prompt = None
-        self.Load_System_Prompt()
+        self.default_model = os.getenv("AGENT_DEFAULT_MODEL", "gpt-oss:20b")
+        self.state = get_state_store()
+        self.Prompt_Path = Path(os.getenv("AGENT_PROMPT_PATH", PROMPT_PATH))
+        self.System_Prompt = None  # 首次建立 Agent 時才讀取
+        self.prefix_hash = None    # 系統提示詞 + 工具定義的雜湊，變動代表 KV cache 前綴失效
 
         self.Model_Set = {
             "temperature": 0.2,
             "top_p": 0.9,
             "frequency_penalty": 0.5,
-            "presence_penalty": 0.3
+            "presence_penalty": 0.3,
+            # 同一回合可要求多個工具呼叫（模型不支援時由推論服務忽略）；工具會同時執行，上限為 TOOL_CONCURRENCY
+            "parallel_tool_calls": os.getenv("AGENT_PARALLEL_TOOL_CALLS", "true").lower() == "true"
         }
         self.log.info("Agent settings initialized.")
 
+    @property
+    def model_(self) -> str:
+        """目前使用的模型（存放在共用狀態，所有 worker / replica 一致）"""
+        return self.state.get("model", self.default_model)
+
+    @model_.setter
+    def model_(self, model: str):
+        self.state.set("model", model)
+
+    def user_model(self, user_id: int) -> str:
+        """用戶自訂的預設模型（未設定時回傳 None）"""
+        return self.state.get(f"user_model:{user_id}")
+
+    def set_user_model(self, user_id: int, model: str):
+        self.state.set(f"user_model:{user_id}", model)
+
+    def resolve_model(self, requested: str = None, user_id: int = None) -> str:
+        """模型優先順序：請求指定 > 用戶預設 > 全域預設"""
+        return requested or (self.user_model(user_id) if user_id is not None else None) or self.model_
+
     def Connect_Models(self):
         try:
+            if os.getenv("OLLAMA_BACKENDS"):
+                # 多個推論服務：依延遲與負載路由，失敗時自動切換
+                self.external_client = ModelRouter.from_env(default_key=self.api_key)
+                self.log.info(f"Connected to {len(self.external_client.backends)} model backends via router.")
+                return
             self.external_client = AsyncOpenAI(base_url=self.base_url, api_key=self.api_key)
             self.log.info(f"Connected to external model {self.external_client.base_url}.")
         except Exception as e:
@@ -42,43 +111,94 @@ class CustomAgent:
 
     def Load_System_Prompt(self):
         try:
-            self.System_Prompt = open(self.Prompt_Path, "r", encoding="utf-8").read()
+            self.System_Prompt = normalize_prompt(self.Prompt_Path.read_text(encoding="utf-8"))
             self.log.info(f"System prompt loaded from {self.Prompt_Path}, Lens = {len(self.System_Prompt)}.")
         except Exception as e:
             self.log.error(f"Failed to load system prompt from {self.Prompt_Path}. Error: {e}")
 
-    def Create_Agent(self, Tool_List = []):
-        """Create or Update Agent"""
+    def Create_Agent(self, Tool_List = [], model: str = None, model_settings: dict = None):
+        """Create or Update Agent（未指定 model / model_settings 時使用目前設定）"""
+        model = model or self.model_
+        if self.System_Prompt is None:
+            self.Load_System_Prompt()
+        # 工具依名稱排序，工具定義在每次請求中的順序固定；每個工具呼叫記錄為 trace 的 span，並受並行上限約束
+        Tool_List = [bounded_tool(traced_tool(tool)) for tool in sorted(Tool_List, key=tool_name)]
+        self.Track_Prefix(Tool_List)
         agent = Agent(
             name=self.name,
             instructions=self.System_Prompt,
             model=OpenAIChatCompletionsModel(
-                model=self.model_,
+                model=model,
                 openai_client=self.external_client
             ),
-            model_settings=ModelSettings(**self.Model_Set),
+            model_settings=ModelSettings(**(model_settings or self.Model_Set)),
             tools=Tool_List,
         )
-        self.log.info(f"Agent {self.name} created.")
+        self.log.info(f"Agent {self.name} created ({model}).")
         return agent
 
+    def Prompt_Prefix(self, Tool_List = None):
+        """
+        正式請求的固定前綴（系統訊息, 工具定義, 雜湊）
+        預熱與量測使用相同內容，才會與正式請求共用推論服務的 KV cache
+        """
+        if self.System_Prompt is None:
+            self.Load_System_Prompt()
+        tools = [tool_schema(tool) for tool in sorted(Tool_List or [], key=tool_name) if hasattr(tool, "params_json_schema")]
+        messages = [{"role": "system", "content": self.System_Prompt or ""}]
+        payload = json.dumps({"messages": messages, "tools": tools}, ensure_ascii=False, sort_keys=True)
+        return messages, tools, hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+    def Track_Prefix(self, Tool_List):
+        """記錄前綴雜湊；與上次不同時記錄警告（推論服務的前綴快取將全部失效）"""
+        _, _, prefix_hash = self.Prompt_Prefix(Tool_List)
+        if self.prefix_hash and prefix_hash != self.prefix_hash:
+            self.log.warning(f"Prompt prefix changed: {self.prefix_hash} -> {prefix_hash}, KV cache will miss.")
+        self.prefix_hash = prefix_hash
+        self.log.info(f"Prompt prefix hash: {prefix_hash}.")
+
+    def Warmup_Targets(self):
+        """需要預熱的推論服務（使用路由器時為每個 backend）"""
+        if isinstance(self.external_client, ModelRouter):
+            return [{"name": b.name, "base_url": b.base_url, "api_key": getattr(b.client, "api_key", None)}
+                    for b in self.external_client.backends]
+        return [{"name": "default", "base_url": self.base_url, "api_key": self.api_key}]
+
 class SystemandLogic():
     def __init__(self):
         self.Create_Agent_Log = self.make_logger("Create_Agent_Log", "logs", "logs/Create_Agent_Log.log")
         self.Agent_CAlling_Log = self.make_logger("Agent_CAlling_Log", "logs", "logs/Agent_CAlling_Log.log")
         self.Agent_CAlling_Log.info("Log initialized.")
 
+        # 建立資料庫與資料表改由 initialize() 執行（API 於啟動階段呼叫，不在 import 時連線）
         self.manager = ChatMemoryManager()
-        self.manager.initialize()
-        self.Agent_CAlling_Log.info("Memory initialized.")
+        self.run_metrics = RunMetricsManager(self.manager.conn_str)
+        # 用量紀錄交給背景執行緒寫入（不佔用 event loop，也不受 asyncio.run 結束時取消工作影響）
+        self._records: "queue.Queue[tuple]" = queue.Queue()
+        self._recorder = None
+        self._recorder_lock = threading.Lock()
         
-        # 當前對話編號（可動態設置）
-        self.current_conversation_id = 1
-        self.Agent_CAlling_Log.info(f"Conversation ID set to: {self.current_conversation_id}")
+        # 當前對話編號（可動態設置，存放在共用狀態）
+        self.state = get_state_store()
+        self.Agent_CAlling_Log.info(f"Conversation ID: {self.current_conversation_id}")
 
         # print("[INFO]: SystemandLogic initialized.")
         pass
 
+    @property
+    def current_conversation_id(self) -> int:
+        return int(self.state.get("current_conversation_id", 1))
+
+    @current_conversation_id.setter
+    def current_conversation_id(self, conversation_id: int):
+        self.state.set("current_conversation_id", int(conversation_id))
+
+    def initialize(self):
+        """初始化記憶數據庫和表格"""
+        initialized = self.manager.initialize()
+        self.Agent_CAlling_Log.info(f"Memory initialized: {initialized}.")
+        return initialized
+
     def make_logger(self, name, file_folder, filepath):
         os.makedirs(file_folder, exist_ok=True)
         logger = logging.getLogger(name)
@@ -116,53 +236,126 @@ class SystemandLogic():
             self.Agent_CAlling_Log.error(f"Error saving system memory: {e}")
             return False
     
-    async def main(self, input, Agent, max_turns=3):
+    async def main(self, input, Agent, max_turns=3, conversation_id=None, user_id=None, queued_at=None):
         """
         執行Agent - 帶對話記憶 + 系統記憶
         Args:
             input: 用戶輸入文本
             Agent: Agent實例
             max_turns: 最大轉數
+            conversation_id: 對話編號（預設為當前對話；執行期間固定，不受其他請求切換影響）
+            user_id: 用戶編號（用量統計用）
+            queued_at: 請求進入服務的時間（time.perf_counter()），用於計算等待時間
         """
-        try:
-            # 1. 獲取對話歷史消息（Agent格式）
-            history_messages = self.manager.get_messages_for_agent(
-                self.current_conversation_id, 
-                limit=20,
-                memory_type=MemoryType.CHAT
-            )
-            
-            # 2. 組合歷史消息 + 當前用戶輸入
-            full_input = history_messages + [{"role": "user", "content": input}]
-            self.Agent_CAlling_Log.info(f"Conversation {self.current_conversation_id}: Running Agent with {len(history_messages)} history messages.")
+        conversation_id = conversation_id or self.current_conversation_id
+        model = getattr(getattr(Agent, "model", None), "model", None)
+        with span("agent.run", conversation_id=conversation_id, user_id=user_id, model=model, max_turns=max_turns) as run_span:
+            accounting = RunAccounting(queued_at)
+            result, error = None, None
+            prefetched = []
+            # 0. 意圖路由：招呼 / 確認與欄位齊全的估價不經過大模型（純計算，不影響其他請求）
+            decision = intent_router.route(input)
+            try:
+                # 依輸入關鍵字預先開始可能需要的檢索，與載入歷史同時進行（工具呼叫時直接取得結果）
+                # 價格表檢索只在價格表尚無資料時預取（由 retrieval_prefetcher 判斷）
+                if decision.route == "agent":
+                    prefetched = retrieval_prefetcher.prefetch(input)
             
-            # 3. 執行Agent
-            result = await Runner.run(
-                starting_agent=Agent,
-                input=full_input,
-                max_turns=max_turns
-            )
+                # 1. 獲取對話歷史消息（Agent格式）；在執行緒中載入，預取的檢索請求同時進行
+                history_messages = await asyncio.to_thread(
+                    self.manager.get_messages_for_agent,
+                    conversation_id, 
+                    limit=20,
+                    memory_type=MemoryType.CHAT
+                )
+                # 上一則助理訊息是提問時，確認類回覆需交給 Agent
+                decision = intent_router.confirm(decision, history_messages)
             
-            self.Agent_CAlling_Log.info(f"Conversation {self.current_conversation_id}: Run completed.")
-            self.Agent_CAlling_Log.info(f"Final output: {result.final_output[:100]}...")
+                if decision.reply is not None:
+                    # 2a. 固定回覆 / 直接估價
+                    model = f"router:{decision.route}"
+                    output = decision.reply
+                    self.Agent_CAlling_Log.info(f"Conversation {conversation_id}: Routed {decision.intent} to {decision.route}.")
+                else:
+                    if decision.route == "small_model":
+                        # 2b. 小模型回覆（不帶工具，一個回合）
+                        Agent = agent_registry.get(intent_router.small_model, [], CustomAgent.Model_Set)
+                        model, max_turns = intent_router.small_model, 1
+                
+                    # 2. 組合已上傳檔案的預分析結果 + 歷史消息 + 當前用戶輸入
+                    #    附件內容放在歷史之前：下一輪只在尾端新增訊息，前綴不變，推論服務的 KV cache 可重複使用
+                    attachment_context = await asyncio.to_thread(file_ingestor.build_context, conversation_id)
+                    full_input = attachment_context + history_messages + [{"role": "user", "content": input}]
+                    self.Agent_CAlling_Log.info(f"Conversation {conversation_id}: Running Agent with {len(history_messages)} history messages.")
+                
+                    # 3. 執行Agent（同一回合的工具呼叫同時執行，最多 TOOL_CONCURRENCY 個）
+                    with tool_slots(TOOL_CONCURRENCY):
+                        result = await Runner.run(
+                            starting_agent=Agent,
+                            input=full_input,
+                            max_turns=max_turns,
+                            hooks=accounting
+                        )
+                    output = result.final_output
+                
+                    self.Agent_CAlling_Log.info(f"Conversation {conversation_id}: Run completed.")
+                    self.Agent_CAlling_Log.info(f"Final output: {output[:100]}...")
             
-            # 4. 保存當前對話到數據庫
-            messages = [
-                {"role": "user", "content": input},
-                {"role": "assistant", "content": result.final_output}
-            ]
-            self.manager.save_messages_batch(
-                self.current_conversation_id,
-                messages, 
-                memory_type=MemoryType.CHAT
-            )
-            self.Agent_CAlling_Log.info(f"Messages saved to conversation {self.current_conversation_id}.")
+                # 4. 保存當前對話到數據庫
+                messages = [
+                    {"role": "user", "content": input},
+                    {"role": "assistant", "content": output}
+                ]
+                self.manager.save_messages_batch(
+                    conversation_id,
+                    messages, 
+                    memory_type=MemoryType.CHAT
+                )
+                self.Agent_CAlling_Log.info(f"Messages saved to conversation {conversation_id}.")
             
-            return result.final_output
+                return output
         
-        except Exception as e:
-            self.Agent_CAlling_Log.error(f"Error in main(): {e}")
-            raise
+            except Exception as e:
+                error = e
+                self.Agent_CAlling_Log.error(f"Error in main(): {e}")
+                raise
+            finally:
+                # 5. 記錄本次執行用量與路由決策（失敗不影響回應）；預取但未使用的檢索計為浪費
+                run_span.set(model=model, intent=decision.intent, route=decision.route)
+                retrieval_prefetcher.settle(prefetched)
+                metrics = accounting.summary(result, error)
+                self.Agent_CAlling_Log.info(
+                    f"Conversation {conversation_id}: {metrics['status']}, model {model}, intent {decision.intent} -> {decision.route}, "
+                    f"tokens {metrics['input_tokens']}/{metrics['output_tokens']}, turns {metrics['turns']}, "
+                    f"tools {metrics['tool_calls']} ({metrics['tool_ms']} ms, max parallel {metrics['max_parallel_tools']}), wait {metrics['queue_wait_ms']} ms, "
+                    f"wall {metrics['wall_ms']} ms, prefetched {prefetched}."
+                )
+                # 寫入在背景執行緒進行，不延遲回應
+                self.queue_record(input, decision, conversation_id, user_id, model, metrics)
+
+    def queue_record(self, *record):
+        with self._recorder_lock:
+            if self._recorder is None:
+                self._recorder = threading.Thread(target=self._record_loop, name="run-recorder", daemon=True)
+                self._recorder.start()
+        self._records.put(record)
+
+    def flush_records(self, timeout: float = 10.0):
+        """等待尚未寫入的用量紀錄完成（CLI 結束或 API 關閉時呼叫）"""
+        deadline = time.time() + timeout
+        while self._records.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.01)
+
+    def _record_loop(self):
+        while True:
+            input, decision, conversation_id, user_id, model, metrics = self._records.get()
+            try:
+                self.run_metrics.record(conversation_id, user_id, model, metrics)
+                intent_router.record(input, decision, conversation_id, user_id, metrics["status"], metrics["wall_ms"])
+            except Exception as e:
+                self.Agent_CAlling_Log.error(f"Conversation {conversation_id}: failed to record run: {e}")
+            finally:
+                self._records.task_done()
     
     def get_conversation_summary(self) -> dict:
         """獲取當前對話摘要"""
@@ -185,12 +378,24 @@ class SystemandLogic():
         return conversations
 
 
+# Agent 預設工具
+Default_Tool_List = [Show_Tables, Query_SQL, Retrieval_Tool_Text, Quote_Tool, Vision_Tool, Vision_Document_Tool, Image_Reference]
+
 SystemandLogic = SystemandLogic()
 CustomAgent = CustomAgent(SystemandLogic.Create_Agent_Log)
-# 創建Agent實例
-Agent_ = CustomAgent.Create_Agent(Tool_List=[Show_Tables, Query_SQL, Retrieval_Tool_Text])
+# 依 (模型, 工具, 參數) 快取已建立的 Agent
+agent_registry = AgentRegistry(lambda model, tools, settings: CustomAgent.Create_Agent(tools, model, settings))
+# 模型清單與規格快取
+model_catalog = ModelCatalog(CustomAgent.base_url, CustomAgent.api_key, CustomAgent.external_client)
+# 模型預熱（與正式請求相同的系統提示詞與工具前綴）
+model_warmer = ModelWarmer(CustomAgent.Warmup_Targets(), lambda: CustomAgent.Prompt_Prefix(Default_Tool_List),
+                           CustomAgent.external_client)
 
 if __name__ == "__main__":
+    SystemandLogic.initialize()
+    # 創建Agent實例
+    Agent_ = CustomAgent.Create_Agent(Tool_List=Default_Tool_List)
+
     print("="*70)
     print("Agent 多對話系統")
     print("="*70)
@@ -199,6 +404,7 @@ if __name__ == "__main__":
     print("  /new <id> - 開始新對話（編號 id）")
     print("  /stats - 當前對話統計")
     print("  /clear - 清除當前對話")
+    print("  /quote <csv|json> [並行數] - 批次估價（輸出 NDJSON）")
     print("  /quit - 退出")
     print("  其他輸入 - 提交給 Agent")
     print("="*70)
@@ -244,6 +450,16 @@ if __name__ == "__main__":
                 print(f"✓ Cleared conversation {SystemandLogic.current_conversation_id}")
                 continue
             
+            elif user_input.lower().startswith("/quote"):
+                from Quote_Tool.Batch_Quote import run_batch_file
+                args = user_input.split()
+                if len(args) < 2:
+                    print("Usage: /quote <parts.csv|parts.json> [concurrency]")
+                    continue
+                concurrency = int(args[2]) if len(args) > 2 else None
+                asyncio.run(run_batch_file(args[1], concurrency))
+                continue
+            
             # 提交給 Agent
             print("\n[Agent is thinking...]")
             result = asyncio.run(SystemandLogic.main(user_input, Agent_, max_turns=10))
@@ -256,3 +472,5 @@ if __name__ == "__main__":
             print(f"Error: {e}")
             continue
 
+    SystemandLogic.flush_records()
+
@@ -0,0 +1,78 @@
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+from collections import OrderedDict
+import threading
+import os
+
+AGENT_REGISTRY_SIZE = int(os.getenv("AGENT_REGISTRY_SIZE", "16"))
+
+def tool_name(tool: Any) -> str:
+    return getattr(tool, "name", None) or getattr(tool, "__name__", repr(tool))
+
+def tool_names(tools: List[Any]) -> Tuple[str, ...]:
+    """依名稱排序（Agent 建立時工具也會排序，順序不同的相同工具組合視為同一個 Agent）"""
+    return tuple(sorted(tool_name(tool) for tool in tools))
+
+def make_key(model: str, tools: List[Any], settings: Dict[str, Any]) -> Tuple[Hashable, ...]:
+    """(模型, 工具名稱, 模型參數) 作為快取鍵"""
+    return (model, tool_names(tools), tuple(sorted(settings.items())))
+
+class AgentRegistry:
+    """
+    已建立 Agent 的 LRU 快取
+    - 每個 (模型, 工具組合, 模型參數) 只建立一次，之後以字典查詢 O(1) 取得
+    - 不同用戶可同時使用不同模型，不需重建或覆寫全域 Agent
+    """
+
+    def __init__(self, factory: Callable[[str, List[Any], Dict[str, Any]], Any],
+                 max_entries: int = AGENT_REGISTRY_SIZE):
+        """
+        Args:
+            factory: factory(model, tools, settings) -> Agent
+            max_entries: 最多保留的 Agent 數，超過時淘汰最久未使用者
+        """
+        self.factory = factory
+        self.max_entries = max(1, max_entries)
+        self._agents: "OrderedDict[Tuple, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, model: str, tools: List[Any], settings: Dict[str, Any]) -> Any:
+        key = make_key(model, tools, settings)
+        with self._lock:
+            agent = self._agents.get(key)
+            if agent is not None:
+                self._agents.move_to_end(key)
+                self.hits += 1
+                return agent
+            self.misses += 1
+
+        # Agent 建立不需持有鎖；同時建立同一個鍵時保留先放入的那個
+        agent = self.factory(model, tools, settings)
+        with self._lock:
+            agent = self._agents.setdefault(key, agent)
+            self._agents.move_to_end(key)
+            while len(self._agents) > self.max_entries:
+                self._agents.popitem(last=False)
+                self.evictions += 1
+        return agent
+
+    def invalidate(self, model: Optional[str] = None):
+        """清除快取（指定模型時只清除該模型），例如系統提示詞更新後"""
+        with self._lock:
+            for key in [k for k in self._agents if model is None or k[0] == model]:
+                del self._agents[key]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._agents),
+                "max_entries": self.max_entries,
+                "models": sorted({key[0] for key in self._agents}),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / total, 4) if total else None,
+            }
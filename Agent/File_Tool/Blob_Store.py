@@ -0,0 +1,96 @@
+from typing import Any, Dict, Optional
+from pathlib import Path
+from File_Tool.Upload_Stream import save_upload_stream
+from File_Tool.Ingestion import UPLOAD_DIR
+from VisionTool.Document_Pipeline import remove_rendered_pages
+from VisionTool.Attachment_Store import attachment_store, ATTACHMENT_PREFIX
+import aiofiles.os
+import re
+import uuid
+import os
+
+BLOB_DIR = Path(os.getenv("BLOB_DIR", str(UPLOAD_DIR / "blobs")))
+attachment_store.allow_root(BLOB_DIR)
+SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+def is_sha256(value: str) -> bool:
+    return bool(value) and bool(SHA256_PATTERN.match(value))
+
+def blob_path(sha256: str) -> Path:
+    """內容定址路徑：blobs/ab/abcdef..."""
+    if not is_sha256(sha256):
+        raise ValueError(f"無效的 SHA-256: {sha256}")
+    return BLOB_DIR / sha256[:2] / sha256
+
+def blob_exists(sha256: str) -> bool:
+    return is_sha256(sha256) and blob_path(sha256).is_file()
+
+def resolve_source(ref: str, allow_paths: bool = True) -> str:
+    """
+    檢查由使用者或模型指定的檔案來源，只接受上傳過的內容（不接受任意伺服器路徑）
+    Args:
+        ref: 附件 ID（att_...）、blob 的 SHA-256，或位於 UPLOAD_DIR 下的路徑
+        allow_paths: 是否接受 UPLOAD_DIR 下的路徑
+    Returns:
+        附件 ID 或檔案路徑（交給 analyze_image / analyze_document）
+    """
+    ref = str(ref or "").strip()
+    if ref.startswith(ATTACHMENT_PREFIX):
+        attachment_store.resolve(ref)  # 不存在時拋出 FileNotFoundError
+        return ref
+    if is_sha256(ref.lower()):
+        if not blob_exists(ref.lower()):
+            raise FileNotFoundError(f"找不到內容：{ref}")
+        return str(blob_path(ref.lower()))
+    if not allow_paths:
+        raise ValueError("path 需為檔案的 SHA-256 或附件 ID（att_...）")
+    path = Path(ref).resolve()
+    if not ref or not path.is_relative_to(UPLOAD_DIR.resolve()):
+        raise ValueError("只接受附件 ID（att_...）、檔案的 SHA-256 或上傳目錄中的檔案")
+    if not path.exists():
+        raise FileNotFoundError(f"找不到檔案：{ref}")
+    return str(path)
+
+async def receive_upload(upload, max_bytes: int) -> Dict[str, Any]:
+    """
+    將上傳內容串流寫入暫存檔並計算雜湊（尚未放進 blob 區）
+    Returns:
+        {"size", "sha256", "temp_path"}
+    """
+    temp_dir = BLOB_DIR / "tmp"
+    temp_dir.mkdir(parents=True, exist_ok=True)
+    temp_path = temp_dir / uuid.uuid4().hex
+    saved = await save_upload_stream(upload, temp_path, max_bytes)
+    saved["temp_path"] = temp_path
+    return saved
+
+async def commit_blob(temp_path: Path, sha256: str) -> bool:
+    """
+    將暫存檔放到內容定址路徑；內容已存在時直接丟棄暫存檔（不重複寫入）
+    Returns:
+        是否寫入了新的 blob
+    """
+    target = blob_path(sha256)
+    if target.is_file():
+        await discard_temp(temp_path)
+        return False
+    target.parent.mkdir(parents=True, exist_ok=True)
+    await aiofiles.os.replace(temp_path, target)
+    return True
+
+async def discard_temp(temp_path: Optional[Path]):
+    if temp_path is None:
+        return
+    try:
+        await aiofiles.os.remove(temp_path)
+    except FileNotFoundError:
+        pass
+
+def delete_blob(sha256: str) -> bool:
+    """刪除 blob 檔案與其渲染頁面（僅在引用數歸零後呼叫）"""
+    remove_rendered_pages(sha256)
+    try:
+        blob_path(sha256).unlink()
+        return True
+    except FileNotFoundError:
+        return False
@@ -0,0 +1,136 @@
+from typing import Optional, Tuple
+from pathlib import Path
+from urllib.parse import quote
+from starlette.responses import Response
+from File_Tool.Upload_Stream import UPLOAD_CHUNK_SIZE
+import aiofiles
+import os
+
+ZEROCOPY_EXTENSION = "http.response.zerocopysend"
+
+def make_etag(sha256: Optional[str], stat: os.stat_result) -> str:
+    """有內容雜湊時為強 ETag，舊版檔案以修改時間與大小產生弱 ETag"""
+    if sha256:
+        return f'"{sha256}"'
+    return f'W/"{int(stat.st_mtime):x}-{stat.st_size:x}"'
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """If-None-Match 比對（弱比較）"""
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    target = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == target for tag in header.split(","))
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    解析單一 bytes 範圍
+    Returns:
+        (start, end)（含 end）；沒有 Range 或為多重範圍時回傳 None（改回完整內容）
+    Raises:
+        ValueError: 範圍無法滿足（416）
+    """
+    if not header or not header.startswith("bytes="):
+        return None
+    spec = header[len("bytes="):].strip()
+    if "," in spec:
+        return None
+    start_text, _, end_text = spec.partition("-")
+    try:
+        if start_text == "":
+            # bytes=-N：最後 N 個位元組
+            length = int(end_text)
+            if length <= 0:
+                raise ValueError
+            return max(0, size - length), size - 1
+        start = int(start_text)
+        end = int(end_text) if end_text else size - 1
+    except ValueError:
+        raise ValueError(f"無效的範圍: {header}")
+    if start >= size or end < start:
+        raise ValueError(f"範圍超出檔案大小: {header}")
+    return start, min(end, size - 1)
+
+def content_disposition(filename: str, attachment: bool) -> str:
+    kind = "attachment" if attachment else "inline"
+    return f"{kind}; filename*=UTF-8''{quote(filename)}"
+
+class FileRangeResponse(Response):
+    """
+    回傳檔案的完整（200）或部分內容（206）
+    - 伺服器支援 zerocopysend 擴充時直接交給 sendfile，不經過 Python 複製
+    - 否則以固定大小區塊讀取，不會把整段內容載入記憶體
+    """
+
+    def __init__(self, path: Path, start: int, end: int, size: int, headers: dict, media_type: str,
+                 partial: bool = False):
+        super().__init__(status_code=206 if partial else 200, headers=headers, media_type=media_type)
+        self.path = path
+        self.start = start
+        self.count = end - start + 1
+        if partial:
+            self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+        self.headers["content-length"] = str(self.count)
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope.get("method") == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        if self.count > 0 and ZEROCOPY_EXTENSION in scope.get("extensions", {}):
+            with open(self.path, "rb") as f:
+                await send({"type": ZEROCOPY_EXTENSION, "file": f.fileno(),
+                            "offset": self.start, "count": self.count, "more_body": False})
+            return
+
+        remaining = self.count
+        async with aiofiles.open(self.path, "rb") as f:
+            await f.seek(self.start)
+            while remaining > 0:
+                chunk = await f.read(min(UPLOAD_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0 or self.count == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+def serve_file(path: Path, download_name: str, media_type: str, sha256: Optional[str] = None,
+               range_header: Optional[str] = None, if_none_match: Optional[str] = None,
+               if_range: Optional[str] = None, attachment: bool = False) -> Response:
+    """
+    依條件請求與 Range 標頭回傳 304 / 206 / 416 / 200
+    Args:
+        path: 實際檔案路徑
+        download_name: 下載時的檔名
+        media_type: MIME 類型
+        sha256: 內容雜湊（作為 ETag）
+        range_header / if_none_match / if_range: 對應的請求標頭
+        attachment: True 時強制下載，否則瀏覽器可直接預覽
+    """
+    stat = path.stat()
+    etag = make_etag(sha256, stat)
+    headers = {
+        "etag": etag,
+        "accept-ranges": "bytes",
+        "cache-control": "private, max-age=0, must-revalidate",
+        "content-disposition": content_disposition(download_name, attachment),
+    }
+
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={k: headers[k] for k in ("etag", "cache-control")})
+
+    # If-Range 與目前版本不符時忽略 Range，回傳完整內容（只接受強 ETag）
+    if if_range is not None and (if_range.strip() != etag or etag.startswith("W/")):
+        range_header = None
+
+    try:
+        byte_range = parse_range(range_header, stat.st_size)
+    except ValueError:
+        return Response(status_code=416, headers={"content-range": f"bytes */{stat.st_size}", "etag": etag})
+
+    if byte_range is None:
+        return FileRangeResponse(path, 0, stat.st_size - 1, stat.st_size, headers, media_type)
+    return FileRangeResponse(path, byte_range[0], byte_range[1], stat.st_size, headers, media_type, partial=True)
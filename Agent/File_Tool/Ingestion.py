@@ -0,0 +1,274 @@
+from typing import Any, Dict, List, Optional
+from datetime import datetime
+from pathlib import Path
+from VisionTool.Vision_Client import analyze_image
+from VisionTool.Document_Pipeline import analyze_document
+from VisionTool.Image_Preprocess import get_pool
+from VisionTool.Attachment_Store import attachment_store
+import asyncio
+import csv
+import json
+import time
+import os
+
+UPLOAD_DIR = Path(os.getenv("UPLOAD_DIR", "./uploads"))
+attachment_store.allow_root(UPLOAD_DIR)
+INGEST_ENABLED = os.getenv("INGEST_ENABLED", "true").lower() == "true"
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "2"))
+INGEST_VISION_PROMPT = os.getenv("INGEST_VISION_PROMPT", "請描述這張圖面的內容，包含零件名稱、材質、尺寸、公差與表面處理等標註")
+INGEST_TEXT_CHARS = int(os.getenv("INGEST_TEXT_CHARS", "20000"))       # 儲存的文字上限
+INGEST_CONTEXT_CHARS = int(os.getenv("INGEST_CONTEXT_CHARS", "1500"))  # 每個檔案放進對話的摘要上限
+
+ANALYSIS_DIR = ".analysis"
+BLOB_ANALYSIS_DIR = UPLOAD_DIR / "blobs" / ANALYSIS_DIR  # 以內容雜湊保存的分析結果，重複上傳時直接沿用
+IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg", ".webp", ".bmp", ".tif", ".tiff"}
+TEXT_SUFFIXES = {".txt", ".md", ".json", ".log", ".xml", ".yaml", ".yml"}
+TABLE_SUFFIXES = {".csv", ".tsv"}
+
+# ==================== 擷取函數（於 process pool 執行） ====================
+
+def extract_pdf(path: str, max_chars: int) -> Dict[str, Any]:
+    """PDF 文字與表格擷取"""
+    import fitz  # PyMuPDF
+
+    text_parts, tables = [], []
+    with fitz.open(path) as doc:
+        page_count = doc.page_count
+        for page in doc:
+            text_parts.append(page.get_text())
+            if hasattr(page, "find_tables"):
+                for table in page.find_tables().tables:
+                    rows = table.extract()
+                    tables.append({
+                        "page": page.number + 1,
+                        "rows": len(rows),
+                        "columns": len(rows[0]) if rows else 0,
+                        "preview": rows[:5],
+                    })
+    text = "\n".join(text_parts).strip()
+    return {"page_count": page_count, "text": text[:max_chars], "text_chars": len(text), "tables": tables}
+
+def extract_table_file(path: str, max_chars: int) -> Dict[str, Any]:
+    """CSV / TSV 表格偵測"""
+    with open(path, "r", encoding="utf-8-sig", errors="replace") as f:
+        text = f.read()
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=",\t;")
+    except csv.Error:
+        dialect = csv.excel_tab if path.lower().endswith(".tsv") else csv.excel
+    rows = list(csv.reader(text.splitlines(), dialect))
+    table = {
+        "rows": len(rows),
+        "columns": max((len(r) for r in rows), default=0),
+        "header": rows[0] if rows else [],
+        "preview": rows[:5],
+    }
+    return {"text": text[:max_chars], "text_chars": len(text), "tables": [table]}
+
+def extract_excel(path: str, max_chars: int) -> Dict[str, Any]:
+    """Excel 工作表擷取（需要 openpyxl）"""
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        return {"tables": [], "warning": "openpyxl 未安裝，略過 Excel 擷取"}
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    tables, lines = [], []
+    for sheet in workbook.worksheets:
+        rows = [["" if v is None else str(v) for v in row] for row in sheet.iter_rows(values_only=True)]
+        rows = [r for r in rows if any(r)]
+        tables.append({
+            "sheet": sheet.title,
+            "rows": len(rows),
+            "columns": max((len(r) for r in rows), default=0),
+            "header": rows[0] if rows else [],
+            "preview": rows[:5],
+        })
+        lines.extend(",".join(r) for r in rows)
+    workbook.close()
+    text = "\n".join(lines)
+    return {"text": text[:max_chars], "text_chars": len(text), "tables": tables}
+
+def extract_text_file(path: str, max_chars: int) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        text = f.read(max_chars + 1)
+    return {"text": text[:max_chars], "truncated": len(text) > max_chars, "tables": []}
+
+# ==================== 背景分析 ====================
+
+class FileIngestor:
+    """上傳檔案的背景預分析 - 視覺描述、文字擷取、表格偵測，結果存為檔案旁的 JSON"""
+
+    def __init__(self, upload_dir: Path = UPLOAD_DIR, concurrency: int = INGEST_CONCURRENCY):
+        self.upload_dir = upload_dir
+        self.concurrency = concurrency
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._tasks = set()
+
+    def result_path(self, conversation_id: int, filename: str) -> Path:
+        return self.upload_dir / str(conversation_id) / ANALYSIS_DIR / f"{filename}.json"
+
+    def write_result(self, conversation_id: int, filename: str, result: Dict[str, Any]):
+        path = self.result_path(conversation_id, filename)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        result["updated_at"] = datetime.now().isoformat()
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(result, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(path)
+
+    def get_status(self, conversation_id: int, filename: str) -> Optional[Dict[str, Any]]:
+        path = self.result_path(conversation_id, filename)
+        if not path.exists():
+            return None
+        return json.loads(path.read_text(encoding="utf-8"))
+
+    def list_results(self, conversation_id: int) -> List[Dict[str, Any]]:
+        folder = self.upload_dir / str(conversation_id) / ANALYSIS_DIR
+        if not folder.exists():
+            return []
+        results = []
+        for path in sorted(folder.glob("*.json")):
+            try:
+                results.append(json.loads(path.read_text(encoding="utf-8")))
+            except (OSError, ValueError):
+                continue
+        return results
+
+    def remove(self, conversation_id: int, filename: str):
+        self.result_path(conversation_id, filename).unlink(missing_ok=True)
+
+    def load_blob_result(self, sha256: Optional[str]) -> Optional[Dict[str, Any]]:
+        """相同內容已分析完成時回傳先前的結果"""
+        if not sha256:
+            return None
+        path = BLOB_ANALYSIS_DIR / f"{sha256}.json"
+        try:
+            result = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        return result if result.get("status") == "done" else None
+
+    def save_blob_result(self, sha256: str, result: Dict[str, Any]):
+        BLOB_ANALYSIS_DIR.mkdir(parents=True, exist_ok=True)
+        path = BLOB_ANALYSIS_DIR / f"{sha256}.json"
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(result, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(path)
+
+    def remove_blob_result(self, sha256: str):
+        (BLOB_ANALYSIS_DIR / f"{sha256}.json").unlink(missing_ok=True)
+
+    def submit(self, conversation_id: int, file_path: Path, original_name: str = None,
+               filename: str = None, sha256: str = None) -> Optional[asyncio.Task]:
+        """
+        排入背景分析（需在 event loop 中呼叫）
+        Args:
+            conversation_id: 對話編號
+            file_path: 實際檔案路徑（blob 或舊版對話資料夾內的檔案）
+            original_name: 原始檔名（決定檔案類型）
+            filename: 對話內的檔名，預設為 file_path.name
+            sha256: 內容雜湊，相同內容已分析過時直接沿用結果
+        """
+        if not INGEST_ENABLED:
+            return None
+        filename = filename or file_path.name
+        self.write_result(conversation_id, filename, {
+            "status": "queued",
+            "filename": filename,
+            "original_name": original_name or filename,
+        })
+        task = asyncio.create_task(self.process(conversation_id, file_path, original_name, filename, sha256))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def process(self, conversation_id: int, file_path: Path, original_name: str = None,
+                      filename: str = None, sha256: str = None) -> Dict[str, Any]:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(max(1, self.concurrency))
+
+        filename = filename or file_path.name
+        original_name = original_name or filename
+        identity = {"filename": filename, "original_name": original_name}
+
+        cached = await asyncio.to_thread(self.load_blob_result, sha256)
+        if cached is not None:
+            result = {**cached, **identity, "reused": True}
+            self.write_result(conversation_id, filename, result)
+            print(f"✓ Ingested [Conv-{conversation_id}] {filename}: reused")
+            return result
+
+        result: Dict[str, Any] = {"status": "processing", **identity, "timings_ms": {}}
+        async with self._semaphore:
+            self.write_result(conversation_id, filename, result)
+            start = time.perf_counter()
+            try:
+                result.update(await self.analyze(file_path, result["timings_ms"], original_name))
+                result["status"] = "done"
+            except Exception as e:
+                result["status"] = "failed"
+                result["error"] = str(e)
+            result["timings_ms"]["total"] = round((time.perf_counter() - start) * 1000, 1)
+            self.write_result(conversation_id, filename, result)
+            if sha256 and result["status"] == "done":
+                self.save_blob_result(sha256, result)
+        print(f"✓ Ingested [Conv-{conversation_id}] {filename}: {result['status']} ({result['timings_ms']['total']} ms)")
+        return result
+
+    async def analyze(self, file_path: Path, timings: Dict[str, float], name: str = None) -> Dict[str, Any]:
+        # blob 沒有副檔名，檔案類型以原始檔名判斷
+        suffix = Path(name or file_path.name).suffix.lower()
+        loop = asyncio.get_running_loop()
+        output: Dict[str, Any] = {"kind": "other"}
+
+        async def timed(name, coro):
+            step_start = time.perf_counter()
+            try:
+                return await coro
+            finally:
+                timings[name] = round((time.perf_counter() - step_start) * 1000, 1)
+
+        if suffix in IMAGE_SUFFIXES:
+            output["kind"] = "image"
+            output["attachment_id"] = attachment_store.register(str(file_path), name)["attachment_id"]
+            output["vision"] = await timed("vision", analyze_image(INGEST_VISION_PROMPT, str(file_path), on_delta=lambda _: None))
+        elif suffix == ".pdf":
+            output["kind"] = "pdf"
+            output["attachment_id"] = attachment_store.register(str(file_path), name)["attachment_id"]
+            output.update(await timed("text", loop.run_in_executor(get_pool(), extract_pdf, str(file_path), INGEST_TEXT_CHARS)))
+            if not output.get("text"):
+                # 沒有文字層（掃描圖面）時改用視覺分析
+                document = await timed("vision", analyze_document(INGEST_VISION_PROMPT, str(file_path)))
+                output["vision"] = document["summary"]
+        elif suffix in TABLE_SUFFIXES:
+            output["kind"] = "table"
+            output.update(await timed("tables", loop.run_in_executor(get_pool(), extract_table_file, str(file_path), INGEST_TEXT_CHARS)))
+        elif suffix in (".xlsx", ".xlsm"):
+            output["kind"] = "spreadsheet"
+            output.update(await timed("tables", loop.run_in_executor(get_pool(), extract_excel, str(file_path), INGEST_TEXT_CHARS)))
+        elif suffix in TEXT_SUFFIXES:
+            output["kind"] = "text"
+            output.update(await timed("text", asyncio.to_thread(extract_text_file, str(file_path), INGEST_TEXT_CHARS)))
+        return output
+
+    def build_context(self, conversation_id: int) -> List[Dict[str, str]]:
+        """將已完成的預分析結果整理成一則 system 訊息，供對話回合直接使用"""
+        lines = []
+        for result in self.list_results(conversation_id):
+            if result.get("status") != "done":
+                continue
+            parts = [f"- {result.get('original_name')} (檔名 {result.get('filename')}, 類型 {result.get('kind')}"
+                     + (f", 附件 ID {result['attachment_id']}" if result.get("attachment_id") else "") + ")"]
+            if result.get("vision"):
+                parts.append(f"  視覺描述: {result['vision'][:INGEST_CONTEXT_CHARS]}")
+            for table in result.get("tables", [])[:3]:
+                parts.append(f"  表格: {table.get('rows')} 列 x {table.get('columns')} 欄, 標題 {table.get('header')}")
+            if result.get("text") and not result.get("vision"):
+                parts.append(f"  文字內容: {result['text'][:INGEST_CONTEXT_CHARS]}")
+            lines.append("\n".join(parts))
+
+        if not lines:
+            return []
+        return [{"role": "system", "content": "使用者已上傳的檔案（預先分析結果）：\n" + "\n".join(lines)}]
+
+file_ingestor = FileIngestor()
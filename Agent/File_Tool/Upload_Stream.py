@@ -0,0 +1,71 @@
+from typing import Any, Dict, Optional
+from pathlib import Path
+import aiofiles
+import aiofiles.os
+import hashlib
+import os
+
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+UPLOAD_MAX_FILE_BYTES = int(os.getenv("UPLOAD_MAX_FILE_BYTES", str(100 * 1024 * 1024)))
+UPLOAD_MAX_CONVERSATION_BYTES = int(os.getenv("UPLOAD_MAX_CONVERSATION_BYTES", str(1024 * 1024 * 1024)))
+PARTIAL_SUFFIX = ".part"
+
+class UploadTooLargeError(Exception):
+    """上傳超過單檔或對話容量上限"""
+
+def conversation_usage(conv_dir: Path) -> int:
+    """計算對話資料夾已使用的容量（不含分析結果與未完成的上傳）"""
+    if not conv_dir.exists():
+        return 0
+    return sum(
+        entry.stat().st_size for entry in os.scandir(conv_dir)
+        if entry.is_file() and not entry.name.endswith(PARTIAL_SUFFIX)
+    )
+
+def upload_limit(used_bytes: int, declared_size: Optional[int] = None) -> int:
+    """
+    計算本次上傳可寫入的最大位元組數，已知大小時提前拒絕
+    Args:
+        used_bytes: 對話已使用的容量
+        declared_size: 請求宣告的大小（可為 None）
+    """
+    remaining = UPLOAD_MAX_CONVERSATION_BYTES - used_bytes
+    limit = min(UPLOAD_MAX_FILE_BYTES, remaining)
+    if limit <= 0:
+        raise UploadTooLargeError("對話檔案容量已滿")
+    if declared_size is not None and declared_size > limit:
+        raise UploadTooLargeError(f"檔案過大（上限 {limit} bytes）")
+    return limit
+
+async def save_upload_stream(upload, dest: Path, max_bytes: int) -> Dict[str, Any]:
+    """
+    以固定大小區塊將上傳內容串流寫入磁碟，同時計算 SHA-256
+    Args:
+        upload: FastAPI UploadFile
+        dest: 目的路徑（先寫入 .part，完成後才改名）
+        max_bytes: 寫入上限，超過時中止並刪除暫存檔
+    Returns:
+        {"size": ..., "sha256": ...}
+    """
+    partial = dest.with_name(dest.name + PARTIAL_SUFFIX)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async with aiofiles.open(partial, "wb") as out:
+            while True:
+                chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLargeError(f"檔案過大（上限 {max_bytes} bytes）")
+                digest.update(chunk)
+                await out.write(chunk)
+        await aiofiles.os.replace(partial, dest)
+    except BaseException:
+        try:
+            await aiofiles.os.remove(partial)
+        except FileNotFoundError:
+            pass
+        raise
+    return {"size": size, "sha256": digest.hexdigest()}
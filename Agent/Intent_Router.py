@@ -0,0 +1,437 @@
+from typing import Any, Dict, List, Optional, Tuple
+from collections import Counter
+from pathlib import Path
+from Quote_Tool.Quote_Engine import quote_engine, QuoteError, normalize_key, SHAPE_ALIASES
+from Tracing import span
+import unicodedata
+import threading
+import hashlib
+import json
+import math
+import time
+import re
+import os
+
+INTENT_ROUTER_ENABLED = os.getenv("INTENT_ROUTER_ENABLED", "true").lower() == "true"
+INTENT_MIN_CONFIDENCE = float(os.getenv("INTENT_MIN_CONFIDENCE", "0.85"))   # 分類器信心低於此值一律交給 Agent
+INTENT_TRIVIAL_MAX_CHARS = int(os.getenv("INTENT_TRIVIAL_MAX_CHARS", "16"))  # 超過此長度不視為招呼 / 確認
+INTENT_SMALL_MODEL = os.getenv("INTENT_SMALL_MODEL", "")   # 設定時招呼 / 確認改由小模型回覆（不帶工具），否則使用固定回覆
+INTENT_LOG_FILE = Path(os.getenv("INTENT_LOG_FILE", "logs/intent_router.jsonl"))
+INTENT_LOG_MAX_BYTES = int(os.getenv("INTENT_LOG_MAX_BYTES", str(20 * 1024 * 1024)))  # 超過時輪替為 .1
+INTENT_LOG_TEXT_CHARS = int(os.getenv("INTENT_LOG_TEXT_CHARS", "200"))   # 紀錄中保留的輸入長度（0 表示只記錄雜湊）
+
+TRIVIAL_INTENTS = ("greeting", "thanks", "ack")
+
+# ==================== 規則 ====================
+
+# 整句（去除標點、表情與空白後）完全符合才套用，避免「好的，那陽極要多久」被當成確認
+RULES: List[Tuple[str, "re.Pattern"]] = [
+    ("greeting", re.compile(r"(你好|您好|妳好|哈囉|哈嘍|嗨|安安|早安|午安|晚安|早|大家好|hi|hello|hey|hiya|goodmorning|goodafternoon|goodevening)(呀|啊|喔|唷)?")),
+    ("thanks", re.compile(r"(謝謝|感謝|多謝|謝啦|謝了|感恩|辛苦了|thanks|thankyou|thx|ty)(你|您|妳)?(啦|喔|囉)?")),
+    ("ack", re.compile(r"(好|好的|好喔|好哦|好啊|好滴|ok|okay|okey|k|收到|了解|瞭解|知道了|明白|沒問題|嗯|嗯嗯|可以|行|對|是|gotit|sure|fine|noted)(了|喔|哦|囉|啦)?")),
+]
+_PUNCTUATION = re.compile(r"[\W_]+", re.UNICODE)
+
+# ==================== 分類器訓練資料 ====================
+
+# 內建範例；數字在特徵中統一為 0，因此重量、工時的數值不影響分類
+TRAINING_EXAMPLES: Dict[str, List[str]] = {
+    "greeting": ["你好", "您好", "哈囉", "嗨", "早安", "午安", "晚安", "大家好", "安安", "hi", "hello", "hey",
+                 "hi there", "good morning", "你好啊", "哈囉你好", "嗨嗨", "您好呀"],
+    "thanks": ["謝謝", "謝謝你", "感謝", "多謝", "謝啦", "感恩", "辛苦了", "thanks", "thank you", "thx",
+               "非常感謝", "謝謝幫忙", "感謝協助", "太感謝了", "thanks a lot", "謝謝您"],
+    "ack": ["好", "好的", "OK", "ok", "收到", "了解", "瞭解", "知道了", "沒問題", "嗯", "可以", "好喔", "明白",
+            "got it", "sure", "okay", "好的收到", "了解了", "OK的", "行", "嗯嗯好"],
+    "quote": [
+        "材料 SUS316 圓柱 15kg 銑床 3小時 真空熱處理",
+        "SUS304 板材 10公斤，車床 2 小時，表面處理無",
+        "請幫我估價 材質:SKD11 板材 重量:5kg 設備:CNC銑床 工時:4hr 表面處理:ESD",
+        "估價 A6061 板材 8kg 線切割 6小時 無電解鎳 20件",
+        "材料內容: SUS316 - 圓柱 - 15KG\n設備內容: 銑床 3 小時\n表面處理: 陽極",
+        "S45C 圓棒 12 公斤 車床 1.5 小時 熱處理 數量 5",
+        "幫我報價 SUS304 圓柱 3kg 磨床 2hr 無表面處理",
+        "A7075 板材 2.5kg 銑床 5 小時 陽極 10 pcs",
+        "材質 SKD61 圓柱 重量 20 公斤 設備 放電 工時 8 表面處理 真空熱處理",
+        "估價：SUS316 板材 7kg，CNC銑床 4 小時，ESD，2 件",
+    ],
+    "open": [
+        "SUS316 跟 SUS304 有什麼差別？", "陽極處理的價格怎麼算", "幫我查一下上個月的訂單", "資料庫有哪些資料表",
+        "這張圖片裡面是什麼", "請解釋熱處理的流程", "好的，那陽極處理需要多久？", "你好，我想問銑床的費率",
+        "謝謝，另外板材的價格是多少", "我想估價，要準備哪些資料？", "幫我看一下上傳的圖面", "為什麼報價這麼高",
+        "可以幫我寫一段 SQL 查詢嗎", "板材和圓柱的單價差多少", "真空熱處理適合哪些材料", "幫我估價",
+        "這個零件大概要做幾天", "ESD 是什麼", "請問你們有哪些設備", "上次的報價可以再便宜一點嗎",
+        "what materials do you support", "how is the quote calculated", "explain the difference between rod and plate",
+        "請幫我整理這份文件的重點", "我剛剛上傳的檔案有幾頁", "工時要怎麼估比較準",
+    ],
+}
+
+def normalize_text(text: str) -> str:
+    """統一全形 / 半形、大小寫，數字統一為 0"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    return re.sub(r"\d", "0", " ".join(text.split()))
+
+class IntentClassifier:
+    """
+    字元 n-gram 多項式 Naive Bayes（純 Python，建立時以內建範例訓練，分類約數十微秒）
+    中文沒有空白斷詞，字元 n-gram 不需斷詞器即可涵蓋「估價」「小時」「kg」等特徵
+    """
+
+    def __init__(self, examples: Dict[str, List[str]] = TRAINING_EXAMPLES,
+                 ngram_range: Tuple[int, int] = (1, 3), alpha: float = 0.5):
+        """
+        Args:
+            examples: {意圖: [範例句, ...]}
+            ngram_range: 字元 n-gram 長度範圍
+            alpha: 加法平滑係數
+        """
+        self.ngram_range = ngram_range
+        self.alpha = alpha
+        total = sum(len(texts) for texts in examples.values())
+        self.labels = list(examples)
+        self.log_priors: Dict[str, float] = {}
+        self.counts: Dict[str, Counter] = {}
+        self.totals: Dict[str, int] = {}
+        vocabulary = set()
+        for label, texts in examples.items():
+            counts = Counter()
+            for text in texts:
+                counts.update(self.features(text))
+            self.counts[label] = counts
+            self.totals[label] = sum(counts.values())
+            self.log_priors[label] = math.log(len(texts) / total)
+            vocabulary.update(counts)
+        self.vocabulary_size = len(vocabulary)
+
+    def features(self, text: str) -> List[str]:
+        text = f"^{normalize_text(text)}$"   # 加上邊界，讓「好」與「好的，那…」中的「好」區分開來
+        low, high = self.ngram_range
+        return [text[i:i + n] for n in range(low, high + 1) for i in range(len(text) - n + 1)]
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        """
+        Returns:
+            (意圖, 機率)
+        """
+        features = self.features(text)
+        scores = {}
+        for label in self.labels:
+            counts, denominator = self.counts[label], self.totals[label] + self.alpha * (self.vocabulary_size + 1)
+            scores[label] = self.log_priors[label] + sum(
+                math.log((counts.get(f, 0) + self.alpha) / denominator) for f in features)
+        best = max(scores, key=scores.get)
+        norm = sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, 1 / norm
+
+# ==================== 估價欄位解析 ====================
+
+NUMBER = r"(\d+(?:\.\d+)?)"
+WEIGHT_PATTERN = re.compile(NUMBER + r"\s*(?:kg|公斤|千克)", re.IGNORECASE)
+HOURS_PATTERN = re.compile(NUMBER + r"\s*(?:個\s*)?(?:小時|hrs?\b|h\b)|工時\s*[:：]?\s*" + NUMBER, re.IGNORECASE)
+QUANTITY_PATTERN = re.compile(NUMBER + r"\s*(?:件|pcs\b|個(?!小時)|支|片)|(?:數量|件數|qty)\s*[:：]?\s*" + NUMBER, re.IGNORECASE)
+# 「無」之後必須是分隔符號或結尾，避免把「表面處理:無電解鎳」當成不做表面處理
+NO_SURFACE_PATTERN = re.compile(r"表面處[理裡]\s*[:：]?\s*(?:無|不需要?|不用|none)(?=$|[\s,，。.;；、/)）])"
+                                r"|(?:無|不需要?|不用|不做)\s*表面處[理裡]", re.IGNORECASE)
+# 否定詞緊接在表面處理名稱前（「不要熱處理」「不需要陽極」）時無法判斷要做哪一種，交給 Agent
+NEGATION = r"(?:不要|不需要?|不用|免|不做|無需|不必)(?:做|作|加)?"
+# 總重 / 總工時 / 合計：quote() 的重量與工時為單件數值，乘上件數會重複計算，交給 Agent
+TOTAL_PATTERN = re.compile(r"總重|總工時|合計|總計")
+# 問句或比較（「SUS304 比較便宜嗎」「板材跟圓柱差多少」）不是要直接算出報價，交給 Agent 回答
+QUESTION_PATTERN = re.compile(r"[?？]|嗎|呢|哪|比較|差")
+SHAPE_WORDS = ("板材", "圓柱", *SHAPE_ALIASES)
+# 價格表名稱沒有出現在輸入中時（例如價格表為「CNC銑床」、使用者只說「銑床」），交給 quote() 的部分名稱比對
+EQUIPMENT_WORDS = ("銑床", "車床", "磨床", "線切割", "放電", "鑽床")
+
+def _first_number(match: Optional["re.Match"]) -> Optional[float]:
+    if match is None:
+        return None
+    return float(next(group for group in match.groups() if group is not None))
+
+def _find_names(text_key: str, names: List[str]) -> List[str]:
+    """
+    在正規化後的輸入中找出出現的項目名稱（依長度由長到短）
+    被其他符合名稱包含的不另外計算，例如同時符合 CNC銑床 與 銑床 時只算 CNC銑床
+    """
+    found: List[str] = []
+    for name in sorted(names, key=lambda n: len(normalize_key(n)), reverse=True):
+        key = normalize_key(name)
+        if key and key in text_key and not any(key in normalize_key(other) for other in found):
+            found.append(name)
+    return found
+
+def parse_quote(text: str, catalog: Dict[str, List[str]]) -> Tuple[Dict[str, Any], List[str], List[str]]:
+    """
+    從單一訊息解析估價參數（只接受價格表中存在的材料、設備與表面處理名稱）
+    Args:
+        text: 使用者輸入
+        catalog: quote_engine.catalog() 的結果
+    Returns:
+        (quote() 參數, 缺少的欄位, 出現多個不同項目的欄位)
+    """
+    text_key = normalize_key(text)
+    # 材料名稱在價格表中為「SUS316 圓柱」形式，比對時只取材料部分
+    materials = {name.split()[0] for name in catalog["materials"]}
+    found = {
+        "material": _find_names(text_key, list(materials)),
+        "shape": _find_names(text_key, ["板材", "圓柱"]),
+        # 價格表名稱優先（CNC銑床），只提到通用名稱（銑床）時交給 quote() 的部分名稱比對
+        "equipment": _find_names(text_key, [*catalog["equipment"], *EQUIPMENT_WORDS]),
+        # 先比對價格表名稱；同時出現名稱與「無表面處理」時視為不明確
+        "surface_treatment": _find_names(text_key, catalog["surface_treatments"]) + (["無"] if NO_SURFACE_PATTERN.search(text) else []),
+    }
+    fields: Dict[str, Any] = {
+        "material": found["material"][0] if found["material"] else None,
+        "shape": next((word for word in SHAPE_WORDS if normalize_key(word) in text_key), ""),
+        "weight_kg": _first_number(WEIGHT_PATTERN.search(text)),
+        "equipment": found["equipment"][0] if found["equipment"] else None,
+        "hours": _first_number(HOURS_PATTERN.search(text)),
+        "surface_treatment": found["surface_treatment"][0] if found["surface_treatment"] else None,
+    }
+    quantity = _first_number(QUANTITY_PATTERN.search(text))
+    fields["quantity"] = 1 if quantity is None else int(quantity)
+
+    missing = [field for field in ("material", "weight_kg", "equipment", "hours", "surface_treatment") if not fields[field]]
+    if fields["quantity"] < 1:
+        missing.append("quantity")
+    ambiguous = [field for field, names in found.items() if len(names) > 1]
+    return fields, missing, ambiguous
+
+def unsafe_quote_reason(text: str, catalog: Dict[str, List[str]]) -> Optional[str]:
+    """
+    不適合直接計算報價的訊息（問句、總量描述、否定某項表面處理），回傳交給 Agent 的原因
+    Returns:
+        question / total_values / negated_treatment；可直接計算時回傳 None
+    """
+    if QUESTION_PATTERN.search(text):
+        return "question"
+    if TOTAL_PATTERN.search(text):
+        return "total_values"
+    text_key = normalize_key(text)
+    for name in catalog["surface_treatments"]:
+        if re.search(NEGATION + re.escape(normalize_key(name)), text_key):
+            return "negated_treatment"
+    return None
+
+def format_quote(result: Dict[str, Any]) -> str:
+    """將 quote() 結果整理為回覆文字（格式與 Agent 整理 Quote_Tool 結果時相同：明細 + 總價 + <3）"""
+    lines = [f"估價明細（{result['quantity']} 件）："]
+    for item in result["items"]:
+        lines.append(f"- {item['item']} {item['name']}：{item['unit_price']:g} x {item['quantity']:g} {item['unit']} = {item['amount']:,.2f}")
+    lines.append(f"總價：{result['total']:,.2f} {result['currency']} <3")
+    return "\n".join(lines)
+
+# ==================== 固定回覆 ====================
+
+CANNED_REPLIES = {
+    "greeting": ("你好！請問需要什麼協助？ <3", "Hi! How can I help you? <3"),
+    "thanks": ("不客氣，有需要隨時告訴我 <3", "You're welcome! <3"),
+    "ack": ("好的，還有其他需要協助的地方嗎？ <3", "Sure, anything else I can help with? <3"),
+}
+
+def canned_reply(intent: str, text: str) -> str:
+    chinese, english = CANNED_REPLIES[intent]
+    return english if text.isascii() else chinese
+
+# ==================== 路由 ====================
+
+class RouteDecision:
+    """單一訊息的路由結果"""
+
+    def __init__(self, intent: str, confidence: float, source: str, route: str = "agent",
+                 reply: Optional[str] = None, reason: Optional[str] = None, details: Optional[Dict[str, Any]] = None):
+        """
+        Args:
+            intent: greeting / thanks / ack / quote / open
+            confidence: 規則為 1.0，否則為分類器機率
+            source: rule / classifier / disabled
+            route: canned（固定回覆）/ small_model（小模型）/ quote（直接估價）/ agent（完整 Agent）
+            reply: canned / quote 路由的回覆內容
+            reason: 未走捷徑的原因（紀錄用，例如 low_confidence / incomplete_quote）
+            details: 估價參數等補充資訊
+        """
+        self.intent = intent
+        self.confidence = confidence
+        self.source = source
+        self.route = route
+        self.reply = reply
+        self.reason = reason
+        self.details = details or {}
+        self.classify_ms = 0.0
+
+    def fallback(self, reason: str) -> "RouteDecision":
+        """改交給完整 Agent"""
+        self.route, self.reply, self.reason = "agent", None, reason
+        return self
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "intent": self.intent,
+            "confidence": round(self.confidence, 4),
+            "source": self.source,
+            "route": self.route,
+            "reason": self.reason,
+            "classify_ms": self.classify_ms,
+            **({"details": self.details} if self.details else {}),
+        }
+
+class IntentRouter:
+    """
+    執行 Agent 前的意圖路由
+    - 規則（整句招呼 / 道謝 / 確認）優先，其餘由字元 n-gram Naive Bayes 分類
+    - 招呼、道謝、確認：固定回覆（或 INTENT_SMALL_MODEL 指定的小模型），不經過大模型與工具
+    - 欄位齊全的估價：直接呼叫 quote_engine 計算；欄位不齊、數量為 0、問句或同時提到多個項目、
+      名稱對不上價格表時交給 Agent
+    - 其餘（開放式問題、信心不足）：完整 Agent
+    - 每次決策寫入 INTENT_LOG_FILE（JSONL），用於調整規則、範例與信心門檻
+    """
+
+    def __init__(self, classifier: Optional[IntentClassifier] = None, min_confidence: float = INTENT_MIN_CONFIDENCE,
+                 small_model: str = INTENT_SMALL_MODEL, log_file: Path = INTENT_LOG_FILE):
+        """
+        Args:
+            classifier: 意圖分類器（預設以內建範例訓練）
+            min_confidence: 分類器信心門檻
+            small_model: 招呼 / 確認使用的小模型（空字串表示使用固定回覆）
+            log_file: 決策紀錄檔
+        """
+        self.classifier = classifier or IntentClassifier()
+        self.min_confidence = min_confidence
+        self.small_model = small_model
+        self.log_file = log_file
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self.routes: Dict[Tuple[str, str], int] = {}   # (意圖, 路由) -> 次數
+        self.reasons: Dict[str, int] = {}              # 未走捷徑的原因 -> 次數
+        self.classify_ms = 0.0
+
+    def classify(self, text: str) -> Tuple[str, float, str]:
+        """
+        Returns:
+            (意圖, 信心, 來源)
+        """
+        compact = _PUNCTUATION.sub("", unicodedata.normalize("NFKC", text).lower())
+        for intent, pattern in RULES:
+            if pattern.fullmatch(compact):
+                return intent, 1.0, "rule"
+        intent, confidence = self.classifier.predict(text)
+        return intent, confidence, "classifier"
+
+    def route(self, text: str) -> RouteDecision:
+        """決定訊息的處理方式（純計算；估價只使用已載入的價格表，不連線資料庫）"""
+        start = time.perf_counter()
+        with span("intent.route", root=False) as current:
+            decision = self._route(text)
+            decision.classify_ms = round((time.perf_counter() - start) * 1000, 3)
+            current.set(intent=decision.intent, confidence=round(decision.confidence, 4), route=decision.route)
+        return decision
+
+    def _route(self, text: str) -> RouteDecision:
+        if not INTENT_ROUTER_ENABLED:
+            return RouteDecision("open", 0.0, "disabled", reason="disabled")
+
+        intent, confidence, source = self.classify(text)
+        decision = RouteDecision(intent, confidence, source)
+        if confidence < self.min_confidence:
+            return decision.fallback("low_confidence")
+
+        if intent in TRIVIAL_INTENTS:
+            if len(text.strip()) > INTENT_TRIVIAL_MAX_CHARS:
+                return decision.fallback("too_long")
+            if self.small_model:
+                decision.route = "small_model"
+            else:
+                decision.route, decision.reply = "canned", canned_reply(intent, text)
+            return decision
+
+        if intent == "quote":
+            if quote_engine.snapshot is None:
+                return decision.fallback("prices_not_loaded")
+            if quote_engine.snapshot.empty:
+                return decision.fallback("prices_empty")
+            catalog = quote_engine.catalog()
+            reason = unsafe_quote_reason(text, catalog)
+            if reason:
+                return decision.fallback(reason)
+            fields, missing, ambiguous = parse_quote(text, catalog)
+            decision.details = {"fields": fields, "missing": missing, "ambiguous": ambiguous}
+            if ambiguous:
+                # 同時提到多種材料 / 設備 / 表面處理（例如比較兩種材料），由 Agent 確認
+                return decision.fallback("ambiguous_quote")
+            if missing:
+                return decision.fallback("incomplete_quote")
+            try:
+                result = quote_engine.quote(**fields)
+            except QuoteError as e:
+                # 名稱對不上價格表：交給 Agent 依候選項目向使用者確認
+                decision.details["error"] = str(e)
+                return decision.fallback("quote_error")
+            decision.details["total"] = result["total"]
+            decision.route, decision.reply = "quote", format_quote(result)
+            return decision
+
+        return decision
+
+    def confirm(self, decision: RouteDecision, history: List[Dict[str, Any]]) -> RouteDecision:
+        """
+        以對話歷史確認捷徑是否適用
+        上一則助理訊息是提問時，「好」「可以」是在回答問題，需交給 Agent 繼續處理
+        """
+        if decision.intent != "ack" or decision.route == "agent":
+            return decision
+        last = next((m.get("content") or "" for m in reversed(history) if m.get("role") == "assistant"), "")
+        if isinstance(last, str) and last.replace("<3", "").rstrip().endswith(("?", "？")):
+            return decision.fallback("answers_question")
+        return decision
+
+    def record(self, text: str, decision: RouteDecision, conversation_id: Optional[int] = None,
+               user_id: Optional[int] = None, status: str = "ok", wall_ms: Optional[float] = None):
+        """統計並寫入一次路由決策（在執行緒中呼叫，寫檔失敗不影響回應）"""
+        with self._lock:
+            key = (decision.intent, decision.route)
+            self.routes[key] = self.routes.get(key, 0) + 1
+            if decision.reason:
+                self.reasons[decision.reason] = self.reasons.get(decision.reason, 0) + 1
+            self.classify_ms += decision.classify_ms
+
+        entry = {
+            "timestamp": time.time(),
+            "conversation_id": conversation_id,
+            "user_id": user_id,
+            "text_sha1": hashlib.sha1(text.encode("utf-8")).hexdigest()[:12],
+            "text": text[:INTENT_LOG_TEXT_CHARS] if INTENT_LOG_TEXT_CHARS > 0 else None,
+            "length": len(text),
+            **decision.to_dict(),
+            "status": status,
+            "wall_ms": wall_ms,
+        }
+        try:
+            with self._write_lock:
+                self.log_file.parent.mkdir(parents=True, exist_ok=True)
+                if self.log_file.exists() and self.log_file.stat().st_size > INTENT_LOG_MAX_BYTES:
+                    self.log_file.replace(self.log_file.with_suffix(self.log_file.suffix + ".1"))
+                with open(self.log_file, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+        except OSError as e:
+            print(f"✗ 寫入意圖路由紀錄失敗: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            routes = dict(self.routes)
+            reasons = dict(self.reasons)
+            classify_ms = self.classify_ms
+        total = sum(routes.values())
+        shortcut = sum(count for (_, route), count in routes.items() if route != "agent")
+        return {
+            "enabled": INTENT_ROUTER_ENABLED,
+            "min_confidence": self.min_confidence,
+            "small_model": self.small_model or None,
+            "decisions": total,
+            "shortcut": shortcut,
+            "shortcut_ratio": round(shortcut / total, 4) if total else None,
+            "avg_classify_ms": round(classify_ms / total, 3) if total else None,
+            "routes": [{"intent": intent, "route": route, "count": count}
+                       for (intent, route), count in sorted(routes.items(), key=lambda item: -item[1])],
+            "fallback_reasons": reasons,
+            "log_file": str(self.log_file),
+        }
+
+intent_router = IntentRouter()
@@ -0,0 +1,88 @@
+from typing import Any, Dict
+from Job_Tool.Job_Worker import JobContext, JobWorkerPool
+from Quote_Tool.Batch_Quote import batch_quote_stream
+from VisionTool.Document_Pipeline import analyze_document
+from File_Tool.Ingestion import file_ingestor, UPLOAD_DIR
+from File_Tool.Blob_Store import blob_path, blob_exists, resolve_source
+from Sql_Tool.File_Index import FileIndexManager
+import asyncio
+
+# ==================== 輸入檢查 ====================
+
+def document_source(ref: str) -> str:
+    """vision_document 的文件來源只接受 blob 的 SHA-256 或附件 ID（不接受伺服器路徑）"""
+    return resolve_source(ref, allow_paths=False)
+
+def validate_payload(job_type: str, payload: Dict[str, Any]):
+    """提交時檢查 payload（錯誤時拋出 ValueError / FileNotFoundError）"""
+    if job_type == "vision_document":
+        if not payload.get("prompt"):
+            raise ValueError("缺少 prompt")
+        document_source(payload.get("path"))
+
+# ==================== 工作處理函數 ====================
+# 處理函數會在 worker 中執行，可能因重試而執行多次，須可安全重複執行
+
+async def vision_document_job(payload: Dict[str, Any], ctx: JobContext) -> Dict[str, Any]:
+    """
+    整份圖面視覺分析
+    payload: {"prompt", "path"（檔案 SHA-256 或附件 ID）, "concurrency"?}
+    """
+    source = await asyncio.to_thread(document_source, payload["path"])
+    done = 0
+
+    async def on_page(_text: str):
+        nonlocal done
+        done += 1
+        ctx.progress(message=f"已完成 {done} 頁")
+
+    return await analyze_document(payload["prompt"], source, payload.get("concurrency"), on_delta=on_page)
+
+async def batch_quote_job(payload: Dict[str, Any], ctx: JobContext) -> Dict[str, Any]:
+    """
+    批次估價
+    payload: {"parts": [...], "concurrency"?}
+    """
+    parts = payload["parts"]
+    results, summary = [], None
+    async for result in batch_quote_stream(parts, payload.get("concurrency")):
+        if "summary" in result:
+            summary = result["summary"]
+            continue
+        results.append(result)
+        ctx.progress(len(results) / max(1, len(parts)), f"{len(results)}/{len(parts)}")
+    results.sort(key=lambda r: r.get("index", 0))
+    return {"results": results, "summary": summary}
+
+async def file_ingest_job(payload: Dict[str, Any], ctx: JobContext) -> Dict[str, Any]:
+    """
+    重新執行附件預分析
+    payload: {"conversation_id", "filename"}
+    """
+    conversation_id, filename = int(payload["conversation_id"]), payload["filename"]
+    record = await asyncio.to_thread(FileIndexManager().get_file, conversation_id, filename)
+    sha256 = record.get("sha256") if record else None
+    if sha256 and blob_exists(sha256):
+        file_path = blob_path(sha256)
+    else:
+        file_path = UPLOAD_DIR / str(conversation_id) / filename
+    if not file_path.is_file():
+        raise FileNotFoundError(f"找不到檔案：{filename}")
+
+    ctx.progress(message="分析中")
+    result = await file_ingestor.process(
+        conversation_id, file_path, record["original_name"] if record else filename, filename, sha256
+    )
+    if result["status"] != "done":
+        raise RuntimeError(result.get("error") or "預分析失敗")
+    return result
+
+DEFAULT_HANDLERS = {
+    "vision_document": vision_document_job,
+    "batch_quote": batch_quote_job,
+    "file_ingest": file_ingest_job,
+}
+
+def register_default_handlers(pool: JobWorkerPool):
+    for job_type, handler in DEFAULT_HANDLERS.items():
+        pool.register(job_type, handler)
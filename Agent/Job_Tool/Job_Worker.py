@@ -0,0 +1,145 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from Sql_Tool.Job_Queue import JobQueueManager
+import asyncio
+import socket
+import time
+import uuid
+import os
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "120"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "2"))
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "5"))
+JOB_RETRY_BASE_SECONDS = int(os.getenv("JOB_RETRY_BASE_SECONDS", "10"))
+JOB_RETRY_MAX_SECONDS = int(os.getenv("JOB_RETRY_MAX_SECONDS", "600"))
+
+class JobContext:
+    """提供給處理函數的執行資訊與進度回報"""
+
+    def __init__(self, job: Dict[str, Any]):
+        self.job_id: int = job["id"]
+        self.job_type: str = job["job_type"]
+        self.attempt: int = job["attempts"]
+        self.progress_value: Optional[float] = None
+        self.progress_message: Optional[str] = None
+
+    def progress(self, fraction: Optional[float] = None, message: Optional[str] = None):
+        """更新進度（0~1），由心跳定期寫回資料庫"""
+        if fraction is not None:
+            self.progress_value = max(0.0, min(1.0, float(fraction)))
+        if message is not None:
+            self.progress_message = message
+
+JobHandler = Callable[[Dict[str, Any], JobContext], Awaitable[Any]]
+
+def retry_delay(attempt: int) -> int:
+    """指數退避：10s, 20s, 40s ... 上限 JOB_RETRY_MAX_SECONDS"""
+    return min(JOB_RETRY_MAX_SECONDS, JOB_RETRY_BASE_SECONDS * 2 ** max(0, attempt - 1))
+
+class JobWorkerPool:
+    """
+    asyncio 背景 worker 池
+    - 由資料庫領取工作（租約制），行程重啟或當機後，租約到期的工作會被重新領取
+    - 執行期間定期心跳延長租約並寫回進度；工作被取消時中止處理函數
+    """
+
+    def __init__(self, queue: JobQueueManager, workers: int = JOB_WORKERS,
+                 lease_seconds: int = JOB_LEASE_SECONDS, poll_seconds: float = JOB_POLL_SECONDS):
+        self.queue = queue
+        self.workers = max(1, workers)
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.handlers: Dict[str, JobHandler] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._running: Dict[int, JobContext] = {}
+        self._stopping = False
+
+    def register(self, job_type: str, handler: JobHandler):
+        self.handlers[job_type] = handler
+
+    def notify(self):
+        """有新工作時喚醒閒置的 worker（不必等到下次輪詢）"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def start(self):
+        if self._tasks:
+            return
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker_loop(i)) for i in range(self.workers)]
+        print(f"✓ 背景工作 worker 已啟動: {self.worker_id} x {self.workers}")
+
+    async def stop(self):
+        """停止所有 worker；執行中的工作不標記失敗，租約到期後由下一個行程接手"""
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "worker_id": self.worker_id,
+            "workers": self.workers,
+            "handlers": sorted(self.handlers),
+            "running": [{"job_id": c.job_id, "job_type": c.job_type, "progress": c.progress_value}
+                        for c in self._running.values()],
+        }
+
+    async def _worker_loop(self, index: int):
+        while True:
+            job = await asyncio.to_thread(self.queue.claim, self.worker_id, self.lease_seconds, list(self.handlers))
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run_job(job)
+
+    async def _run_job(self, job: Dict[str, Any]):
+        ctx = JobContext(job)
+        handler = self.handlers.get(job["job_type"])
+        start = time.perf_counter()
+
+        if job["attempts"] > job["max_attempts"]:
+            # 租約過期後重新領取，但已超過嘗試次數
+            await asyncio.to_thread(self.queue.fail, ctx.job_id, self.worker_id, "超過最大嘗試次數", 0)
+            return
+
+        self._running[ctx.job_id] = ctx
+        work = asyncio.create_task(handler(job["payload"], ctx))
+        beat = asyncio.create_task(self._heartbeat(ctx, work))
+        try:
+            result = await work
+            await asyncio.to_thread(self.queue.complete, ctx.job_id, self.worker_id, result)
+            print(f"✓ Job {ctx.job_id} ({ctx.job_type}) succeeded in {time.perf_counter() - start:.1f}s")
+        except asyncio.CancelledError:
+            if self._stopping:
+                raise
+            print(f"✗ Job {ctx.job_id} ({ctx.job_type}) cancelled")
+        except Exception as e:
+            status = await asyncio.to_thread(
+                self.queue.fail, ctx.job_id, self.worker_id, f"{type(e).__name__}: {e}", retry_delay(ctx.attempt)
+            )
+            print(f"✗ Job {ctx.job_id} ({ctx.job_type}) attempt {ctx.attempt} failed: {e} -> {status}")
+        finally:
+            beat.cancel()
+            work.cancel()
+            self._running.pop(ctx.job_id, None)
+
+    async def _heartbeat(self, ctx: JobContext, work: asyncio.Task):
+        interval = max(1.0, min(self.lease_seconds / 3, JOB_HEARTBEAT_SECONDS))
+        while not work.done():
+            await asyncio.sleep(interval)
+            alive = await asyncio.to_thread(
+                self.queue.heartbeat, ctx.job_id, self.worker_id, self.lease_seconds,
+                ctx.progress_value, ctx.progress_message
+            )
+            if not alive:
+                work.cancel()
+                return
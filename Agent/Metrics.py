@@ -0,0 +1,264 @@
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from bisect import bisect_left
+from Tracing import add_span_listener
+import threading
+import math
+import time
+import os
+
+# 秒；涵蓋資料庫查詢（毫秒級）到模型推論（分鐘級）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+LabelKey = Tuple[str, ...]
+Sample = Tuple[str, Dict[str, str], float]
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class _Metric:
+    """
+    指標基底類別
+    - 每個指標一把鎖，只在更新單一數值時短暫持有（不同指標之間互不阻擋）
+    - 標籤以位置參數傳入並依定義順序組成 tuple，避免每次更新建立 dict
+    """
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Tuple[Any, ...]) -> LabelKey:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} 需要標籤 {self.labelnames}")
+        return tuple(str(v) for v in labels)
+
+    def _labels(self, key: LabelKey) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+    def samples(self) -> List[Sample]:
+        raise NotImplementedError
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, self._labels(key), value) for key, value in items]
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelKey, float] = {}
+
+    def set(self, value: float, *labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, *labels, amount: float = 1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, self._labels(key), value) for key, value in items]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 每組標籤：[各 bucket 的個數（非累計）..., +Inf 個數, 總和]
+        self._values: Dict[LabelKey, List[float]] = {}
+
+    def observe(self, value: float, *labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            items = [(key, list(counts)) for key, counts in self._values.items()]
+        samples = []
+        for key, counts in items:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts[:-1]):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative))
+            samples.append((f"{self.name}_sum", labels, counts[-1]))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+# 抓取時才計算的指標：collector() -> [(名稱, 類型, 說明, [(標籤, 數值), ...]), ...]
+Collector = Callable[[], List[Tuple[str, str, str, List[Tuple[Dict[str, Any], float]]]]]
+
+class MetricsRegistry:
+    """
+    Prometheus 文字格式的指標登錄（不需額外套件）
+    - 事件型指標（請求數、延遲）於發生時更新
+    - 狀態型指標（快取命中數、backend 延遲）於抓取時由 collector 讀取既有的 stats，不增加請求路徑的負擔
+    - 指標存在各行程的記憶體；UVICORN_WORKERS > 1 時每次抓取只會看到其中一個 worker
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Collector] = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                  buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector: Collector):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """輸出 Prometheus 文字格式（text/plain; version=0.0.4）"""
+        lines: List[str] = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for collector in self._collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                lines.append(f"# collector error: {_escape(e)}")
+                continue
+            for name, kind, documentation, samples in families:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    if value is not None:
+                        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
+
+# ==================== 指標定義 ====================
+
+HTTP_REQUESTS = registry.counter("http_requests_total", "HTTP requests", ("method", "route", "status"))
+HTTP_DURATION = registry.histogram("http_request_duration_seconds", "HTTP request latency", ("method", "route"))
+HTTP_IN_FLIGHT = registry.gauge("http_requests_in_flight", "HTTP requests being processed")
+AGENT_RUNS_IN_FLIGHT = registry.gauge("agent_runs_in_flight", "Agent runs in progress")
+AGENT_RUNS = registry.counter("agent_runs_total", "Finished agent runs", ("model", "status"))
+AGENT_RUN_DURATION = registry.histogram("agent_run_duration_seconds", "Agent run wall time", ("model",))
+AGENT_TOKENS = registry.counter("agent_tokens_total", "Model tokens used by agent runs", ("model", "kind"))
+LLM_DURATION = registry.histogram("llm_call_duration_seconds", "Model call latency (one agent turn)", ("model",))
+TOOL_DURATION = registry.histogram("tool_call_duration_seconds", "Function tool latency", ("tool", "status"))
+RAGFLOW_DURATION = registry.histogram("ragflow_request_duration_seconds", "RAGFlow request latency", ("status",))
+DB_IN_USE = registry.gauge("db_connections_in_use", "Open MSSQL connections (one per DB manager call)")
+DB_DURATION = registry.histogram("db_operation_duration_seconds", "DB manager call latency", ("operation", "status"))
+UPLOAD_BYTES = registry.counter("upload_bytes_total", "Uploaded bytes", ("stored",))
+
+PROCESS_START = time.time()
+registry.add_collector(lambda: [
+    ("process_start_time_seconds", "gauge", "Start time of the process", [({"pid": os.getpid()}, PROCESS_START)]),
+])
+
+class SpanMetrics:
+    """
+    由 Tracing 的 span 事件更新指標（資料庫、模型、工具、RAGFlow 與 Agent 執行）
+    不需在各模組重複加入計時程式碼；未在 trace 中的呼叫也會產生 span 事件
+    """
+
+    # 資料庫管理方法可能互相呼叫，只計算最外層（每次最外層呼叫開啟一個連線）
+    @staticmethod
+    def _outer_db(span) -> bool:
+        return span.name.startswith("db.") and not (span.parent_name or "").startswith("db.")
+
+    def on_start(self, span):
+        if self._outer_db(span):
+            DB_IN_USE.inc()
+        elif span.name == "agent.run":
+            AGENT_RUNS_IN_FLIGHT.inc()
+
+    def on_end(self, span):
+        seconds = span.duration_ms / 1000
+        status = "error" if span.error else "ok"
+        name, attrs = span.name, span.attributes
+        if name.startswith("db."):
+            if self._outer_db(span):
+                DB_IN_USE.dec()
+            DB_DURATION.observe(seconds, name[3:], status)
+        elif name == "llm.call":
+            model = attrs.get("model", "")
+            LLM_DURATION.observe(seconds, model)
+            for kind in ("input_tokens", "output_tokens"):
+                if attrs.get(kind):
+                    AGENT_TOKENS.inc(model, kind[:-7], amount=attrs[kind])
+        elif name.startswith("tool."):
+            TOOL_DURATION.observe(seconds, name[5:], status)
+        elif name.startswith("ragflow."):
+            RAGFLOW_DURATION.observe(seconds, status)
+        elif name == "agent.run":
+            AGENT_RUNS_IN_FLIGHT.dec()
+            model = attrs.get("model", "")
+            AGENT_RUNS.inc(model, status)
+            AGENT_RUN_DURATION.observe(seconds, model)
+
+def observe_request(method: str, route: str, status: int, seconds: float):
+    HTTP_REQUESTS.inc(method, route, status)
+    HTTP_DURATION.observe(seconds, method, route)
+
+def cache_family(caches: Dict[str, Optional[Dict[str, Any]]]):
+    """由各快取的 stats()（含 hits / misses）產生命中與未命中計數"""
+    hits, misses = [], []
+    for cache, stats in caches.items():
+        if stats:
+            hits.append(({"cache": cache}, stats.get("hits")))
+            misses.append(({"cache": cache}, stats.get("misses")))
+    return [
+        ("cache_hits_total", "counter", "Cache hits", hits),
+        ("cache_misses_total", "counter", "Cache misses", misses),
+    ]
+
+add_span_listener(SpanMetrics())
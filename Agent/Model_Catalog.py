@@ -0,0 +1,173 @@
+from typing import Any, Dict, List, Optional
+import asyncio
+import httpx
+import time
+import os
+
+MODEL_CATALOG_TTL = float(os.getenv("MODEL_CATALOG_TTL", "300"))              # 超過即在背景更新
+MODEL_CATALOG_MAX_STALE = float(os.getenv("MODEL_CATALOG_MAX_STALE", "3600"))  # 超過則等待更新完成
+MODEL_CATALOG_MIN_REFRESH = float(os.getenv("MODEL_CATALOG_MIN_REFRESH", "10"))  # 查無模型時最短的重新取得間隔
+MODEL_CATALOG_TIMEOUT = float(os.getenv("MODEL_CATALOG_TIMEOUT", "10"))
+MODEL_CATALOG_SHOW_CONCURRENCY = int(os.getenv("MODEL_CATALOG_SHOW_CONCURRENCY", "4"))
+
+def ollama_root(base_url: str) -> str:
+    """OpenAI 相容位址（.../v1）轉為 Ollama 原生 API 位址"""
+    root = (base_url or "").rstrip("/")
+    return root[:-3] if root.endswith("/v1") else root
+
+class ModelCatalog:
+    """
+    模型清單與規格快取（stale-while-revalidate）
+    - 清單與 context length / 參數量 / 量化方式存在記憶體，列表與驗證不需連線
+    - 超過 TTL 時先回傳舊資料並在背景更新；同一時間只會有一個更新請求
+    - Ollama 原生 API 無法使用時改用 OpenAI 相容的 /v1/models（只有名稱）
+    """
+
+    def __init__(self, base_url: str, api_key: str = None, openai_client=None,
+                 ttl: float = MODEL_CATALOG_TTL, max_stale: float = MODEL_CATALOG_MAX_STALE):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.openai_client = openai_client
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.models: Dict[str, Dict[str, Any]] = {}
+        self.fetched_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.failed_at: Optional[float] = None
+        self._refreshing: Optional[asyncio.Task] = None
+        self._periodic: Optional[asyncio.Task] = None
+
+    def _headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+
+    async def _fetch(self) -> Dict[str, Dict[str, Any]]:
+        root = ollama_root(self.base_url)
+        async with httpx.AsyncClient(timeout=MODEL_CATALOG_TIMEOUT, headers=self._headers()) as client:
+            try:
+                resp = await client.get(f"{root}/api/tags")
+                resp.raise_for_status()
+                tags = resp.json().get("models", [])
+            except Exception:
+                return await self._fetch_openai()
+
+            semaphore = asyncio.Semaphore(max(1, MODEL_CATALOG_SHOW_CONCURRENCY))
+
+            async def describe(tag: Dict[str, Any]) -> Dict[str, Any]:
+                name = tag.get("model") or tag.get("name")
+                details = tag.get("details") or {}
+                meta = {
+                    "id": name,
+                    "digest": tag.get("digest"),
+                    "size_bytes": tag.get("size"),
+                    "family": details.get("family"),
+                    "parameter_size": details.get("parameter_size"),
+                    "quantization": details.get("quantization_level"),
+                    "context_length": None,
+                    "capabilities": None,
+                }
+                # 版本沒變時沿用先前查到的 context length，不重複呼叫 /api/show
+                cached = self.models.get(name)
+                if cached and cached.get("digest") == meta["digest"] and cached.get("context_length"):
+                    meta["context_length"] = cached["context_length"]
+                    meta["capabilities"] = cached.get("capabilities")
+                    return meta
+                try:
+                    async with semaphore:
+                        show = await client.post(f"{root}/api/show", json={"model": name})
+                    show.raise_for_status()
+                    info = show.json()
+                    meta["context_length"] = next(
+                        (v for k, v in (info.get("model_info") or {}).items() if k.endswith(".context_length")), None
+                    )
+                    meta["capabilities"] = info.get("capabilities")
+                except Exception:
+                    pass
+                return meta
+
+            described = await asyncio.gather(*[describe(tag) for tag in tags])
+            return {meta["id"]: meta for meta in described if meta["id"]}
+
+    async def _fetch_openai(self) -> Dict[str, Dict[str, Any]]:
+        if self.openai_client is None:
+            raise RuntimeError("無法取得模型清單")
+        resp = await self.openai_client.models.list()
+        return {m.id: {"id": m.id} async for m in resp}
+
+    async def refresh(self) -> Dict[str, Dict[str, Any]]:
+        """重新取得模型清單；失敗時保留舊資料"""
+        start = time.perf_counter()
+        try:
+            self.models = await self._fetch()
+            self.fetched_at = time.time()
+            self.last_error = None
+            print(f"✓ Model catalog refreshed: {len(self.models)} models ({(time.perf_counter() - start) * 1000:.0f} ms)")
+        except Exception as e:
+            self.last_error = str(e)
+            self.failed_at = time.time()
+            print(f"✗ Model catalog refresh failed: {e}")
+        return self.models
+
+    def _refresh_in_background(self) -> asyncio.Task:
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.create_task(self.refresh())
+        return self._refreshing
+
+    def age(self) -> Optional[float]:
+        return None if self.fetched_at is None else time.time() - self.fetched_at
+
+    async def get_models(self) -> Dict[str, Dict[str, Any]]:
+        """取得模型清單（新鮮直接回傳、過期先回傳舊資料並在背景更新、太舊或沒有資料則等待更新）"""
+        age = self.age()
+        recently_failed = self.failed_at is not None and time.time() - self.failed_at < MODEL_CATALOG_MIN_REFRESH
+        if (age is None or age > self.max_stale) and not recently_failed:
+            await asyncio.shield(self._refresh_in_background())
+        elif age is not None and age > self.ttl and not recently_failed:
+            self._refresh_in_background()
+        return self.models
+
+    async def list_models(self) -> List[Dict[str, Any]]:
+        return sorted((await self.get_models()).values(), key=lambda m: m["id"])
+
+    async def validate(self, model: str) -> bool:
+        """模型是否存在；清單無法取得時不阻擋（回傳 True）"""
+        models = await self.get_models()
+        if not models:
+            return True
+        if model in models:
+            return True
+        # 可能是新下載的模型，等待一次更新後再判斷（限制頻率，避免錯誤名稱造成大量請求）
+        if (self.age() or 0) < MODEL_CATALOG_MIN_REFRESH:
+            return False
+        await asyncio.shield(self._refresh_in_background())
+        return model in self.models or not self.models
+
+    def get(self, model: str) -> Optional[Dict[str, Any]]:
+        return self.models.get(model)
+
+    def start_auto_refresh(self, interval: float = None):
+        """定期在背景更新（需在 event loop 中呼叫）"""
+        interval = interval or self.ttl
+        if self._periodic is not None and not self._periodic.done():
+            return
+
+        async def loop():
+            while True:
+                await self.refresh()
+                await asyncio.sleep(interval)
+
+        self._periodic = asyncio.create_task(loop())
+
+    async def stop(self):
+        for task in (self._periodic, self._refreshing):
+            if task is not None and not task.done():
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        age = self.age()
+        return {
+            "models": len(self.models),
+            "age_seconds": round(age, 1) if age is not None else None,
+            "ttl_seconds": self.ttl,
+            "stale": age is None or age > self.ttl,
+            "last_error": self.last_error,
+        }
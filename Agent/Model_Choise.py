@@ -1,26 +1,34 @@
-from agents import Agent, Runner, OpenAIChatCompletionsModel, AsyncOpenAI, ModelSettings, function_tool
+from Model_Catalog import ModelCatalog
+from dotenv import load_dotenv
 import questionary
 import asyncio
+import os
 
-external_client = AsyncOpenAI(
-    base_url="https://ollama.labelnine.app:5016/v1", 
-    api_key="ollama-e28h8JE92-e19hd-dj2h8ak",
+load_dotenv()
+
+# 與 Agent 相同的連線設定（環境變數）
+model_catalog = ModelCatalog(
+    base_url=os.getenv("Ollama_Api_URL"),
+    api_key=os.getenv("Ollama_Api_Key"),
 )
 
 async def Models_List():
-    resp = await external_client.models.list()
-    return [m.id async for m in resp]
+    return [m["id"] for m in await model_catalog.list_models()]
+
+def describe(model: dict) -> str:
+    specs = [model.get("parameter_size"), model.get("quantization"),
+             f"ctx {model['context_length']}" if model.get("context_length") else None]
+    specs = [s for s in specs if s]
+    return f"{model['id']} ({', '.join(specs)})" if specs else model["id"]
 
 async def main():
-    models = await Models_List()
+    models = await model_catalog.list_models()
     choice = await questionary.select(
         "請選擇模型：",
-        choices=models,
+        choices=[questionary.Choice(describe(m), value=m["id"]) for m in models],
     ).ask_async()
 
     print("當前選擇模型為：", choice)
 
 if __name__ == "__main__":
     asyncio.run(main())
-    # f = open('Prompt\Prompt.txt', 'r', encoding='utf-8').read()
-    # print(f)
\ No newline at end of file
@@ -0,0 +1,283 @@
+from typing import Any, Dict, List, Optional, Set
+from types import SimpleNamespace
+from agents import AsyncOpenAI
+import asyncio
+import openai
+import httpx
+import random
+import json
+import time
+import os
+
+ROUTER_EWMA_ALPHA = float(os.getenv("ROUTER_EWMA_ALPHA", "0.3"))
+ROUTER_MAX_ATTEMPTS = int(os.getenv("ROUTER_MAX_ATTEMPTS", "3"))
+ROUTER_EJECT_FAILURES = int(os.getenv("ROUTER_EJECT_FAILURES", "3"))      # 連續失敗幾次後暫停使用
+ROUTER_EJECT_SECONDS = float(os.getenv("ROUTER_EJECT_SECONDS", "30"))     # 暫停時間（重複被暫停時加倍）
+ROUTER_EJECT_MAX_SECONDS = float(os.getenv("ROUTER_EJECT_MAX_SECONDS", "600"))
+ROUTER_INITIAL_LATENCY = float(os.getenv("ROUTER_INITIAL_LATENCY", "1.0"))  # 尚無紀錄時假設的延遲（秒）
+ROUTER_FAILURE_PENALTY = float(os.getenv("ROUTER_FAILURE_PENALTY", "1.0"))  # 每次連續失敗增加的預估秒數
+ROUTER_MODELS_TTL = float(os.getenv("ROUTER_MODELS_TTL", "60"))           # 各 backend 模型清單的更新間隔
+ROUTER_BACKEND_TIMEOUT = float(os.getenv("ROUTER_BACKEND_TIMEOUT", "120"))  # 單一 backend 單次請求的時限（秒）
+
+def parse_backends(spec: str, default_key: str = None) -> List[Dict[str, str]]:
+    """
+    解析 OLLAMA_BACKENDS
+    - JSON：[{"name": "gpu1", "base_url": "...", "api_key": "..."}, ...]
+    - 逗號分隔：http://gpu1:11434/v1|key1,http://gpu2:11434/v1
+    """
+    spec = (spec or "").strip()
+    if not spec:
+        return []
+    if spec.startswith("["):
+        backends = json.loads(spec)
+    else:
+        backends = []
+        for item in filter(None, (part.strip() for part in spec.split(","))):
+            url, _, key = item.partition("|")
+            backends.append({"base_url": url, "api_key": key or None})
+    for i, backend in enumerate(backends):
+        backend.setdefault("name", f"backend-{i + 1}")
+        backend["api_key"] = backend.get("api_key") or default_key or "ollama"
+    return backends
+
+def is_retryable(error: Exception) -> bool:
+    """連線錯誤、逾時、429 與 5xx 可換 backend 重試；其他 4xx 與程式錯誤（TypeError 等）為請求本身的問題"""
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, (openai.APIConnectionError, httpx.TransportError, ConnectionError,
+                              TimeoutError, asyncio.TimeoutError))
+
+class Backend:
+    """單一 OpenAI 相容推論服務的狀態"""
+
+    def __init__(self, name: str, base_url: str, api_key: str, client=None):
+        self.name = name
+        self.base_url = base_url
+        # 重試由 router 換 backend 進行，用戶端本身不重試，並限制單次請求時間
+        self.client = client or AsyncOpenAI(base_url=base_url, api_key=api_key,
+                                            max_retries=0, timeout=ROUTER_BACKEND_TIMEOUT)
+        self.models: Optional[Set[str]] = None   # None = 尚未取得，視為全部可用
+        self.models_at = 0.0
+        self.inflight = 0
+        self.ewma: Optional[float] = None        # 秒
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+
+    def available(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+    def serves(self, model: str) -> bool:
+        return self.models is None or model in self.models
+
+    def score(self) -> float:
+        """預估等待時間：EWMA 延遲 x (進行中請求 + 1)，加上連續失敗的懲罰"""
+        latency = self.ewma if self.ewma is not None else ROUTER_INITIAL_LATENCY
+        return latency * (self.inflight + 1) + self.consecutive_failures * ROUTER_FAILURE_PENALTY
+
+    def record_success(self, latency: float):
+        self.ewma = latency if self.ewma is None else ROUTER_EWMA_ALPHA * latency + (1 - ROUTER_EWMA_ALPHA) * self.ewma
+        self.consecutive_failures = 0
+        self.ejections = 0
+
+    def record_failure(self, now: float):
+        self.failures += 1
+        if not self.available(now):
+            return  # 暫停前就已送出的請求，不重複延長暫停時間
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= ROUTER_EJECT_FAILURES:
+            self.ejections += 1
+            backoff = min(ROUTER_EJECT_MAX_SECONDS, ROUTER_EJECT_SECONDS * 2 ** (self.ejections - 1))
+            self.ejected_until = now + backoff
+            self.consecutive_failures = 0
+            print(f"✗ Router: backend {self.name} ejected for {backoff:.0f}s")
+
+    def stats(self, now: float) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "base_url": self.base_url,
+            "healthy": self.available(now),
+            "ejected_for_seconds": round(max(0.0, self.ejected_until - now), 1),
+            "inflight": self.inflight,
+            "ewma_ms": round(self.ewma * 1000, 1) if self.ewma is not None else None,
+            "requests": self.requests,
+            "failures": self.failures,
+            "models": sorted(self.models) if self.models is not None else None,
+        }
+
+class _Completions:
+    def __init__(self, router: "ModelRouter"):
+        self._router = router
+
+    async def create(self, **kwargs):
+        return await self._router.create_chat_completion(**kwargs)
+
+class _Chat:
+    def __init__(self, router: "ModelRouter"):
+        self.completions = _Completions(router)
+
+class _ModelList:
+    """與 AsyncOpenAI models.list() 相同的 async 迭代介面"""
+
+    def __init__(self, models: List[Any]):
+        self.data = models
+
+    def __aiter__(self):
+        async def iterate():
+            for model in self.data:
+                yield model
+        return iterate()
+
+class _Models:
+    def __init__(self, router: "ModelRouter"):
+        self._router = router
+
+    async def list(self):
+        return _ModelList(await self._router.list_models())
+
+class ModelRouter:
+    """
+    多個 OpenAI 相容 backend 的路由器（介面與 AsyncOpenAI 相同，可直接交給 OpenAIChatCompletionsModel）
+    - 只選擇有該模型且未被暫停的 backend，依 EWMA 延遲與進行中請求數挑選
+    - 連線錯誤 / 逾時 / 5xx 時換下一個 backend 重試；連續失敗的 backend 暫停使用一段時間
+    - 串流請求只在取得回應前重試（已開始輸出後無法切換）
+    """
+
+    def __init__(self, backends: List[Backend], max_attempts: int = ROUTER_MAX_ATTEMPTS):
+        if not backends:
+            raise ValueError("至少需要一個 backend")
+        self.backends = backends
+        self.max_attempts = max(1, max_attempts)
+        self.base_url = backends[0].base_url
+        self.chat = _Chat(self)
+        self.models = _Models(self)
+        self._models_refresh: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_env(cls, spec: str = None, default_key: str = None) -> "ModelRouter":
+        configs = parse_backends(spec if spec is not None else os.getenv("OLLAMA_BACKENDS", ""), default_key)
+        return cls([Backend(c["name"], c["base_url"], c["api_key"]) for c in configs])
+
+    # ==================== 模型清單 ====================
+
+    async def _refresh_backend_models(self, backend: Backend):
+        try:
+            resp = await backend.client.models.list()
+            backend.models = {m.id async for m in resp}
+        except Exception as e:
+            print(f"✗ Router: failed to list models on {backend.name}: {e}")
+        backend.models_at = time.time()
+
+    async def refresh_models(self):
+        await asyncio.gather(*[self._refresh_backend_models(b) for b in self.backends])
+
+    def _maybe_refresh_models(self):
+        now = time.time()
+        if any(now - b.models_at > ROUTER_MODELS_TTL for b in self.backends):
+            if self._models_refresh is None or self._models_refresh.done():
+                self._models_refresh = asyncio.create_task(self.refresh_models())
+
+    async def list_models(self) -> List[Any]:
+        """所有 backend 模型的聯集"""
+        await self.refresh_models()
+        names = set().union(*(b.models or set() for b in self.backends))
+        return [SimpleNamespace(id=name, object="model") for name in sorted(names)]
+
+    # ==================== 路由 ====================
+
+    def candidates(self, model: str) -> List[Backend]:
+        """可用的 backend，依預估等待時間排序（相同時隨機，分散負載）"""
+        now = time.time()
+        healthy = [b for b in self.backends if b.available(now) and b.serves(model)]
+        if not healthy:
+            # 全部被暫停時仍嘗試最快恢復的 backend，而不是直接失敗
+            healthy = sorted((b for b in self.backends if b.serves(model)), key=lambda b: b.ejected_until)[:1]
+        return sorted(healthy, key=lambda b: (b.score(), random.random()))
+
+    async def create_chat_completion(self, **kwargs):
+        self._maybe_refresh_models()
+        model = kwargs.get("model", "")
+        candidates = self.candidates(model)
+        if not candidates:
+            raise RuntimeError(f"沒有 backend 提供模型 {model}")
+
+        last_error: Optional[Exception] = None
+        for backend in candidates[:self.max_attempts]:
+            backend.inflight += 1
+            backend.requests += 1
+            start = time.perf_counter()
+            try:
+                response = await backend.client.chat.completions.create(**kwargs)
+                backend.record_success(time.perf_counter() - start)
+                return response
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                backend.record_failure(time.time())
+                last_error = e
+                print(f"✗ Router: {backend.name} failed ({type(e).__name__}: {e}), trying next backend")
+            finally:
+                backend.inflight -= 1
+        raise last_error
+
+    def stats(self) -> List[Dict[str, Any]]:
+        now = time.time()
+        return [b.stats(now) for b in self.backends]
+
+# ==================== 本機測試：以 aiohttp 啟動多個模擬 backend ====================
+
+async def _start_stub_server(port: int, delay: float, fail: bool = False):
+    from aiohttp import web
+
+    async def models(_request):
+        return web.json_response({"object": "list", "data": [{"id": "stub-model", "object": "model", "owned_by": "stub"}]})
+
+    async def completions(request):
+        body = await request.json()
+        await asyncio.sleep(delay)
+        if fail:
+            return web.json_response({"error": {"message": "stub failure"}}, status=503)
+        return web.json_response({
+            "id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()), "model": body["model"],
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": f"port {port}"}}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+        })
+
+    app = web.Application()
+    app.router.add_get("/v1/models", models)
+    app.router.add_post("/v1/chat/completions", completions)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+async def _demo():
+    from collections import Counter
+
+    specs = [(18101, 0.05, False), (18102, 0.3, False), (18103, 0.05, True)]
+    runners = [await _start_stub_server(port, delay, fail) for port, delay, fail in specs]
+    router = ModelRouter([Backend(f"stub-{port}", f"http://127.0.0.1:{port}/v1", "stub",
+                                  client=AsyncOpenAI(base_url=f"http://127.0.0.1:{port}/v1", api_key="stub", max_retries=0))
+                          for port, _, _ in specs])
+    await router.refresh_models()
+
+    async def ask(_):
+        response = await router.chat.completions.create(
+            model="stub-model", messages=[{"role": "user", "content": "hi"}]
+        )
+        return response.choices[0].message.content
+
+    # 第一輪：尚無延遲紀錄，依進行中請求數平均分配；第二輪：依 EWMA 偏向較快的 backend
+    for wave in (1, 2):
+        start = time.perf_counter()
+        answers = await asyncio.gather(*[ask(i) for i in range(30)])
+        print(f"wave {wave}: 30 requests in {time.perf_counter() - start:.2f}s -> {Counter(answers)}")
+    print(json.dumps(router.stats(), indent=2))
+    for runner in runners:
+        await runner.cleanup()
+
+if __name__ == "__main__":
+    asyncio.run(_demo())
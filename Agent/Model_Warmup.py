@@ -0,0 +1,159 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from Model_Catalog import ollama_root
+import asyncio
+import httpx
+import time
+import os
+
+MODEL_WARMUP_ENABLED = os.getenv("MODEL_WARMUP_ENABLED", "true").lower() == "true"
+MODEL_WARMUP_INTERVAL = float(os.getenv("MODEL_WARMUP_INTERVAL", "240"))   # 需小於 keep_alive，模型才不會被卸載
+MODEL_WARMUP_TIMEOUT = float(os.getenv("MODEL_WARMUP_TIMEOUT", "300"))     # 冷啟動載入大模型可能需要數分鐘
+MODEL_WARMUP_MODELS = [m.strip() for m in os.getenv("MODEL_WARMUP_MODELS", "").split(",") if m.strip()]
+MODEL_KEEP_ALIVE = os.getenv("MODEL_KEEP_ALIVE", "30m")                     # Ollama keep_alive（-1 表示常駐）
+
+PrefixFn = Callable[[], Tuple[List[Dict[str, Any]], List[Dict[str, Any]], str]]
+
+def _ms(nanoseconds) -> Optional[float]:
+    return round(nanoseconds / 1e6, 1) if nanoseconds else None
+
+class ModelWarmer:
+    """
+    模型預熱
+    - 以與正式請求相同的系統提示詞與工具定義呼叫 Ollama /api/chat（只產生 1 個 token），
+      讓模型載入記憶體並把提示詞前綴放進 KV cache
+    - 帶 keep_alive 控制模型常駐時間，並定期重新呼叫避免閒置後被卸載
+    - 預熱後量測串流第一個 token 的延遲，與冷啟動時的延遲比較
+    """
+
+    def __init__(self, targets: List[Dict[str, str]], prefix_fn: PrefixFn, openai_client=None,
+                 keep_alive: str = MODEL_KEEP_ALIVE):
+        """
+        Args:
+            targets: [{"name", "base_url", "api_key"}]，多個 backend 時每個都預熱
+            prefix_fn: 回傳 (系統訊息, 工具定義, 前綴雜湊)
+            openai_client: 量測第一個 token 延遲用（與正式請求相同的用戶端）
+            keep_alive: 模型常駐時間
+        """
+        self.targets = targets
+        self.prefix_fn = prefix_fn
+        self.openai_client = openai_client
+        self.keep_alive = keep_alive
+        self.results: Dict[str, Dict[str, Any]] = {}
+        self._periodic: Optional[asyncio.Task] = None
+
+    async def _warm_target(self, client: httpx.AsyncClient, target: Dict[str, str], model: str,
+                           messages: List[Dict[str, Any]], tools: List[Dict[str, Any]]) -> Dict[str, Any]:
+        headers = {"Authorization": f"Bearer {target['api_key']}"} if target.get("api_key") else {}
+        start = time.perf_counter()
+        try:
+            resp = await client.post(f"{ollama_root(target['base_url'])}/api/chat", headers=headers, json={
+                "model": model,
+                "messages": messages + [{"role": "user", "content": "ping"}],
+                "tools": tools,
+                "stream": False,
+                "keep_alive": self.keep_alive,
+                "options": {"num_predict": 1},
+            })
+            resp.raise_for_status()
+            body = resp.json()
+            return {
+                "backend": target["name"],
+                "ok": True,
+                "duration_ms": round((time.perf_counter() - start) * 1000, 1),
+                "load_ms": _ms(body.get("load_duration")),          # 模型載入時間（已常駐時接近 0）
+                "prompt_eval_ms": _ms(body.get("prompt_eval_duration")),
+                "prompt_tokens": body.get("prompt_eval_count"),    # 前綴命中 KV cache 時會明顯變少
+            }
+        except Exception as e:
+            return {"backend": target["name"], "ok": False, "error": str(e),
+                    "duration_ms": round((time.perf_counter() - start) * 1000, 1)}
+
+    async def warm_up(self, model: str) -> List[Dict[str, Any]]:
+        """預熱所有 backend 上的指定模型"""
+        messages, tools, prefix_hash = self.prefix_fn()
+        async with httpx.AsyncClient(timeout=MODEL_WARMUP_TIMEOUT) as client:
+            results = await asyncio.gather(*[
+                self._warm_target(client, target, model, messages, tools) for target in self.targets
+            ])
+        for result in results:
+            if result["ok"]:
+                print(f"✓ Warm-up {model} on {result['backend']}: {result['duration_ms']} ms "
+                      f"(load {result['load_ms']} ms, prompt tokens {result['prompt_tokens']})")
+            else:
+                print(f"✗ Warm-up {model} on {result['backend']} failed: {result['error']}")
+        self.results.setdefault(model, {}).update({
+            "prefix_hash": prefix_hash,
+            "warmed_at": time.time(),
+            "warmup": results,
+        })
+        return results
+
+    async def measure_first_token(self, model: str) -> Optional[float]:
+        """以正式請求的前綴送出串流請求，回傳收到第一個 chunk 的毫秒數"""
+        if self.openai_client is None:
+            return None
+        messages, tools, _ = self.prefix_fn()
+        start = time.perf_counter()
+        stream = await self.openai_client.chat.completions.create(
+            model=model,
+            messages=messages + [{"role": "user", "content": "ping"}],
+            tools=tools or None,
+            max_tokens=1,
+            stream=True,
+        )
+        try:
+            async for _chunk in stream:
+                break
+        finally:
+            await stream.close()
+        first_token_ms = round((time.perf_counter() - start) * 1000, 1)
+        self.results.setdefault(model, {})["first_token_ms"] = first_token_ms
+        return first_token_ms
+
+    async def warm_and_measure(self, model: str, measure: bool = True) -> Dict[str, Any]:
+        """
+        預熱並比較延遲
+        Returns:
+            {"model", "prefix_hash", "warmup": [...], "cold_first_call_ms", "first_token_ms"}
+            cold_first_call_ms 為預熱請求本身的耗時（含模型載入），first_token_ms 為預熱後的第一個 token 延遲
+        """
+        results = await self.warm_up(model)
+        ok = [r["duration_ms"] for r in results if r["ok"]]
+        report = {
+            "model": model,
+            "prefix_hash": self.results[model]["prefix_hash"],
+            "warmup": results,
+            "cold_first_call_ms": max(ok) if ok else None,
+            "first_token_ms": None,
+        }
+        if measure and ok:
+            try:
+                report["first_token_ms"] = await self.measure_first_token(model)
+            except Exception as e:
+                report["first_token_error"] = str(e)
+        return report
+
+    def start_periodic(self, models_fn: Callable[[], List[str]], interval: float = MODEL_WARMUP_INTERVAL):
+        """啟動時立即預熱一次，之後定期重新預熱（需在 event loop 中呼叫）"""
+        if not MODEL_WARMUP_ENABLED or (self._periodic is not None and not self._periodic.done()):
+            return
+
+        async def loop():
+            while True:
+                for model in dict.fromkeys(models_fn() + MODEL_WARMUP_MODELS):
+                    await self.warm_up(model)
+                await asyncio.sleep(interval)
+
+        self._periodic = asyncio.create_task(loop())
+
+    async def stop(self):
+        if self._periodic is not None and not self._periodic.done():
+            self._periodic.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": MODEL_WARMUP_ENABLED,
+            "interval_seconds": MODEL_WARMUP_INTERVAL,
+            "keep_alive": self.keep_alive,
+            "models": self.results,
+        }
@@ -0,0 +1,134 @@
+from typing import Any, AsyncIterator, Dict, List, Optional
+from Quote_Tool.Quote_Engine import quote_engine, QuoteError, QuoteEngine
+import argparse
+import asyncio
+import csv
+import io
+import json
+import time
+import sys
+import os
+
+BATCH_CONCURRENCY = int(os.getenv("QUOTE_BATCH_CONCURRENCY", "8"))   # 每計算幾筆讓出一次 event loop
+
+# 欄位別名 -> Quote_Engine.quote 參數名稱（CSV 標題可用中文或英文）
+FIELD_ALIASES = {
+    "id": "id", "編號": "id", "part": "id", "料號": "id",
+    "material": "material", "材料": "material", "材質": "material",
+    "shape": "shape", "胚料格式": "shape", "格式": "shape",
+    "weight": "weight_kg", "weight_kg": "weight_kg", "重量": "weight_kg",
+    "equipment": "equipment", "設備": "equipment",
+    "hours": "hours", "工時": "hours",
+    "surface_treatment": "surface_treatment", "surface": "surface_treatment", "表面處理": "surface_treatment",
+    "quantity": "quantity", "qty": "quantity", "數量": "quantity",
+}
+
+def normalize_part(raw: Dict[str, Any]) -> Dict[str, Any]:
+    """將一筆零件資料的欄位名稱與型別轉成 quote() 可用的參數"""
+    part = {}
+    for key, value in raw.items():
+        field = FIELD_ALIASES.get(str(key).strip().lower()) or FIELD_ALIASES.get(str(key).strip())
+        if field and value not in (None, ""):
+            part[field] = value.strip() if isinstance(value, str) else value
+
+    for field in ("weight_kg", "hours"):
+        if field in part:
+            part[field] = float(part[field])
+    if "quantity" in part:
+        part["quantity"] = int(float(part["quantity"]))
+    return part
+
+def parse_parts(data: str, fmt: str) -> List[Dict[str, Any]]:
+    """
+    解析批次估價輸入
+    Args:
+        data: 檔案內容
+        fmt: "csv" 或 "json"（JSON 可為 list 或 {"parts": [...]}）
+    """
+    if fmt == "csv":
+        rows = list(csv.DictReader(io.StringIO(data.lstrip("\ufeff"))))
+    elif fmt == "json":
+        rows = json.loads(data)
+        if isinstance(rows, dict):
+            rows = rows.get("parts", [])
+    else:
+        raise ValueError(f"不支援的格式: {fmt}")
+    return rows
+
+def detect_format(filename: str, data: str) -> str:
+    if filename.lower().endswith(".json") or data.lstrip("\ufeff \r\n\t")[:1] in ("[", "{"):
+        return "json"
+    return "csv"
+
+def quote_one(index: int, raw: Dict[str, Any], engine: QuoteEngine) -> Dict[str, Any]:
+    """計算單筆估價（純記憶體計算，約數微秒，直接在呼叫端執行）"""
+    start = time.perf_counter()
+    result: Dict[str, Any] = {"index": index}
+    try:
+        part = normalize_part(raw)
+        result["id"] = part.pop("id", index)
+        result["quote"] = engine.quote(**part)
+        result["status"] = "success"
+    except QuoteError as e:
+        result.update({"status": "error", "error": str(e), "candidates": e.candidates})
+    except Exception as e:
+        result.update({"status": "error", "error": str(e)})
+    result["latency_ms"] = round((time.perf_counter() - start) * 1000, 3)
+    return result
+
+async def batch_quote_stream(parts: List[Dict[str, Any]], concurrency: Optional[int] = None,
+                             engine: QuoteEngine = quote_engine) -> AsyncIterator[Dict[str, Any]]:
+    """
+    依輸入順序逐筆估價並產出結果，最後產出一筆 summary
+    估價只讀取記憶體中的價格表，不交給執行緒（每筆換手的成本遠高於計算本身）
+    Args:
+        parts: 零件列表
+        concurrency: 每計算幾筆讓出一次 event loop（預設 QUOTE_BATCH_CONCURRENCY），避免大批次佔住其他請求
+    """
+    start = time.perf_counter()
+    await asyncio.to_thread(engine.ensure_loaded)  # 價格表未載入時從資料庫載入（阻塞式 I/O）
+
+    chunk = max(1, concurrency or BATCH_CONCURRENCY)
+    succeeded = 0
+    for i, raw in enumerate(parts):
+        result = quote_one(i, raw, engine)
+        succeeded += result["status"] == "success"
+        yield result
+        if (i + 1) % chunk == 0:
+            await asyncio.sleep(0)
+
+    yield {
+        "summary": {
+            "total": len(parts),
+            "succeeded": succeeded,
+            "failed": len(parts) - succeeded,
+            "total_ms": round((time.perf_counter() - start) * 1000, 3),
+        }
+    }
+
+def to_ndjson(result: Dict[str, Any]) -> str:
+    return json.dumps(result, ensure_ascii=False) + "\n"
+
+async def run_batch_file(path: str, concurrency: Optional[int] = None, output=None):
+    """讀取 CSV / JSON 檔並將 NDJSON 結果寫到 output（預設 stdout）"""
+    with open(path, "r", encoding="utf-8") as f:
+        data = f.read()
+    parts = parse_parts(data, detect_format(path, data))
+
+    output = output or sys.stdout
+    async for result in batch_quote_stream(parts, concurrency):
+        output.write(to_ndjson(result))
+        output.flush()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="批次估價（輸出 NDJSON）")
+    parser.add_argument("path", help="CSV 或 JSON 零件列表")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="每計算幾筆讓出一次 event loop")
+    parser.add_argument("--output", help="輸出檔案（預設 stdout）")
+    args = parser.parse_args()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as out:
+            asyncio.run(run_batch_file(args.path, args.concurrency, out))
+    else:
+        asyncio.run(run_batch_file(args.path, args.concurrency))
@@ -0,0 +1,354 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from datetime import datetime
+import difflib
+import json
+import threading
+import time
+import unicodedata
+import dotenv
+import os
+
+dotenv.load_dotenv()
+
+# ==================== 價格表設定 ====================
+#
+# 價格表原本只以文件形式存放在 RAGFlow（「材質-板材表格」「材質-圓柱表格」「設備使用費」「陽極、ESD、無電解鎳」「熱處裡」），
+# 估價引擎改為讀取下列三張 MSSQL 表（表名可由環境變數指定），initialize_price_tables() 於啟動時建立：
+#   材料：    Material NVARCHAR(100), Shape NVARCHAR(50), PricePerKg DECIMAL(18, 2)          （每公斤單價，依胚料格式區分）
+#   設備：    Equipment NVARCHAR(100), HourlyRate DECIMAL(18, 2)                           （每小時費率）
+#   表面處理：Treatment NVARCHAR(100), PricePerKg DECIMAL(18, 2), MinimumCharge DECIMAL(18, 2)（每公斤單價 + 最低收費）
+# 表為空且設定 QUOTE_SEED_FILE 時，以該 JSON 檔（格式同 QUOTE_PRICE_FILE，範例見 price_tables.sample.json）寫入初始資料；
+# 範例檔的價格僅為格式示意，正式環境需依 RAGFlow 中的價格表文件填入
+
+PRICE_FILE = os.getenv("QUOTE_PRICE_FILE")  # 若設定則改從 JSON 檔載入（離線 / 測試用）
+SEED_FILE = os.getenv("QUOTE_SEED_FILE")    # 價格表為空時寫入的初始資料
+MATERIAL_TABLE = os.getenv("QUOTE_MATERIAL_TABLE", "dbo.Material_Cost")
+EQUIPMENT_TABLE = os.getenv("QUOTE_EQUIPMENT_TABLE", "dbo.Equipment_Usage_Cost")
+SURFACE_TABLE = os.getenv("QUOTE_SURFACE_TABLE", "dbo.Surface_Treatment_Cost")
+REFRESH_SECONDS = int(os.getenv("QUOTE_REFRESH_SECONDS", "300"))
+CURRENCY = os.getenv("QUOTE_CURRENCY", "TWD")
+
+# (價格表名稱, 資料表, 欄位定義)；load_price_tables_from_sql 依相同欄位讀取
+PRICE_TABLES = (
+    ("materials", MATERIAL_TABLE,
+     (("Material", "NVARCHAR(100) NOT NULL"), ("Shape", "NVARCHAR(50) NOT NULL DEFAULT ''"), ("PricePerKg", "DECIMAL(18, 2) NOT NULL"))),
+    ("equipment", EQUIPMENT_TABLE,
+     (("Equipment", "NVARCHAR(100) NOT NULL"), ("HourlyRate", "DECIMAL(18, 2) NOT NULL"))),
+    ("surface_treatments", SURFACE_TABLE,
+     (("Treatment", "NVARCHAR(100) NOT NULL"), ("PricePerKg", "DECIMAL(18, 2) NOT NULL"), ("MinimumCharge", "DECIMAL(18, 2) NOT NULL DEFAULT 0"))),
+)
+
+# 胚料格式別名 -> 標準名稱
+SHAPE_ALIASES = {
+    "板": "板材",
+    "板料": "板材",
+    "PLATE": "板材",
+    "圓棒": "圓柱",
+    "棒材": "圓柱",
+    "圓柱體": "圓柱",
+    "ROD": "圓柱",
+    "BAR": "圓柱",
+}
+
+class QuoteError(ValueError):
+    """估價輸入無法對應到價格表（附帶候選項目供 Agent 追問使用者）"""
+
+    def __init__(self, message: str, candidates: Optional[List[str]] = None):
+        super().__init__(message)
+        self.candidates = candidates or []
+
+class PriceTablesEmpty(QuoteError):
+    """價格表尚未建立資料（尚未執行 seed / 匯入），Agent 應改用 Retrieval_Tool_Text 檢索價格表"""
+
+    def __init__(self):
+        super().__init__("價格表尚無資料，請改用 Retrieval_Tool_Text 檢索價格表後計算")
+
+def normalize_key(text: str) -> str:
+    """統一全形/半形、大小寫與空白，作為索引鍵"""
+    text = unicodedata.normalize("NFKC", text or "")
+    return "".join(text.split()).upper()
+
+def normalize_shape(shape: str) -> str:
+    key = normalize_key(shape)
+    return normalize_key(SHAPE_ALIASES.get(key, key))
+
+def initialize_price_tables(seed_file: Optional[str] = SEED_FILE) -> bool:
+    """
+    建立三張價格表（已存在則略過），表為空且有 seed_file 時寫入初始資料
+    Args:
+        seed_file: JSON 檔，格式同 load_price_tables_from_file
+    """
+    import pyodbc
+    from Sql_Tool.MsSQL_Tool import conn_str
+
+    try:
+        seed = load_price_tables_from_file(seed_file) if seed_file else {}
+        conn = pyodbc.connect(conn_str, timeout=5)
+        cur = conn.cursor()
+
+        for name, table, columns in PRICE_TABLES:
+            definition = ",\n".join(f"{column} {sql_type}" for column, sql_type in columns)
+            cur.execute(f"""
+                IF OBJECT_ID(?, 'U') IS NULL
+                CREATE TABLE {table} (
+                    Id INT IDENTITY(1,1) PRIMARY KEY,
+                    {definition}
+                )
+            """, (table,))
+
+            cur.execute(f"SELECT COUNT(*) FROM {table}")
+            empty = cur.fetchone()[0] == 0
+            rows = seed.get(name) or []
+            if rows and empty:
+                names = [column for column, _ in columns]
+                cur.executemany(
+                    f"INSERT INTO {table} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})",
+                    [tuple(row.get(column, "" if column == "Shape" else 0) for column in names) for row in rows])
+                print(f"✓ 價格表 {table} 寫入初始資料 {len(rows)} 筆")
+
+        conn.commit()
+        conn.close()
+        print("✓ 價格表初始化成功")
+        return True
+
+    except Exception as e:
+        print(f"✗ 價格表初始化失敗: {e}")
+        return False
+
+def load_price_tables_from_sql() -> Dict[str, List[Dict[str, Any]]]:
+    """從 MSSQL 讀取三張價格表"""
+    import pyodbc
+    from Sql_Tool.MsSQL_Tool import conn_str
+
+    conn = pyodbc.connect(conn_str, timeout=5)
+    cur = conn.cursor()
+
+    tables = {}
+    for name, table, columns in PRICE_TABLES:
+        cur.execute(f"SELECT {', '.join(column for column, _ in columns)} FROM {table}")
+        keys = [column[0] for column in cur.description]
+        tables[name] = [dict(zip(keys, row)) for row in cur.fetchall()]
+
+    cur.close()
+    conn.close()
+    return tables
+
+def load_price_tables_from_file(path: str) -> Dict[str, List[Dict[str, Any]]]:
+    """從 JSON 檔讀取價格表，格式與 load_price_tables_from_sql 的回傳相同"""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def default_loader() -> Dict[str, List[Dict[str, Any]]]:
+    if PRICE_FILE:
+        return load_price_tables_from_file(PRICE_FILE)
+    return load_price_tables_from_sql()
+
+class PriceSnapshot:
+    """某一時間點的價格表索引（建立後不再修改，可無鎖讀取）"""
+
+    def __init__(self, tables: Dict[str, List[Dict[str, Any]]]):
+        self.loaded_at = datetime.now()
+
+        # (材料, 胚料格式) -> 每公斤單價
+        self.materials: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        # 材料 -> 可用胚料格式
+        self.material_shapes: Dict[str, List[str]] = {}
+        for row in tables.get("materials", []):
+            material, shape = normalize_key(row["Material"]), normalize_shape(row.get("Shape") or "")
+            self.materials[(material, shape)] = {
+                "name": f"{row['Material']} {row.get('Shape') or ''}".strip(),
+                "price_per_kg": float(row["PricePerKg"]),
+            }
+            self.material_shapes.setdefault(material, []).append(shape)
+
+        # 設備 -> 每小時費率
+        self.equipment: Dict[str, Dict[str, Any]] = {}
+        for row in tables.get("equipment", []):
+            self.equipment[normalize_key(row["Equipment"])] = {
+                "name": row["Equipment"],
+                "hourly_rate": float(row["HourlyRate"]),
+            }
+
+        # 表面處理 -> 每公斤單價 + 最低收費
+        self.surface_treatments: Dict[str, Dict[str, Any]] = {}
+        for row in tables.get("surface_treatments", []):
+            self.surface_treatments[normalize_key(row["Treatment"])] = {
+                "name": row["Treatment"],
+                "price_per_kg": float(row["PricePerKg"]),
+                "minimum_charge": float(row.get("MinimumCharge") or 0),
+            }
+
+    @property
+    def empty(self) -> bool:
+        """材料或設備價格表沒有任何資料時無法估價"""
+        return not self.materials or not self.equipment
+
+    def lookup(self, index: Dict[str, Dict[str, Any]], label: str, value: str) -> Dict[str, Any]:
+        key = normalize_key(value)
+        entry = index.get(key)
+        if entry is None:
+            # 允許部分名稱，例如「銑床」對應「CNC銑床」，但只接受唯一結果
+            partial = [k for k in index if key and (key in k or k in key)]
+            if len(partial) == 1:
+                return index[partial[0]]
+            candidates = [index[k]["name"] for k in (partial or difflib.get_close_matches(key, index, n=5, cutoff=0.3))]
+            raise QuoteError(f"找不到{label}：{value}", candidates)
+        return entry
+
+    def lookup_material(self, material: str, shape: str = "") -> Dict[str, Any]:
+        material_key = normalize_key(material)
+        shapes = self.material_shapes.get(material_key)
+        if shapes is None:
+            candidates = difflib.get_close_matches(material_key, self.material_shapes, n=5, cutoff=0.3)
+            raise QuoteError(f"找不到材料：{material}", candidates)
+
+        shape_key = normalize_shape(shape)
+        if not shape_key:
+            if len(shapes) != 1:
+                raise QuoteError(f"材料 {material} 需要指定胚料格式", [self.materials[(material_key, s)]["name"] for s in shapes])
+            shape_key = shapes[0]
+
+        entry = self.materials.get((material_key, shape_key))
+        if entry is None:
+            raise QuoteError(f"材料 {material} 沒有胚料格式：{shape}", [self.materials[(material_key, s)]["name"] for s in shapes])
+        return entry
+
+class QuoteEngine:
+    """估價引擎 - 價格表載入記憶體建立索引，定期背景刷新，估價為純計算"""
+
+    def __init__(self, loader: Callable[[], Dict[str, List[Dict[str, Any]]]] = default_loader,
+                 refresh_seconds: int = REFRESH_SECONDS):
+        """
+        初始化估價引擎
+        Args:
+            loader: 回傳三張價格表的函數（materials / equipment / surface_treatments）
+            refresh_seconds: 背景刷新間隔（秒，<= 0 表示不自動刷新）
+        """
+        self.loader = loader
+        self.refresh_seconds = refresh_seconds
+        self.snapshot: Optional[PriceSnapshot] = None
+        self._load_lock = threading.Lock()
+        self._refresh_thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def refresh(self) -> bool:
+        """重新載入價格表，失敗時保留舊的快照"""
+        with self._load_lock:
+            try:
+                start = time.perf_counter()
+                snapshot = PriceSnapshot(self.loader())
+                self.snapshot = snapshot  # 整份替換，讀取端不需要鎖
+                print(f"✓ Price tables loaded: {len(snapshot.materials)} materials, "
+                      f"{len(snapshot.equipment)} equipment, {len(snapshot.surface_treatments)} surface treatments "
+                      f"({(time.perf_counter() - start) * 1000:.1f} ms)")
+                return True
+            except Exception as e:
+                print(f"Error loading price tables: {e}")
+                return False
+
+    def ensure_loaded(self) -> PriceSnapshot:
+        if self.snapshot is None:
+            self.refresh()
+            if self.snapshot is None:
+                raise RuntimeError("價格表尚未載入")
+            self.start_auto_refresh()
+        return self.snapshot
+
+    def start_auto_refresh(self):
+        """啟動背景刷新執行緒（重複呼叫無副作用）"""
+        if self.refresh_seconds <= 0 or (self._refresh_thread and self._refresh_thread.is_alive()):
+            return
+        self._stop.clear()
+        self._refresh_thread = threading.Thread(target=self._refresh_loop, name="QuoteEngineRefresh", daemon=True)
+        self._refresh_thread.start()
+
+    def stop_auto_refresh(self):
+        self._stop.set()
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.refresh_seconds):
+            self.refresh()
+
+    def quote(self, material: str, weight_kg: float, equipment: str, hours: float,
+              surface_treatment: str = "", shape: str = "", quantity: int = 1) -> Dict[str, Any]:
+        """
+        計算報價
+        Args:
+            material: 材料，如 SUS316
+            weight_kg: 單件重量（公斤）
+            equipment: 加工設備，如 銑床
+            hours: 單件預估工時（小時）
+            surface_treatment: 表面處理（可為空）
+            shape: 胚料格式，如 板材 / 圓柱（材料只有一種格式時可省略）
+            quantity: 件數
+        Returns:
+            {"items": [...], "total": ..., "currency": ..., ...}
+        """
+        if weight_kg <= 0:
+            raise QuoteError("重量必須大於 0")
+        if hours < 0:
+            raise QuoteError("工時不可為負數")
+        if quantity < 1:
+            raise QuoteError("件數至少為 1")
+
+        snapshot = self.ensure_loaded()
+        if snapshot.empty:
+            raise PriceTablesEmpty()
+        items = []
+
+        mat = snapshot.lookup_material(material, shape)
+        items.append({
+            "item": "材料",
+            "name": mat["name"],
+            "unit_price": mat["price_per_kg"],
+            "unit": "kg",
+            "quantity": round(weight_kg * quantity, 3),
+            "amount": round(mat["price_per_kg"] * weight_kg * quantity, 2),
+        })
+
+        eq = snapshot.lookup(snapshot.equipment, "設備", equipment)
+        items.append({
+            "item": "設備使用",
+            "name": eq["name"],
+            "unit_price": eq["hourly_rate"],
+            "unit": "hr",
+            "quantity": round(hours * quantity, 3),
+            "amount": round(eq["hourly_rate"] * hours * quantity, 2),
+        })
+
+        if normalize_key(surface_treatment) not in ("", "無", "NONE"):
+            st = snapshot.lookup(snapshot.surface_treatments, "表面處理", surface_treatment)
+            amount = max(st["price_per_kg"] * weight_kg * quantity, st["minimum_charge"])
+            items.append({
+                "item": "表面處理",
+                "name": st["name"],
+                "unit_price": st["price_per_kg"],
+                "unit": "kg",
+                "quantity": round(weight_kg * quantity, 3),
+                "amount": round(amount, 2),
+                "minimum_charge": st["minimum_charge"],
+            })
+
+        return {
+            "items": items,
+            "total": round(sum(i["amount"] for i in items), 2),
+            "currency": CURRENCY,
+            "quantity": quantity,
+            "price_tables_loaded_at": snapshot.loaded_at.isoformat(),
+        }
+
+    def catalog(self) -> Dict[str, List[str]]:
+        """列出可估價的項目名稱"""
+        snapshot = self.ensure_loaded()
+        return {
+            "materials": [m["name"] for m in snapshot.materials.values()],
+            "equipment": [e["name"] for e in snapshot.equipment.values()],
+            "surface_treatments": [s["name"] for s in snapshot.surface_treatments.values()],
+        }
+
+quote_engine = QuoteEngine()
+
+if __name__ == "__main__":
+    engine = QuoteEngine(refresh_seconds=0)
+    print(engine.catalog())
+    print(json.dumps(engine.quote("SUS316", 15, "銑床", 3, "真空熱處理", shape="圓柱"), ensure_ascii=False, indent=2))
@@ -0,0 +1,43 @@
+from agents import function_tool
+from typing import Any, Dict
+from Quote_Tool.Quote_Engine import quote_engine, QuoteError, PriceTablesEmpty
+import asyncio
+
+@function_tool
+async def Quote_Tool(material: str, weight_kg: float, equipment: str, hours: float,
+               surface_treatment: str = "", shape: str = "", quantity: int = 1) -> Dict[str, Any]:
+    """
+    Compute a machining quote from the in-memory price tables and return an itemized breakdown.
+
+    Args:
+        material: Material grade, e.g. SUS316
+        weight_kg: Weight of one piece in kilograms
+        equipment: Machining equipment, e.g. 銑床
+        hours: Estimated machining hours per piece
+        surface_treatment: Surface treatment, e.g. 陽極 / ESD / 無電解鎳 / 真空熱處理; empty if none
+        shape: Stock shape, e.g. 板材 or 圓柱; may be empty when the material has only one shape
+        quantity: Number of pieces
+    """
+    print("=== Quote Tool Activated ===")
+    try:
+        if quote_engine.snapshot is None:
+            # 價格表通常於啟動時載入；啟動載入失敗時才在這裡載入（pyodbc 為阻塞式呼叫，放到執行緒中）
+            await asyncio.to_thread(quote_engine.ensure_loaded)
+        return quote_engine.quote(
+            material=material,
+            weight_kg=weight_kg,
+            equipment=equipment,
+            hours=hours,
+            surface_treatment=surface_treatment,
+            shape=shape,
+            quantity=quantity,
+        )
+    except PriceTablesEmpty as e:
+        return {"error": str(e), "fallback": "retrieval"}
+    except QuoteError as e:
+        return {"error": str(e), "candidates": e.candidates}
+    except Exception as e:
+        return {"error": f"估價失敗: {e}"}
+
+if __name__ == "__main__":
+    print(quote_engine.quote("SUS316", 15, "銑床", 3, "真空熱處理", shape="圓柱"))
@@ -0,0 +1,178 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from collections import OrderedDict
+from Tracing import span
+import asyncio
+import json
+import time
+import re
+import os
+
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "true").lower() == "true"
+PREFETCH_TTL = float(os.getenv("PREFETCH_TTL", "300"))               # 檢索結果快取秒數
+PREFETCH_MAX_ENTRIES = int(os.getenv("PREFETCH_MAX_ENTRIES", "256"))
+
+def parse_rules(spec: str) -> List[Tuple[str, Tuple[str, ...]]]:
+    """
+    解析 PREFETCH_RULES：{"檢索關鍵字": ["觸發詞", ...], ...}
+    檢索關鍵字需與模型實際呼叫 Retrieval_Tool_Text 的問題相同，預取結果才會被使用
+    """
+    spec = (spec or "").strip()
+    if not spec:
+        return []
+    return [(query, tuple(k.lower() for k in keywords)) for query, keywords in json.loads(spec).items()]
+
+# 自訂規則（額外加入，預設無）
+PREFETCH_RULES = parse_rules(os.getenv("PREFETCH_RULES", ""))
+
+# 價格表檢索：檢索關鍵字與 Prompt.txt 在價格表尚無資料（Quote_Tool 回傳 fallback=retrieval）時指示模型使用的完全相同
+# 只在價格表為空時啟用；價格表有資料時估價由 Quote_Tool 計算，預取只會浪費
+PRICE_TABLE_RULES: List[Tuple[str, Tuple[str, ...]]] = [
+    ("材質-板材表格", ("板材", "板料", "鋼板", "鋁板")),
+    ("材質-圓柱表格", ("圓柱", "圓棒", "棒材", "圓料")),
+    ("設備使用費", ("設備", "銑床", "車床", "cnc", "磨床", "線切割", "放電", "工時")),
+    ("陽極、ESD、無電解鎳", ("陽極", "esd", "無電解鎳", "電鍍")),   # 「表面處理」本身不觸發，無法判斷是哪一種
+    ("熱處裡", ("熱處理", "熱處裡", "淬火", "回火", "退火")),
+]
+# 提到材料但沒有說明胚料形狀時，兩種材質表都預先取得
+MATERIAL_PATTERN = re.compile(r"SUS\s*\d{3}|SKD\s*\d+|S\d{2}C|A\d{4}|材料|材質", re.IGNORECASE)
+MATERIAL_QUERIES = ("材質-板材表格", "材質-圓柱表格")
+
+class _Entry:
+    def __init__(self, task: asyncio.Task, prefetched: bool):
+        self.task = task
+        self.prefetched = prefetched
+        self.created = time.time()
+        self.used = False
+        self.wasted = False
+
+class RetrievalPrefetcher:
+    """
+    檢索預取
+    - 依使用者輸入的關鍵字（成本極低的字串比對）推測模型會呼叫的檢索，與載入歷史訊息同時開始
+    - 工具呼叫時直接取得已完成（或進行中）的結果；相同問題在 TTL 內共用同一份結果
+    - 預取但該次執行沒有用到的視為浪費，統計浪費比例以調整觸發詞
+    """
+
+    def __init__(self, fetch: Callable[[str], Awaitable[Any]], rules=PREFETCH_RULES,
+                 ttl: float = PREFETCH_TTL, max_entries: int = PREFETCH_MAX_ENTRIES,
+                 price_rules=PRICE_TABLE_RULES, price_tables_empty: Callable[[], bool] = lambda: False):
+        """
+        Args:
+            fetch: fetch(question) -> 檢索結果（與工具回傳值相同）
+            rules: [(檢索關鍵字, 觸發詞), ...]，一律套用
+            ttl: 結果保留秒數
+            max_entries: 最多保留的結果數
+            price_rules: 價格表檢索規則，只在 price_tables_empty() 為 True 時套用
+            price_tables_empty: 價格表是否尚無資料（此時模型改以檢索估價）
+        """
+        self.fetch = fetch
+        self.rules = rules
+        self.price_rules = price_rules
+        self.price_tables_empty = price_tables_empty
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self.started = 0    # 預取次數
+        self.used = 0       # 預取結果被工具使用的次數
+        self.wasted = 0     # 預取後該次執行沒有用到
+        self.hits = 0       # 工具呼叫由快取取得（含先前工具呼叫留下的結果）
+        self.misses = 0
+
+    @staticmethod
+    def _key(question: str) -> str:
+        return " ".join(question.split())
+
+    def detect(self, text: str) -> List[str]:
+        """依輸入內容推測需要的檢索（依規則順序，不重複）"""
+        lowered = text.lower()
+        queries = [query for query, keywords in self.rules if any(k in lowered for k in keywords)]
+        if self.price_rules and self.price_tables_empty():
+            price_queries = [query for query, keywords in self.price_rules if any(k in lowered for k in keywords)]
+            if MATERIAL_PATTERN.search(text) and not any(q in price_queries for q in MATERIAL_QUERIES):
+                price_queries = list(MATERIAL_QUERIES) + price_queries
+            queries += [q for q in price_queries if q not in queries]
+        return queries
+
+    def _fresh(self, entry: Optional[_Entry]) -> bool:
+        if entry is None or time.time() - entry.created > self.ttl:
+            return False
+        task = entry.task
+        if task.get_loop() is not asyncio.get_running_loop():
+            return False
+        return not (task.done() and (task.cancelled() or task.exception() is not None))
+
+    def _start(self, question: str, prefetched: bool) -> _Entry:
+        async def run():
+            with span("retrieval.prefetch" if prefetched else "retrieval.fetch", root=False, query=question):
+                return await self.fetch(question)
+
+        task = asyncio.create_task(run())
+        # 預取失敗時由工具呼叫重新檢索，這裡只取出例外避免 "never retrieved" 警告
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        entry = self._entries[self._key(question)] = _Entry(task, prefetched)
+        self._entries.move_to_end(self._key(question))
+        while len(self._entries) > self.max_entries:
+            _, evicted = self._entries.popitem(last=False)
+            if evicted.prefetched and not evicted.used and not evicted.wasted:
+                evicted.wasted = True
+                self.wasted += 1
+        return entry
+
+    def prefetch(self, text: str) -> List[str]:
+        """
+        開始預取（需在 event loop 中呼叫，不等待結果）
+        Returns:
+            本次新開始的檢索關鍵字（交給 settle() 計算浪費）
+        """
+        if not PREFETCH_ENABLED:
+            return []
+        started = []
+        for query in self.detect(text):
+            if self._fresh(self._entries.get(self._key(query))):
+                continue
+            self._start(query, prefetched=True)
+            self.started += 1
+            started.append(query)
+        return started
+
+    async def get(self, question: str) -> Any:
+        """取得檢索結果：有預取或先前結果時直接使用，否則檢索並保留結果"""
+        entry = self._entries.get(self._key(question))
+        if self._fresh(entry):
+            self.hits += 1
+            if entry.prefetched and not entry.used:
+                entry.used = True
+                self.used += 1
+                if entry.wasted:  # 已被其他執行計為浪費，之後才被使用
+                    entry.wasted = False
+                    self.wasted -= 1
+            try:
+                return await asyncio.shield(entry.task)
+            except Exception:
+                pass  # 預取失敗，重新檢索
+        else:
+            self.misses += 1
+        return await asyncio.shield(self._start(question, prefetched=False).task)
+
+    def settle(self, queries: List[str]):
+        """一次執行結束後，將該次預取但未使用的結果計為浪費"""
+        for query in queries:
+            entry = self._entries.get(self._key(query))
+            if entry is not None and entry.prefetched and not entry.used and not entry.wasted:
+                entry.wasted = True
+                self.wasted += 1
+
+    def stats(self) -> Dict[str, Any]:
+        settled = self.used + self.wasted
+        lookups = self.hits + self.misses
+        return {
+            "enabled": PREFETCH_ENABLED,
+            "entries": len(self._entries),
+            "prefetched": self.started,
+            "used": self.used,
+            "wasted": self.wasted,
+            "wasted_ratio": round(self.wasted / settled, 4) if settled else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+        }
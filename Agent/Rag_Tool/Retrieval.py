@@ -1,7 +1,10 @@
 
 from agents import function_tool
 from typing import Any, Dict, List, Optional
-import requests, dotenv, os
+from Tracing import traced
+from Rag_Tool.Prefetch import RetrievalPrefetcher
+from Quote_Tool.Quote_Engine import quote_engine
+import requests, httpx, dotenv, os
 
 dotenv.load_dotenv()
 
@@ -9,21 +12,20 @@ BASE_URL = os.getenv("RAGFLOW_BASE_URL", "http://192.168.1.36:8080") # 140.134.6
 API_KEY = os.getenv("ragflowapi")
 DATASET_ID = os.getenv("RAGFLOW_DATASET_ID", "a92508d0dd8d11f0b6ae9e3860c79f60")
 
-def ragflow_retrieval(
+def build_retrieval_request(
     question: str,
     dataset_id: str,
     top_k: int = 5,
     page: int = 1,
-    timeout: int = 60,
 
     # ===== RERANK 相關 =====
     enable_rerank: bool = False,
     rerank_top_k: Optional[int] = None,
     similarity_threshold: Optional[float] = None,
     vector_similarity_weight: Optional[float] = None,
-) -> Dict[str, Any]:
+):
     """
-    Call RAGFlow retrieval API with optional rerank.
+    Build (url, headers, payload) for the RAGFlow retrieval API.
     """
 
     url = f"{BASE_URL}/api/v1/retrieval"
@@ -51,10 +53,29 @@ def ragflow_retrieval(
     if vector_similarity_weight is not None:
         payload["vector_similarity_weight"] = vector_similarity_weight
 
+    return url, headers, payload
+
+@traced("ragflow.retrieval", kind="client")
+def ragflow_retrieval(question: str, dataset_id: str, timeout: int = 60, **options) -> Dict[str, Any]:
+    """
+    Call RAGFlow retrieval API with optional rerank (blocking).
+    """
+    url, headers, payload = build_retrieval_request(question, dataset_id, **options)
     r = requests.post(url, headers=headers, json=payload, timeout=timeout)
     r.raise_for_status()
     return r.json()
 
+@traced("ragflow.retrieval", kind="client")
+async def ragflow_retrieval_async(question: str, dataset_id: str, timeout: int = 60, **options) -> Dict[str, Any]:
+    """
+    Call RAGFlow retrieval API with optional rerank (non-blocking, for tools running in the event loop).
+    """
+    url, headers, payload = build_retrieval_request(question, dataset_id, **options)
+    async with httpx.AsyncClient(timeout=timeout) as client:
+        r = await client.post(url, headers=headers, json=payload)
+    r.raise_for_status()
+    return r.json()
+
 def extract_chunks(resp: Dict[str, Any]) -> List[Dict[str, Any]]:
     """
     Extract chunks from RAGFlow response safely.
@@ -82,19 +103,8 @@ def pretty_print_chunks(chunks: List[Dict[str, Any]], max_chars: int = 400) -> N
         print(f"    similarity={sim} term={term} vector={vec}")
         print(text[:max_chars])
 
-@function_tool
-def Retrieval_Tool_Text(question: str) -> Dict[str, Any]:
-    """RAGFlow retrieval -> return compact context text for LLM"""
-    print("=== Retrieval Tool Activated ===")
-    print("Question:", question)
-    resp = ragflow_retrieval(
-        question=question,
-        dataset_id=DATASET_ID,
-        top_k=5,
-        enable_rerank=True,
-        rerank_top_k=10,
-    )
-
+def format_context(resp: Dict[str, Any]) -> Dict[str, Any]:
+    """RAGFlow response -> {"total", "context"} compact context text for LLM"""
     chunks = extract_chunks(resp)
     total = (resp.get("data") or {}).get("total", 0)
 
@@ -112,6 +122,30 @@ def Retrieval_Tool_Text(question: str) -> Dict[str, Any]:
         "context": context
     }
 
+async def retrieve_context(question: str) -> Dict[str, Any]:
+    """Retrieval used by the tool (and by speculative prefetch, so both share results)"""
+    resp = await ragflow_retrieval_async(
+        question=question,
+        dataset_id=DATASET_ID,
+        top_k=5,
+        enable_rerank=True,
+        rerank_top_k=10,
+    )
+    return format_context(resp)
+
+# 依使用者輸入預先檢索，工具呼叫時直接取得結果；價格表尚無資料時模型改以檢索估價，一併預取價格表
+retrieval_prefetcher = RetrievalPrefetcher(
+    retrieve_context,
+    price_tables_empty=lambda: quote_engine.snapshot is not None and quote_engine.snapshot.empty,
+)
+
+@function_tool
+async def Retrieval_Tool_Text(question: str) -> Dict[str, Any]:
+    """RAGFlow retrieval -> return compact context text for LLM"""
+    print("=== Retrieval Tool Activated ===")
+    print("Question:", question)
+    return dict(await retrieval_prefetcher.get(question))
+
 if __name__ == "__main__":
-    Anwser = Retrieval_Tool_Text("材質-板材表格")
+    Anwser = format_context(ragflow_retrieval("材質-板材表格", DATASET_ID, top_k=5, enable_rerank=True, rerank_top_k=10))
     print(Anwser)
@@ -0,0 +1,84 @@
+from typing import Any, Dict, List, Optional
+from agents import RunHooks
+from Tracing import current_span, start_span
+import time
+
+class RunAccounting(RunHooks):
+    """
+    單次 Agent 執行的用量統計（每次 Runner.run 建立一個）
+    - 工具：呼叫次數與累計耗時
+    - 模型：呼叫次數與累計耗時（SDK 支援 on_llm_start / on_llm_end 時）
+    - 執行結束後由 summary() 合併 Runner 結果中的 token 用量與回合數
+    """
+
+    def __init__(self, queued_at: Optional[float] = None):
+        """
+        Args:
+            queued_at: 請求進入服務的時間（time.perf_counter()），用於計算執行前的等待時間
+        """
+        self.started_at = time.perf_counter()
+        self.queue_wait = self.started_at - queued_at if queued_at is not None else 0.0
+        self.tools: Dict[str, Dict[str, float]] = {}
+        self.llm_calls = 0
+        self.llm_seconds = 0.0
+        self._tool_starts: Dict[str, List[float]] = {}
+        self._active_tools = 0
+        self.max_parallel_tools = 0
+        self._llm_start: Optional[float] = None
+        self._run_span = current_span()   # 模型呼叫的 span 掛在建立時的 span（agent.run）下
+        self._llm_span = None
+
+    async def on_tool_start(self, context, agent, tool):
+        self._tool_starts.setdefault(tool.name, []).append(time.perf_counter())
+        self._active_tools += 1
+        self.max_parallel_tools = max(self.max_parallel_tools, self._active_tools)
+
+    async def on_tool_end(self, context, agent, tool, result):
+        self._active_tools -= 1
+        starts = self._tool_starts.get(tool.name)
+        elapsed = time.perf_counter() - starts.pop(0) if starts else 0.0
+        stats = self.tools.setdefault(tool.name, {"calls": 0, "duration_ms": 0.0})
+        stats["calls"] += 1
+        stats["duration_ms"] = round(stats["duration_ms"] + elapsed * 1000, 1)
+
+    async def on_llm_start(self, context, agent, system_prompt, input_items):
+        self._llm_start = time.perf_counter()
+        self._llm_span = start_span("llm.call", self._run_span, "client",
+                                    model=getattr(agent.model, "model", None), turn=self.llm_calls + 1)
+
+    async def on_llm_end(self, context, agent, response):
+        if self._llm_start is not None:
+            self.llm_calls += 1
+            self.llm_seconds += time.perf_counter() - self._llm_start
+            self._llm_start = None
+        if self._llm_span is not None:
+            usage = getattr(response, "usage", None)
+            self._llm_span.set(input_tokens=getattr(usage, "input_tokens", None),
+                               output_tokens=getattr(usage, "output_tokens", None))
+            self._llm_span.end()
+            self._llm_span = None
+
+    def summary(self, result: Any = None, error: Exception = None) -> Dict[str, Any]:
+        """
+        整理統計結果（result 為 Runner.run 的回傳值；執行失敗時為 None）
+        Returns:
+            dict: tokens / turns / 工具統計 / 各階段耗時
+        """
+        usage = getattr(getattr(result, "context_wrapper", None), "usage", None)
+        raw_responses = getattr(result, "raw_responses", None) or []
+        return {
+            "status": "error" if error else "ok",
+            "error": str(error)[:2000] if error else None,
+            "input_tokens": getattr(usage, "input_tokens", 0) or 0,
+            "output_tokens": getattr(usage, "output_tokens", 0) or 0,
+            "total_tokens": getattr(usage, "total_tokens", 0) or 0,
+            "requests": getattr(usage, "requests", 0) or self.llm_calls,
+            "turns": len(raw_responses),
+            "tool_calls": sum(int(t["calls"]) for t in self.tools.values()),
+            "tool_ms": round(sum(t["duration_ms"] for t in self.tools.values()), 1),
+            "max_parallel_tools": self.max_parallel_tools,
+            "llm_ms": round(self.llm_seconds * 1000, 1),
+            "queue_wait_ms": round(self.queue_wait * 1000, 1),
+            "wall_ms": round((time.perf_counter() - self.started_at) * 1000, 1),
+            "tools": self.tools,
+        }
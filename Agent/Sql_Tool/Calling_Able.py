@@ -1,6 +1,7 @@
 from datetime import datetime
 from typing import List, Dict, Any, Optional
 from enum import Enum
+from Tracing import traced_methods
 import pyodbc
 import dotenv
 import os
@@ -14,6 +15,7 @@ class MemoryType(Enum):
     CONTEXT = "context"     # 上下文記憶
     KNOWLEDGE = "knowledge" # 知識記憶
 
+@traced_methods("db.memory")
 class ChatMemoryManager:
     """統一記憶管理器 - 支持多對話 + 系統記憶 + 按編號管理"""
     
@@ -687,6 +689,7 @@ class UserRole(Enum):
     USER = "user"       # 一般用戶
     ADMIN = "admin"     # 超級管理員
 
+@traced_methods("db.users")
 class UserManager:
     """用戶管理器 - 處理用戶認證、權限和用戶數據隔離"""
     
@@ -0,0 +1,380 @@
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Callable
+from pathlib import Path
+from Sql_Tool.Calling_Able import ChatMemoryManager
+from Tracing import traced_methods
+import mimetypes
+import pyodbc
+import re
+
+TIMESTAMP_PREFIX = re.compile(r"^\d{8}_\d{6}_")
+
+@traced_methods("db.file_index")
+class FileIndexManager:
+    """對話附件索引 - 記錄原始檔名、大小、雜湊、MIME 與時間；內容以雜湊去重並計算引用數"""
+
+    def __init__(self, conn_str: str = None):
+        """
+        初始化附件索引
+        Args:
+            conn_str: 連線字串（預設與 ChatMemoryManager 相同）
+        """
+        self.conn_str = conn_str or ChatMemoryManager().conn_str
+
+    def initialize_tables(self):
+        """初始化附件索引表"""
+        try:
+            conn = pyodbc.connect(self.conn_str, timeout=5)
+            cursor = conn.cursor()
+
+            cursor.execute("""
+                IF NOT EXISTS (SELECT * FROM sys.tables WHERE name = 'ConversationFiles')
+                CREATE TABLE ConversationFiles (
+                    Id INT IDENTITY(1,1) PRIMARY KEY,
+                    ConversationId INT NOT NULL,
+                    StoredName NVARCHAR(400) NOT NULL,
+                    OriginalName NVARCHAR(400) NOT NULL,
+                    Size BIGINT NOT NULL,
+                    Sha256 CHAR(64),
+                    MimeType NVARCHAR(200),
+                    CreatedAt DATETIME DEFAULT GETDATE(),
+                    UpdatedAt DATETIME DEFAULT GETDATE()
+                )
+            """)
+
+            cursor.execute("""
+                IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'IX_ConversationFiles_Conversation')
+                CREATE UNIQUE INDEX IX_ConversationFiles_Conversation ON ConversationFiles(ConversationId, StoredName)
+            """)
+
+            cursor.execute("""
+                IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'IX_ConversationFiles_Sha256')
+                CREATE INDEX IX_ConversationFiles_Sha256 ON ConversationFiles(Sha256)
+            """)
+
+            # 內容定址 blob 與引用數
+            cursor.execute("""
+                IF NOT EXISTS (SELECT * FROM sys.tables WHERE name = 'FileBlobs')
+                CREATE TABLE FileBlobs (
+                    Sha256 CHAR(64) PRIMARY KEY,
+                    Size BIGINT NOT NULL,
+                    RefCount INT NOT NULL DEFAULT 0,
+                    CreatedAt DATETIME DEFAULT GETDATE()
+                )
+            """)
+
+            conn.commit()
+            conn.close()
+            print("✓ 附件索引表初始化成功")
+            return True
+
+        except Exception as e:
+            print(f"✗ 附件索引表初始化失敗: {e}")
+            return False
+
+    @staticmethod
+    def guess_mime(name: str, fallback: str = None) -> str:
+        return mimetypes.guess_type(name)[0] or fallback or "application/octet-stream"
+
+    def add_file(self, conversation_id: int, stored_name: str, original_name: str, size: int,
+                 sha256: str = None, mime_type: str = None) -> bool:
+        """
+        新增附件紀錄
+        Args:
+            conversation_id: 對話編號
+            stored_name: 儲存檔名
+            original_name: 原始檔名
+            size: 大小（bytes）
+            sha256: 內容雜湊
+            mime_type: MIME 類型（未提供時依副檔名推測）
+        """
+        try:
+            conn = pyodbc.connect(self.conn_str, timeout=5)
+            cursor = conn.cursor()
+
+            cursor.execute("""
+                INSERT INTO ConversationFiles (ConversationId, StoredName, OriginalName, Size, Sha256, MimeType)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (conversation_id, stored_name, original_name, size, sha256,
+                  mime_type or self.guess_mime(original_name)))
+
+            conn.commit()
+            conn.close()
+            return True
+
+        except Exception as e:
+            print(f"✗ 新增附件紀錄失敗: {e}")
+            return False
+
+    def add_reference(self, conversation_id: int, stored_name: str, original_name: str, size: int,
+                      sha256: str, mime_type: str = None) -> bool:
+        """
+        新增附件並增加 blob 引用數（同一交易）
+        Args:
+            conversation_id: 對話編號
+            stored_name: 對話內的檔名
+            original_name: 原始檔名
+            size: 大小（bytes）
+            sha256: 內容雜湊（blob 鍵）
+            mime_type: MIME 類型
+        """
+        try:
+            conn = pyodbc.connect(self.conn_str, timeout=5)
+            cursor = conn.cursor()
+
+            cursor.execute("""
+                MERGE FileBlobs WITH (HOLDLOCK) AS t
+                USING (SELECT ? AS Sha256, ? AS Size) AS s ON t.Sha256 = s.Sha256
+                WHEN MATCHED THEN UPDATE SET RefCount = t.RefCount + 1
+                WHEN NOT MATCHED THEN INSERT (Sha256, Size, RefCount) VALUES (s.Sha256, s.Size, 1);
+            """, (sha256, size))
+
+            cursor.execute("""
+                INSERT INTO ConversationFiles (ConversationId, StoredName, OriginalName, Size, Sha256, MimeType)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (conversation_id, stored_name, original_name, size, sha256,
+                  mime_type or self.guess_mime(original_name)))
+
+            conn.commit()
+            conn.close()
+            return True
+
+        except Exception as e:
+            print(f"✗ 新增附件引用失敗: {e}")
+            return False
+
+    def remove_reference(self, conversation_id: int, stored_name: str,
+                         on_orphaned: Callable[[str], Any] = None) -> Optional[Dict[str, Any]]:
+        """
+        刪除附件並減少 blob 引用數（同一交易）
+        Args:
+            on_orphaned: 引用數歸零時在交易提交前呼叫（例如刪除 blob 檔案）；
+                         此時仍鎖住 FileBlobs 該列，同時上傳相同內容的 add_reference 會等待提交後才重新建立引用
+        Returns:
+            {"sha256": ..., "orphaned": 引用數是否歸零}；找不到紀錄或失敗時回傳 None
+        """
+        try:
+            conn = pyodbc.connect(self.conn_str, timeout=5)
+            cursor = conn.cursor()
+
+            cursor.execute("""
+                DELETE FROM ConversationFiles
+                OUTPUT deleted.Sha256
+                WHERE ConversationId = ? AND StoredName = ?
+            """, (conversation_id, stored_name))
+            row = cursor.fetchone()
+            if row is None:
+                conn.rollback()
+                conn.close()
+                return None
+
+            sha256 = row[0].strip() if row[0] else None
+            orphaned = False
+            if sha256:
+                cursor.execute("""
+                    UPDATE FileBlobs SET RefCount = RefCount - 1
+                    OUTPUT inserted.RefCount
+                    WHERE Sha256 = ?
+                """, (sha256,))
+                ref = cursor.fetchone()
+                if ref is not None and ref[0] <= 0:
+                    cursor.execute("DELETE FROM FileBlobs WHERE Sha256 = ? AND RefCount <= 0", (sha256,))
+                    orphaned = True
+                    if on_orphaned is not None:
+                        on_orphaned(sha256)
+
+            conn.commit()
+            conn.close()
+            return {"sha256": sha256, "orphaned": orphaned}
+
+        except Exception as e:
+            print(f"✗ 刪除附件引用失敗: {e}")
+            return None
+
+    def has_blob(self, sha256: str, user_id: Optional[int] = None) -> bool:
+        """
+        內容是否被某位用戶的對話引用（避免任何人都能以雜湊探測其他對話的檔案）
+        Args:
+            user_id: 用戶編號；None 表示不限用戶（管理員）
+        """
+        try:
+            conn = pyodbc.connect(self.conn_str, timeout=5)
+            cursor = conn.cursor()
+
+            sql = "SELECT TOP 1 1 FROM ConversationFiles f WHERE f.Sha256 = ?"
+            params = [sha256]
+            if user_id is not None:
+                sql += """
+                    AND EXISTS (SELECT 1 FROM UnifiedMemory m
+                                WHERE m.ConversationId = f.ConversationId AND m.UserId = ?)
+                """
+                params.append(user_id)
+            cursor.execute(sql, params)
+            found = cursor.fetchone() is not None
+            conn.close()
+            return found
+
+        except Exception as e:
+            print(f"✗ 查詢內容引用失敗: {e}")
+            return False
+
+    def get_blob(self, sha256: str) -> Optional[Dict[str, Any]]:
+        """獲取 blob 資訊（大小與引用數）"""
+        try:
+            conn = pyodbc.connect(self.conn_str, timeout=5)
+            cursor = conn.cursor()
+
+            cursor.execute("SELECT Size, RefCount, CreatedAt FROM FileBlobs WHERE Sha256 = ?", (sha256,))
+            row = cursor.fetchone()
+            conn.close()
+
+            if row:
+                return {
+                    "sha256": sha256,
+                    "size": row.Size,
+                    "ref_count": row.RefCount,
+                    "created_at": row.CreatedAt.isoformat() if row.CreatedAt else None
+                }
+            return None
+
+        except Exception as e:
+            print(f"✗ 獲取 blob 資訊失敗: {e}")
+            return None
+
+    def _row_to_dict(self, row) -> Dict[str, Any]:
+        return {
+            "filename": row.StoredName,
+            "original_name": row.OriginalName,
+            "size": row.Size,
+            "sha256": row.Sha256.strip() if row.Sha256 else None,
+            "mime_type": row.MimeType,
+            "upload_date": row.CreatedAt.isoformat() if row.CreatedAt else None,
+            "updated_at": row.UpdatedAt.isoformat() if row.UpdatedAt else None,
+        }
+
+    def get_files(self, conversation_id: int) -> Optional[List[Dict[str, Any]]]:
+        """
+        獲取對話的所有附件
+        Returns:
+            附件列表；查詢失敗時回傳 None（呼叫端可改用目錄掃描）
+        """
+        try:
+            conn = pyodbc.connect(self.conn_str, timeout=5)
+            cursor = conn.cursor()
+
+            cursor.execute("""
+                SELECT StoredName, OriginalName, Size, Sha256, MimeType, CreatedAt, UpdatedAt
+                FROM ConversationFiles
+                WHERE ConversationId = ?
+                ORDER BY StoredName
+            """, (conversation_id,))
+
+            files = [self._row_to_dict(row) for row in cursor.fetchall()]
+            conn.close()
+            return files
+
+        except Exception as e:
+            print(f"✗ 獲取附件列表失敗: {e}")
+            return None
+
+    def get_file(self, conversation_id: int, stored_name: str) -> Optional[Dict[str, Any]]:
+        """獲取單一附件紀錄"""
+        try:
+            conn = pyodbc.connect(self.conn_str, timeout=5)
+            cursor = conn.cursor()
+
+            cursor.execute("""
+                SELECT StoredName, OriginalName, Size, Sha256, MimeType, CreatedAt, UpdatedAt
+                FROM ConversationFiles
+                WHERE ConversationId = ? AND StoredName = ?
+            """, (conversation_id, stored_name))
+
+            row = cursor.fetchone()
+            conn.close()
+            return self._row_to_dict(row) if row else None
+
+        except Exception as e:
+            print(f"✗ 獲取附件紀錄失敗: {e}")
+            return None
+
+    def delete_file(self, conversation_id: int, stored_name: str) -> bool:
+        """刪除附件紀錄"""
+        try:
+            conn = pyodbc.connect(self.conn_str, timeout=5)
+            cursor = conn.cursor()
+
+            cursor.execute("""
+                DELETE FROM ConversationFiles
+                WHERE ConversationId = ? AND StoredName = ?
+            """, (conversation_id, stored_name))
+
+            conn.commit()
+            conn.close()
+            return True
+
+        except Exception as e:
+            print(f"✗ 刪除附件紀錄失敗: {e}")
+            return False
+
+    def conversation_usage(self, conversation_id: int) -> Optional[int]:
+        """對話已使用的附件容量（bytes），查詢失敗時回傳 None"""
+        try:
+            conn = pyodbc.connect(self.conn_str, timeout=5)
+            cursor = conn.cursor()
+
+            cursor.execute("""
+                SELECT COALESCE(SUM(Size), 0) FROM ConversationFiles WHERE ConversationId = ?
+            """, (conversation_id,))
+
+            usage = cursor.fetchone()[0]
+            conn.close()
+            return int(usage)
+
+        except Exception as e:
+            print(f"✗ 獲取對話容量失敗: {e}")
+            return None
+
+    def backfill(self, upload_dir: Path) -> int:
+        """
+        將索引建立前就存在的檔案補登到索引（只需執行一次，已登記的檔案會略過）
+        Args:
+            upload_dir: 上傳根目錄
+        Returns:
+            補登的檔案數
+        """
+        if not upload_dir.exists():
+            return 0
+        try:
+            conn = pyodbc.connect(self.conn_str, timeout=5)
+            cursor = conn.cursor()
+
+            cursor.execute("SELECT ConversationId, StoredName FROM ConversationFiles")
+            known = {(row.ConversationId, row.StoredName) for row in cursor.fetchall()}
+
+            added = 0
+            for conv_dir in upload_dir.iterdir():
+                if not (conv_dir.is_dir() and conv_dir.name.isdigit()):
+                    continue
+                for file_path in conv_dir.iterdir():
+                    if not file_path.is_file() or file_path.name.endswith(".part"):
+                        continue
+                    if (int(conv_dir.name), file_path.name) in known:
+                        continue
+                    st = file_path.stat()
+                    original_name = TIMESTAMP_PREFIX.sub("", file_path.name)
+                    cursor.execute("""
+                        INSERT INTO ConversationFiles (ConversationId, StoredName, OriginalName, Size, MimeType, CreatedAt)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                    """, (int(conv_dir.name), file_path.name, original_name, st.st_size,
+                          self.guess_mime(original_name), datetime.fromtimestamp(st.st_mtime)))
+                    added += 1
+
+            conn.commit()
+            conn.close()
+            if added:
+                print(f"✓ 補登 {added} 個附件到索引")
+            return added
+
+        except Exception as e:
+            print(f"✗ 補登附件索引失敗: {e}")
+            return 0
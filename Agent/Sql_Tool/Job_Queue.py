@@ -0,0 +1,340 @@
+from typing import List, Dict, Any, Optional
+from Sql_Tool.Calling_Able import ChatMemoryManager
+from Tracing import traced_methods
+import pyodbc
+import json
+import os
+
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_STATUSES = ("queued", "running", "succeeded", "failed", "cancelled")
+FINISHED_STATUSES = ("succeeded", "failed", "cancelled")
+
+@traced_methods("db.jobs")
+class JobQueueManager:
+    """背景工作佇列 - 工作狀態存放在 MSSQL（與 UnifiedMemory 同一資料庫），重啟後可繼續執行"""
+
+    def __init__(self, conn_str: str = None):
+        """
+        初始化工作佇列
+        Args:
+            conn_str: 連線字串（預設與 ChatMemoryManager 相同）
+        """
+        self.conn_str = conn_str or ChatMemoryManager().conn_str
+
+    def initialize_tables(self):
+        """初始化工作表"""
+        try:
+            conn = pyodbc.connect(self.conn_str, timeout=5)
+            cursor = conn.cursor()
+
+            cursor.execute("""
+                IF NOT EXISTS (SELECT * FROM sys.tables WHERE name = 'AgentJobs')
+                CREATE TABLE AgentJobs (
+                    Id BIGINT IDENTITY(1,1) PRIMARY KEY,
+                    JobType NVARCHAR(100) NOT NULL,
+                    Status NVARCHAR(20) NOT NULL DEFAULT 'queued',
+                    Priority INT NOT NULL DEFAULT 0,
+                    Payload NVARCHAR(MAX),
+                    Result NVARCHAR(MAX),
+                    Error NVARCHAR(MAX),
+                    Progress FLOAT,
+                    ProgressMessage NVARCHAR(400),
+                    Attempts INT NOT NULL DEFAULT 0,
+                    MaxAttempts INT NOT NULL DEFAULT 3,
+                    AvailableAt DATETIME NOT NULL DEFAULT GETDATE(),
+                    LeaseOwner NVARCHAR(100),
+                    LeaseExpiresAt DATETIME,
+                    UserId INT,
+                    ConversationId INT,
+                    CreatedAt DATETIME DEFAULT GETDATE(),
+                    StartedAt DATETIME,
+                    FinishedAt DATETIME,
+                    UpdatedAt DATETIME DEFAULT GETDATE()
+                )
+            """)
+
+            cursor.execute("""
+                IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'IX_AgentJobs_Claim')
+                CREATE INDEX IX_AgentJobs_Claim ON AgentJobs(Status, Priority DESC, AvailableAt)
+            """)
+
+            conn.commit()
+            conn.close()
+            print("✓ 工作佇列表初始化成功")
+            return True
+
+        except Exception as e:
+            print(f"✗ 工作佇列表初始化失敗: {e}")
+            return False
+
+    def enqueue(self, job_type: str, payload: Dict[str, Any], priority: int = 0,
+                max_attempts: int = JOB_MAX_ATTEMPTS, user_id: int = None,
+                conversation_id: int = None, delay_seconds: int = 0) -> Optional[int]:
+        """
+        新增工作
+        Args:
+            job_type: 工作類型（對應已註冊的處理函數）
+            payload: 工作參數（JSON）
+            priority: 優先權，數字越大越先執行
+            max_attempts: 最多嘗試次數（含第一次）
+            user_id / conversation_id: 關聯的用戶與對話
+            delay_seconds: 延後執行秒數
+        Returns:
+            工作編號；失敗時回傳 None
+        """
+        try:
+            conn = pyodbc.connect(self.conn_str, timeout=5)
+            cursor = conn.cursor()
+
+            cursor.execute("""
+                INSERT INTO AgentJobs (JobType, Priority, Payload, MaxAttempts, UserId, ConversationId, AvailableAt)
+                OUTPUT inserted.Id
+                VALUES (?, ?, ?, ?, ?, ?, DATEADD(second, ?, GETDATE()))
+            """, (job_type, priority, json.dumps(payload, ensure_ascii=False), max(1, max_attempts),
+                  user_id, conversation_id, delay_seconds))
+
+            job_id = cursor.fetchone()[0]
+            conn.commit()
+            conn.close()
+            return int(job_id)
+
+        except Exception as e:
+            print(f"✗ 新增工作失敗: {e}")
+            return None
+
+    def claim(self, worker_id: str, lease_seconds: int, job_types: List[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        領取下一個可執行的工作（含租約過期、執行者已中斷的工作）
+        - READPAST + UPDLOCK 讓多個 worker / 行程同時領取時不互相阻塞也不重複領取
+        Returns:
+            {"id", "job_type", "payload", "attempts", "max_attempts"}；沒有工作時回傳 None
+        """
+        type_filter = ""
+        if job_types:
+            type_filter = f"AND JobType IN ({', '.join('?' for _ in job_types)})"
+
+        try:
+            conn = pyodbc.connect(self.conn_str, timeout=5)
+            cursor = conn.cursor()
+
+            cursor.execute(f"""
+                WITH next_job AS (
+                    SELECT TOP (1) *
+                    FROM AgentJobs WITH (ROWLOCK, READPAST, UPDLOCK)
+                    WHERE ((Status = 'queued' AND AvailableAt <= GETDATE())
+                        OR (Status = 'running' AND LeaseExpiresAt < GETDATE()))
+                        {type_filter}
+                    ORDER BY Priority DESC, AvailableAt, Id
+                )
+                UPDATE next_job
+                SET Status = 'running',
+                    Attempts = Attempts + 1,
+                    LeaseOwner = ?,
+                    LeaseExpiresAt = DATEADD(second, ?, GETDATE()),
+                    StartedAt = COALESCE(StartedAt, GETDATE()),
+                    UpdatedAt = GETDATE()
+                OUTPUT inserted.Id, inserted.JobType, inserted.Payload, inserted.Attempts, inserted.MaxAttempts
+            """, (*(job_types or []), worker_id, lease_seconds))
+
+            row = cursor.fetchone()
+            conn.commit()
+            conn.close()
+
+            if row is None:
+                return None
+            return {
+                "id": int(row.Id),
+                "job_type": row.JobType,
+                "payload": json.loads(row.Payload) if row.Payload else {},
+                "attempts": row.Attempts,
+                "max_attempts": row.MaxAttempts,
+            }
+
+        except Exception as e:
+            print(f"✗ 領取工作失敗: {e}")
+            return None
+
+    def heartbeat(self, job_id: int, worker_id: str, lease_seconds: int,
+                  progress: float = None, message: str = None) -> bool:
+        """
+        延長租約並回報進度
+        Returns:
+            是否仍持有該工作（已被取消或被其他 worker 接手時回傳 False）
+        """
+        try:
+            conn = pyodbc.connect(self.conn_str, timeout=5)
+            cursor = conn.cursor()
+
+            cursor.execute("""
+                UPDATE AgentJobs
+                SET LeaseExpiresAt = DATEADD(second, ?, GETDATE()),
+                    Progress = COALESCE(?, Progress),
+                    ProgressMessage = COALESCE(?, ProgressMessage),
+                    UpdatedAt = GETDATE()
+                WHERE Id = ? AND Status = 'running' AND LeaseOwner = ?
+            """, (lease_seconds, progress, message[:400] if message else None, job_id, worker_id))
+
+            alive = cursor.rowcount > 0
+            conn.commit()
+            conn.close()
+            return alive
+
+        except Exception as e:
+            # 資料庫暫時無法連線時繼續執行，租約到期前仍會重試
+            print(f"✗ 更新工作租約失敗: {e}")
+            return True
+
+    def complete(self, job_id: int, worker_id: str, result: Any) -> bool:
+        """標記工作完成並保存結果"""
+        try:
+            conn = pyodbc.connect(self.conn_str, timeout=5)
+            cursor = conn.cursor()
+
+            cursor.execute("""
+                UPDATE AgentJobs
+                SET Status = 'succeeded', Result = ?, Error = NULL, Progress = 1,
+                    LeaseOwner = NULL, LeaseExpiresAt = NULL, FinishedAt = GETDATE(), UpdatedAt = GETDATE()
+                WHERE Id = ? AND Status = 'running' AND LeaseOwner = ?
+            """, (json.dumps(result, ensure_ascii=False, default=str), job_id, worker_id))
+
+            done = cursor.rowcount > 0
+            conn.commit()
+            conn.close()
+            return done
+
+        except Exception as e:
+            print(f"✗ 標記工作完成失敗: {e}")
+            return False
+
+    def fail(self, job_id: int, worker_id: str, error: str, retry_delay_seconds: int) -> Optional[str]:
+        """
+        標記工作失敗；尚有嘗試次數時延後重新排入佇列
+        Returns:
+            更新後的狀態（"queued" 或 "failed"）；失敗時回傳 None
+        """
+        try:
+            conn = pyodbc.connect(self.conn_str, timeout=5)
+            cursor = conn.cursor()
+
+            cursor.execute("""
+                UPDATE AgentJobs
+                SET Status = CASE WHEN Attempts < MaxAttempts THEN 'queued' ELSE 'failed' END,
+                    AvailableAt = CASE WHEN Attempts < MaxAttempts
+                                       THEN DATEADD(second, ?, GETDATE()) ELSE AvailableAt END,
+                    FinishedAt = CASE WHEN Attempts < MaxAttempts THEN NULL ELSE GETDATE() END,
+                    Error = ?, LeaseOwner = NULL, LeaseExpiresAt = NULL, UpdatedAt = GETDATE()
+                OUTPUT inserted.Status
+                WHERE Id = ? AND Status = 'running' AND LeaseOwner = ?
+            """, (retry_delay_seconds, error, job_id, worker_id))
+
+            row = cursor.fetchone()
+            conn.commit()
+            conn.close()
+            return row[0] if row else None
+
+        except Exception as e:
+            print(f"✗ 標記工作失敗狀態失敗: {e}")
+            return None
+
+    def cancel(self, job_id: int, user_id: int = None) -> bool:
+        """
+        取消尚未完成的工作（執行中的工作會在下次回報進度時停止）
+        Args:
+            user_id: 指定時只取消該用戶提交的工作
+        """
+        try:
+            conn = pyodbc.connect(self.conn_str, timeout=5)
+            cursor = conn.cursor()
+
+            sql = """
+                UPDATE AgentJobs
+                SET Status = 'cancelled', LeaseOwner = NULL, LeaseExpiresAt = NULL,
+                    FinishedAt = GETDATE(), UpdatedAt = GETDATE()
+                WHERE Id = ? AND Status IN ('queued', 'running')
+            """
+            params = [job_id]
+            if user_id is not None:
+                sql += " AND UserId = ?"
+                params.append(user_id)
+            cursor.execute(sql, params)
+
+            cancelled = cursor.rowcount > 0
+            conn.commit()
+            conn.close()
+            return cancelled
+
+        except Exception as e:
+            print(f"✗ 取消工作失敗: {e}")
+            return False
+
+    def _row_to_dict(self, row, include_result: bool = False) -> Dict[str, Any]:
+        job = {
+            "job_id": int(row.Id),
+            "job_type": row.JobType,
+            "status": row.Status,
+            "priority": row.Priority,
+            "progress": row.Progress,
+            "progress_message": row.ProgressMessage,
+            "attempts": row.Attempts,
+            "max_attempts": row.MaxAttempts,
+            "error": row.Error,
+            "user_id": row.UserId,
+            "conversation_id": row.ConversationId,
+            "created_at": row.CreatedAt.isoformat() if row.CreatedAt else None,
+            "started_at": row.StartedAt.isoformat() if row.StartedAt else None,
+            "finished_at": row.FinishedAt.isoformat() if row.FinishedAt else None,
+            "updated_at": row.UpdatedAt.isoformat() if row.UpdatedAt else None,
+        }
+        if include_result:
+            job["result"] = json.loads(row.Result) if row.Result else None
+        return job
+
+    def get_job(self, job_id: int, include_result: bool = False) -> Optional[Dict[str, Any]]:
+        """獲取工作狀態（可選擇包含結果）"""
+        try:
+            conn = pyodbc.connect(self.conn_str, timeout=5)
+            cursor = conn.cursor()
+
+            cursor.execute("""
+                SELECT Id, JobType, Status, Priority, Progress, ProgressMessage, Attempts, MaxAttempts,
+                       Error, UserId, ConversationId, CreatedAt, StartedAt, FinishedAt, UpdatedAt, Result
+                FROM AgentJobs WHERE Id = ?
+            """, (job_id,))
+
+            row = cursor.fetchone()
+            conn.close()
+            return self._row_to_dict(row, include_result) if row else None
+
+        except Exception as e:
+            print(f"✗ 獲取工作狀態失敗: {e}")
+            return None
+
+    def list_jobs(self, status: str = None, user_id: int = None, limit: int = 50) -> List[Dict[str, Any]]:
+        """列出最近的工作"""
+        conditions, params = [], []
+        if status:
+            conditions.append("Status = ?")
+            params.append(status)
+        if user_id is not None:
+            conditions.append("UserId = ?")
+            params.append(user_id)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        try:
+            conn = pyodbc.connect(self.conn_str, timeout=5)
+            cursor = conn.cursor()
+
+            cursor.execute(f"""
+                SELECT TOP (?) Id, JobType, Status, Priority, Progress, ProgressMessage, Attempts, MaxAttempts,
+                       Error, UserId, ConversationId, CreatedAt, StartedAt, FinishedAt, UpdatedAt
+                FROM AgentJobs {where}
+                ORDER BY Id DESC
+            """, (limit, *params))
+
+            jobs = [self._row_to_dict(row) for row in cursor.fetchall()]
+            conn.close()
+            return jobs
+
+        except Exception as e:
+            print(f"✗ 獲取工作列表失敗: {e}")
+            return []
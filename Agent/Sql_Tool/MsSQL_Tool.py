@@ -1,4 +1,6 @@
 from agents import function_tool
+from Tracing import traced
+import asyncio
 import pyodbc
 import dotenv
 import os
@@ -18,9 +20,10 @@ conn_str = (
     "Connection Timeout=5;"
 )
 
-@function_tool
-def Show_Tables():
-    "Show all tables in the database"
+# pyodbc 為阻塞式呼叫，工具在執行緒中執行，同一回合的多個查詢可同時進行、不阻塞 event loop
+
+@traced("db.tool.show_tables", kind="client")
+def show_tables():
     print("Connecting to database to show tables...")
 
     conn = pyodbc.connect(conn_str, timeout=5)
@@ -43,9 +46,8 @@ def Show_Tables():
     conn.close()
     return Result
 
-@function_tool
-def Query_SQL(Sql:str):
-    "Execute a SQL query and return the results as a list of dictionaries"
+@traced("db.tool.query_sql", kind="client")
+def query_sql(Sql: str):
     print("Connecting to database to execute SQL query...")
     conn = pyodbc.connect(conn_str, timeout=5)
     cur = conn.cursor()
@@ -63,14 +65,24 @@ def Query_SQL(Sql:str):
     conn.close()
     return Result
 
+@function_tool
+async def Show_Tables():
+    "Show all tables in the database"
+    return await asyncio.to_thread(show_tables)
+
+@function_tool
+async def Query_SQL(Sql:str):
+    "Execute a SQL query and return the results as a list of dictionaries"
+    return await asyncio.to_thread(query_sql, Sql)
+
 if __name__ == "__main__":
     print("=== Show Tables ===")
-    tables = Show_Tables()
+    tables = show_tables()
     for t in tables:
         print(t)
 
     print("\n=== Query SQL ===")
     sample_sql = "SELECT TOP 5 * FROM dbo.Equipment_Usage_Cost"  # 請替換為你的表名
-    results = Query_SQL(sample_sql)
+    results = query_sql(sample_sql)
     for r in results:
         print(r)
\ No newline at end of file
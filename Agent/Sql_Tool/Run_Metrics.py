@@ -0,0 +1,229 @@
+from typing import List, Dict, Any, Optional
+from Sql_Tool.Calling_Able import ChatMemoryManager
+from Tracing import traced_methods
+import pyodbc
+import json
+
+RUN_METRICS_GROUPS = {"user": "UserId", "model": "Model", "conversation": "ConversationId"}
+
+@traced_methods("db.run_metrics")
+class RunMetricsManager:
+    """Agent 執行用量紀錄 - 每次執行一筆（tokens、回合數、工具呼叫、等待與總耗時）"""
+
+    def __init__(self, conn_str: str = None):
+        """
+        初始化用量紀錄
+        Args:
+            conn_str: 連線字串（預設與 ChatMemoryManager 相同）
+        """
+        self.conn_str = conn_str or ChatMemoryManager().conn_str
+
+    def initialize_tables(self):
+        """初始化用量紀錄表"""
+        try:
+            conn = pyodbc.connect(self.conn_str, timeout=5)
+            cursor = conn.cursor()
+
+            cursor.execute("""
+                IF NOT EXISTS (SELECT * FROM sys.tables WHERE name = 'AgentRunMetrics')
+                CREATE TABLE AgentRunMetrics (
+                    Id BIGINT IDENTITY(1,1) PRIMARY KEY,
+                    ConversationId INT,
+                    UserId INT,
+                    Model NVARCHAR(200),
+                    Status NVARCHAR(20) NOT NULL,
+                    Error NVARCHAR(2000),
+                    InputTokens INT NOT NULL DEFAULT 0,
+                    OutputTokens INT NOT NULL DEFAULT 0,
+                    TotalTokens INT NOT NULL DEFAULT 0,
+                    Requests INT NOT NULL DEFAULT 0,
+                    Turns INT NOT NULL DEFAULT 0,
+                    ToolCalls INT NOT NULL DEFAULT 0,
+                    ToolMs FLOAT NOT NULL DEFAULT 0,
+                    LlmMs FLOAT NOT NULL DEFAULT 0,
+                    QueueWaitMs FLOAT NOT NULL DEFAULT 0,
+                    WallMs FLOAT NOT NULL DEFAULT 0,
+                    ToolStats NVARCHAR(MAX),
+                    CreatedAt DATETIME DEFAULT GETDATE()
+                )
+            """)
+
+            cursor.execute("""
+                IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'IX_AgentRunMetrics_CreatedAt')
+                CREATE INDEX IX_AgentRunMetrics_CreatedAt ON AgentRunMetrics(CreatedAt)
+                    INCLUDE (UserId, Model, ConversationId, TotalTokens, WallMs)
+            """)
+
+            conn.commit()
+            conn.close()
+            print("✓ 用量紀錄表初始化成功")
+            return True
+
+        except Exception as e:
+            print(f"✗ 用量紀錄表初始化失敗: {e}")
+            return False
+
+    def record(self, conversation_id: int, user_id: Optional[int], model: str, metrics: Dict[str, Any]) -> bool:
+        """
+        寫入一次執行的用量
+        Args:
+            conversation_id / user_id / model: 分析維度
+            metrics: RunAccounting.summary() 的結果
+        """
+        try:
+            conn = pyodbc.connect(self.conn_str, timeout=5)
+            cursor = conn.cursor()
+
+            cursor.execute("""
+                INSERT INTO AgentRunMetrics
+                    (ConversationId, UserId, Model, Status, Error, InputTokens, OutputTokens, TotalTokens,
+                     Requests, Turns, ToolCalls, ToolMs, LlmMs, QueueWaitMs, WallMs, ToolStats)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (conversation_id, user_id, model, metrics["status"], metrics.get("error"),
+                  metrics["input_tokens"], metrics["output_tokens"], metrics["total_tokens"],
+                  metrics["requests"], metrics["turns"], metrics["tool_calls"], metrics["tool_ms"],
+                  metrics["llm_ms"], metrics["queue_wait_ms"], metrics["wall_ms"],
+                  json.dumps(metrics.get("tools") or {}, ensure_ascii=False)))
+
+            conn.commit()
+            conn.close()
+            return True
+
+        except Exception as e:
+            print(f"✗ 寫入用量紀錄失敗: {e}")
+            return False
+
+    def _filters(self, hours: float, user_id: int = None, model: str = None, conversation_id: int = None):
+        conditions, params = ["m.CreatedAt >= DATEADD(SECOND, ?, GETDATE())"], [-int(hours * 3600)]
+        if user_id is not None:
+            conditions.append("m.UserId = ?")
+            params.append(user_id)
+        if model:
+            conditions.append("m.Model = ?")
+            params.append(model)
+        if conversation_id is not None:
+            conditions.append("m.ConversationId = ?")
+            params.append(conversation_id)
+        return "WHERE " + " AND ".join(conditions), params
+
+    def aggregate(self, group_by: str = "model", hours: float = 24, user_id: int = None,
+                  model: str = None, conversation_id: int = None, limit: int = 50) -> Dict[str, Any]:
+        """
+        彙總用量
+        Args:
+            group_by: user / model / conversation
+            hours: 統計最近幾小時
+            user_id / model / conversation_id: 篩選條件
+            limit: 依總 tokens 排序後回傳的組數
+        Returns:
+            dict: {"groups": [...], "tools": [...]}
+        """
+        column = RUN_METRICS_GROUPS[group_by]
+        where, params = self._filters(hours, user_id, model, conversation_id)
+
+        try:
+            conn = pyodbc.connect(self.conn_str, timeout=5)
+            cursor = conn.cursor()
+
+            cursor.execute(f"""
+                SELECT TOP (?) m.{column} AS GroupKey,
+                       COUNT(*) AS Runs,
+                       SUM(CASE WHEN m.Status = 'error' THEN 1 ELSE 0 END) AS Errors,
+                       SUM(CAST(m.InputTokens AS BIGINT)) AS InputTokens,
+                       SUM(CAST(m.OutputTokens AS BIGINT)) AS OutputTokens,
+                       SUM(CAST(m.TotalTokens AS BIGINT)) AS TotalTokens,
+                       SUM(m.Turns) AS Turns,
+                       SUM(m.ToolCalls) AS ToolCalls,
+                       AVG(m.WallMs) AS AvgWallMs,
+                       MAX(m.WallMs) AS MaxWallMs,
+                       AVG(m.QueueWaitMs) AS AvgQueueWaitMs,
+                       SUM(m.WallMs) AS TotalWallMs
+                FROM AgentRunMetrics m {where}
+                GROUP BY m.{column}
+                ORDER BY TotalTokens DESC
+            """, (limit, *params))
+
+            groups = [{
+                group_by: row.GroupKey,
+                "runs": row.Runs,
+                "errors": row.Errors,
+                "input_tokens": int(row.InputTokens or 0),
+                "output_tokens": int(row.OutputTokens or 0),
+                "total_tokens": int(row.TotalTokens or 0),
+                "turns": row.Turns,
+                "tool_calls": row.ToolCalls,
+                "avg_wall_ms": round(row.AvgWallMs or 0, 1),
+                "max_wall_ms": round(row.MaxWallMs or 0, 1),
+                "avg_queue_wait_ms": round(row.AvgQueueWaitMs or 0, 1),
+                "total_wall_ms": round(row.TotalWallMs or 0, 1),
+            } for row in cursor.fetchall()]
+
+            # 工具統計存為 JSON 物件 {工具名稱: {"calls", "duration_ms"}}，以 OPENJSON 展開後彙總
+            cursor.execute(f"""
+                SELECT t.[key] AS Tool,
+                       SUM(CAST(JSON_VALUE(t.value, '$.calls') AS INT)) AS Calls,
+                       SUM(CAST(JSON_VALUE(t.value, '$.duration_ms') AS FLOAT)) AS DurationMs
+                FROM AgentRunMetrics m
+                CROSS APPLY OPENJSON(m.ToolStats) t
+                {where}
+                GROUP BY t.[key]
+                ORDER BY DurationMs DESC
+            """, params)
+
+            tools = [{
+                "tool": row.Tool,
+                "calls": row.Calls,
+                "duration_ms": round(row.DurationMs or 0, 1),
+                "avg_ms": round((row.DurationMs or 0) / row.Calls, 1) if row.Calls else None,
+            } for row in cursor.fetchall()]
+
+            conn.close()
+            return {"groups": groups, "tools": tools}
+
+        except Exception as e:
+            print(f"✗ 彙總用量失敗: {e}")
+            return {"groups": [], "tools": []}
+
+    def recent(self, limit: int = 50, user_id: int = None, model: str = None,
+               conversation_id: int = None, hours: float = 24) -> List[Dict[str, Any]]:
+        """最近的執行紀錄"""
+        where, params = self._filters(hours, user_id, model, conversation_id)
+
+        try:
+            conn = pyodbc.connect(self.conn_str, timeout=5)
+            cursor = conn.cursor()
+
+            cursor.execute(f"""
+                SELECT TOP (?) m.Id, m.ConversationId, m.UserId, m.Model, m.Status, m.Error, m.InputTokens,
+                       m.OutputTokens, m.TotalTokens, m.Turns, m.ToolCalls, m.ToolMs, m.LlmMs, m.QueueWaitMs,
+                       m.WallMs, m.ToolStats, m.CreatedAt
+                FROM AgentRunMetrics m {where}
+                ORDER BY m.Id DESC
+            """, (limit, *params))
+
+            runs = [{
+                "run_id": int(row.Id),
+                "conversation_id": row.ConversationId,
+                "user_id": row.UserId,
+                "model": row.Model,
+                "status": row.Status,
+                "error": row.Error,
+                "input_tokens": row.InputTokens,
+                "output_tokens": row.OutputTokens,
+                "total_tokens": row.TotalTokens,
+                "turns": row.Turns,
+                "tool_calls": row.ToolCalls,
+                "tool_ms": row.ToolMs,
+                "llm_ms": row.LlmMs,
+                "queue_wait_ms": row.QueueWaitMs,
+                "wall_ms": row.WallMs,
+                "tools": json.loads(row.ToolStats) if row.ToolStats else {},
+                "created_at": row.CreatedAt.isoformat() if row.CreatedAt else None,
+            } for row in cursor.fetchall()]
+
+            conn.close()
+            return runs
+
+        except Exception as e:
+            print(f"✗ 獲取用量紀錄失敗: {e}")
+            return []
@@ -0,0 +1,201 @@
+from typing import Any, Dict, Optional, Tuple
+from collections import OrderedDict
+import threading
+import queue
+import json
+import time
+import os
+
+STATE_STORE = os.getenv("STATE_STORE", "memory").lower()   # memory / redis / redis-local
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+STATE_PREFIX = os.getenv("STATE_PREFIX", "best_agent:")
+STATE_REFRESH_SECONDS = float(os.getenv("STATE_REFRESH_SECONDS", "2"))   # 本機快取向 Redis 重新同步的間隔
+STATE_CACHE_MAX_ENTRIES = int(os.getenv("STATE_CACHE_MAX_ENTRIES", "1024"))  # 本機快取上限（LRU）
+STATE_CACHE_IDLE_SECONDS = float(os.getenv("STATE_CACHE_IDLE_SECONDS", "300"))  # 多久未讀取的鍵從本機快取移除
+
+class InMemoryStateStore:
+    """單一行程使用的狀態儲存（預設）"""
+
+    def __init__(self):
+        self._data: Dict[str, Tuple[Any, Optional[float]]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.time():
+                del self._data[key]
+                return default
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = None):
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl if ttl else None)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+class LocalRedisClient:
+    """
+    Redis 用戶端的本機替身（測試或無 Redis 時使用）
+    只實作 RedisStateStore 需要的 get / set / delete，行為與 redis-py 相同（回傳 bytes）
+    """
+
+    def __init__(self):
+        self._store = InMemoryStateStore()
+
+    def get(self, name: str) -> Optional[bytes]:
+        return self._store.get(name)
+
+    def set(self, name: str, value, ex: Optional[int] = None):
+        self._store.set(name, value.encode("utf-8") if isinstance(value, str) else value, ex)
+        return True
+
+    def delete(self, *names: str) -> int:
+        for name in names:
+            self._store.delete(name)
+        return len(names)
+
+class RedisStateStore:
+    """
+    多個 worker / replica 共用的狀態儲存
+    redis-py 為同步呼叫，而 get / set 會在 event loop 上被呼叫，因此：
+    - 讀取優先回傳本機快取，由背景執行緒每 STATE_REFRESH_SECONDS 秒向 Redis 重新同步
+    - 寫入先更新本機快取，再交由背景執行緒寫入 Redis
+    - 本機快取以 LRU 限制數量，超過 STATE_CACHE_IDLE_SECONDS 未讀取的鍵會移除
+    - 不在本機快取中的鍵（第一次讀取或已移除）直接查詢 Redis（受 socket_timeout 限制）
+    Args:
+        client: 具 get / set / delete 的 Redis 用戶端（可注入 LocalRedisClient）
+        url: 未提供 client 時連線的 Redis 位址
+        prefix: 鍵值前綴
+        refresh_seconds: 本機快取的同步間隔
+        max_entries: 本機快取上限
+        idle_seconds: 未讀取多久後從本機快取移除
+    """
+
+    _MISSING = object()
+
+    def __init__(self, client=None, url: str = REDIS_URL, prefix: str = STATE_PREFIX,
+                 refresh_seconds: float = STATE_REFRESH_SECONDS, max_entries: int = STATE_CACHE_MAX_ENTRIES,
+                 idle_seconds: float = STATE_CACHE_IDLE_SECONDS):
+        if client is None:
+            import redis  # 只有使用 Redis 時才需要安裝
+            client = redis.Redis.from_url(url, socket_timeout=2, socket_connect_timeout=2)
+        self.client = client
+        self.prefix = prefix
+        self.refresh_seconds = refresh_seconds
+        self.max_entries = max(1, max_entries)
+        self.idle_seconds = idle_seconds
+        # key -> [值或 _MISSING, 到期時間, 最後讀取時間]
+        self._cache: "OrderedDict[str, list]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes: "queue.Queue[Tuple[str, str, Any, Optional[int]]]" = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="state-store-sync", daemon=True)
+        self._worker.start()
+
+    def _fetch(self, key: str) -> Any:
+        raw = self.client.get(self.prefix + key)
+        return self._MISSING if raw is None else json.loads(raw)
+
+    def _put(self, key: str, value: Any, expires_at: Optional[float]):
+        """寫入本機快取（需持有 self._lock），超過上限時移除最久未使用的鍵"""
+        self._cache[key] = [value, expires_at, time.time()]
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        now = time.time()
+        with self._lock:
+            item = self._cache.get(key)
+            if item is not None and (item[1] is None or item[1] > now):
+                item[2] = now
+                self._cache.move_to_end(key)
+                return default if item[0] is self._MISSING else item[0]
+        try:
+            value = self._fetch(key)
+        except Exception as e:
+            print(f"✗ State store 讀取失敗 ({key}): {e}")
+            return default
+        with self._lock:
+            self._put(key, value, None)
+        return default if value is self._MISSING else value
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = None):
+        with self._lock:
+            self._put(key, value, time.time() + ttl if ttl else None)
+            self._writes.put(("set", key, value, ttl))
+
+    def delete(self, key: str):
+        with self._lock:
+            self._put(key, self._MISSING, None)
+            self._writes.put(("delete", key, None, None))
+
+    def flush(self, timeout: float = 5.0):
+        """等待尚未寫入 Redis 的變更完成（關閉或測試時使用）"""
+        deadline = time.time() + timeout
+        while self._writes.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.01)
+
+    def _write(self, op: str, key: str, value: Any, ttl: Optional[int]):
+        if op == "set":
+            self.client.set(self.prefix + key, json.dumps(value, ensure_ascii=False), ex=ttl)
+        else:
+            self.client.delete(self.prefix + key)
+
+    def _refresh(self):
+        """移除過期或閒置的鍵，其餘重新讀取（其他 worker 的變更在下一輪同步後可見）"""
+        now = time.time()
+        with self._lock:
+            for key in [k for k, (_, expires_at, used_at) in self._cache.items()
+                        if (expires_at is not None and expires_at <= now) or now - used_at > self.idle_seconds]:
+                del self._cache[key]
+            keys = list(self._cache)
+        for key in keys:
+            value = self._fetch(key)
+            with self._lock:
+                if self._writes.unfinished_tasks:
+                    return  # 本行程尚有變更未寫入，避免讀回的舊值覆蓋
+                if key in self._cache:
+                    self._cache[key][0] = value
+
+    def _run(self):
+        next_refresh = time.time() + self.refresh_seconds
+        while True:
+            try:
+                op, key, value, ttl = self._writes.get(timeout=max(0.0, next_refresh - time.time()))
+            except queue.Empty:
+                try:
+                    self._refresh()
+                except Exception as e:
+                    print(f"✗ State store 同步失敗: {e}")
+                next_refresh = time.time() + self.refresh_seconds
+                continue
+            try:
+                self._write(op, key, value, ttl)
+            except Exception as e:
+                print(f"✗ State store 寫入失敗 ({key}): {e}")
+            finally:
+                self._writes.task_done()
+
+_state_store = None
+_state_lock = threading.Lock()
+
+def get_state_store():
+    """依 STATE_STORE 建立共用的狀態儲存"""
+    global _state_store
+    if _state_store is None:
+        with _state_lock:
+            if _state_store is None:
+                if STATE_STORE == "redis":
+                    _state_store = RedisStateStore()
+                elif STATE_STORE == "redis-local":
+                    _state_store = RedisStateStore(client=LocalRedisClient())
+                else:
+                    _state_store = InMemoryStateStore()
+                print(f"✓ State store: {type(_state_store).__name__} ({STATE_STORE})")
+    return _state_store
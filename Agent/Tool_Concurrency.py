@@ -0,0 +1,42 @@
+from typing import Any, Optional
+from contextlib import contextmanager
+from contextvars import ContextVar
+import dataclasses
+import asyncio
+import os
+
+TOOL_CONCURRENCY = int(os.getenv("TOOL_CONCURRENCY", "4"))   # 單次 Agent 執行中同時執行的工具呼叫上限
+
+_tool_slots: ContextVar[Optional[asyncio.Semaphore]] = ContextVar("tool_slots", default=None)
+
+@contextmanager
+def tool_slots(limit: int = TOOL_CONCURRENCY):
+    """
+    為一次 Agent 執行設定工具並行上限
+    Runner 在同一回合中以多個 task 同時執行工具呼叫，task 會繼承此 context，共用同一個 semaphore；
+    回合依序進行，因此也等於每回合的上限
+    """
+    token = _tool_slots.set(asyncio.Semaphore(max(1, limit)))
+    try:
+        yield
+    finally:
+        _tool_slots.reset(token)
+
+def bounded_tool(tool: Any) -> Any:
+    """
+    回傳受並行上限約束的 FunctionTool 副本（未設定 tool_slots 時不限制）
+    非 FunctionTool（沒有 on_invoke_tool）則原樣回傳
+    """
+    invoke = getattr(tool, "on_invoke_tool", None)
+    if invoke is None or getattr(invoke, "__bounded__", False) or not dataclasses.is_dataclass(tool):
+        return tool
+
+    async def on_invoke_tool(ctx, args):
+        slots = _tool_slots.get()
+        if slots is None:
+            return await invoke(ctx, args)
+        async with slots:
+            return await invoke(ctx, args)
+
+    on_invoke_tool.__bounded__ = True
+    return dataclasses.replace(tool, on_invoke_tool=on_invoke_tool)
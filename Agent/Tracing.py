@@ -0,0 +1,288 @@
+from typing import Any, Callable, Dict, List, Optional
+from contextlib import contextmanager
+from collections import deque
+from contextvars import ContextVar
+from pathlib import Path
+import dataclasses
+import functools
+import threading
+import inspect
+import queue
+import random
+import json
+import time
+import os
+
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "true").lower() == "true"
+TRACE_FILE = Path(os.getenv("TRACE_FILE", "logs/traces.jsonl"))
+TRACE_FILE_MAX_BYTES = int(os.getenv("TRACE_FILE_MAX_BYTES", str(50 * 1024 * 1024)))  # 超過時輪替為 .1
+TRACE_FILE_MIN_MS = float(os.getenv("TRACE_FILE_MIN_MS", "0"))    # 只寫入總耗時超過此值的 trace
+TRACE_KEEP = int(os.getenv("TRACE_KEEP", "500"))                  # 記憶體中保留最近幾個 trace
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "1000"))       # 單一 trace 最多記錄的 span 數
+TRACE_SERVICE = os.getenv("TRACE_SERVICE", "best-agent")
+TRACE_QUEUE_SIZE = int(os.getenv("TRACE_QUEUE_SIZE", "1000"))    # 等待寫檔的 trace 上限（滿時丟棄）
+TRACE_ORPHAN_SECONDS = 600  # 根 span 結束後才結束的子 span（例如背景工作）保留的時間
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+_listeners: List[Any] = []   # 具 on_start(span) / on_end(span) 的物件，例如 Metrics.SpanMetrics
+
+def add_span_listener(listener: Any):
+    """註冊 span 開始 / 結束事件（包含不寫入 trace 的 span，可用於指標統計）"""
+    _listeners.append(listener)
+
+def _notify(event: str, span: "Span"):
+    for listener in _listeners:
+        try:
+            getattr(listener, event)(span)
+        except Exception as e:
+            print(f"✗ span listener 失敗: {e}")
+
+class Span:
+    """
+    一段計時區間（欄位對應 OTLP JSON 的 span）
+    detached=True 時只通知 listener、不寫入 trace（未啟用追蹤，或不在任何請求中的資料庫操作）
+    """
+
+    def __init__(self, name: str, parent: Optional["Span"] = None, kind: str = "internal",
+                 detached: bool = False, **attributes):
+        self.name = name
+        self.kind = kind
+        self.detached = detached or (parent is not None and parent.detached)
+        self.trace_id = parent.trace_id if parent else f"{random.getrandbits(128):032x}"
+        self.span_id = f"{random.getrandbits(64):016x}"  # 不需密碼學強度，避免每個 span 一次系統呼叫
+        self.parent_id = parent.span_id if parent else None
+        self.parent_name = parent.name if parent else None
+        self.attributes: Dict[str, Any] = {k: v for k, v in attributes.items() if v is not None}
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.error: Optional[str] = None
+        _notify("on_start", self)
+
+    def set(self, **attributes):
+        self.attributes.update({k: v for k, v in attributes.items() if v is not None})
+
+    def end(self, error: Exception = None):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"[:1000]
+        _notify("on_end", self)
+        if not self.detached:
+            recorder.on_end(self)
+
+    @property
+    def duration_ms(self) -> float:
+        return round(((self.end_ns or time.time_ns()) - self.start_ns) / 1e6, 2)
+
+    def to_otlp(self) -> Dict[str, Any]:
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "durationMs": self.duration_ms,
+            "attributes": [{"key": k, "value": {"stringValue": str(v)}} for k, v in self.attributes.items()],
+            "status": {"code": "ERROR", "message": self.error} if self.error else {"code": "OK"},
+        }
+
+class TraceRecorder:
+    """
+    收集 span，根 span 結束時將整個 trace 寫入 JSONL（每行一個 OTLP 格式的 span）並保留在記憶體
+    寫檔由背景執行緒進行，on_end 可能在 event loop 上被呼叫，不做檔案 I/O
+    """
+
+    def __init__(self, path: Path = TRACE_FILE, keep: int = TRACE_KEEP):
+        self.path = path
+        self._open: Dict[str, Dict[str, Any]] = {}   # trace_id -> {"seen": 建立時間, "spans": [...]}
+        self._recent: "deque[Dict[str, Any]]" = deque(maxlen=keep)
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue[List[Span]]" = queue.Queue(maxsize=TRACE_QUEUE_SIZE)
+        self._writer: Optional[threading.Thread] = None
+        self.dropped = 0
+
+    def on_end(self, span: Span):
+        with self._lock:
+            spans = self._open.setdefault(span.trace_id, {"seen": time.time(), "spans": []})["spans"]
+            if len(spans) < TRACE_MAX_SPANS:
+                spans.append(span)
+            if span.parent_id is not None:
+                return
+            del self._open[span.trace_id]
+            expired = time.time() - TRACE_ORPHAN_SECONDS
+            for trace_id in [k for k, v in self._open.items() if v["seen"] < expired]:
+                del self._open[trace_id]
+            trace = {
+                "trace_id": span.trace_id,
+                "name": span.name,
+                "attributes": span.attributes,
+                "error": span.error,
+                "start": span.start_ns / 1e9,
+                "duration_ms": span.duration_ms,
+                "spans": spans,
+            }
+            self._recent.append(trace)
+        if span.duration_ms >= TRACE_FILE_MIN_MS:
+            self._enqueue(spans)
+
+    def _enqueue(self, spans: List[Span]):
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run, name="trace-writer", daemon=True)
+                self._writer.start()
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self, timeout: float = 5.0):
+        """等待已結束的 trace 寫入檔案（關閉或測試時使用）"""
+        deadline = time.time() + timeout
+        while self._queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.01)
+
+    def _run(self):
+        while True:
+            spans = self._queue.get()
+            try:
+                self._write(spans)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, spans: List[Span]):
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            if self.path.exists() and self.path.stat().st_size > TRACE_FILE_MAX_BYTES:
+                self.path.replace(self.path.with_suffix(self.path.suffix + ".1"))
+            with open(self.path, "a", encoding="utf-8") as f:
+                for span in spans:
+                    f.write(json.dumps({"resource": {"service.name": TRACE_SERVICE}, **span.to_otlp()},
+                                       ensure_ascii=False, default=str) + "\n")
+        except OSError as e:
+            print(f"✗ 寫入 trace 失敗: {e}")
+
+    @staticmethod
+    def _summary(trace: Dict[str, Any]) -> Dict[str, Any]:
+        # 依名稱彙總子 span 耗時，快速看出時間花在哪一類操作
+        breakdown: Dict[str, Dict[str, float]] = {}
+        for span in trace["spans"]:
+            if span.parent_id is None:
+                continue
+            item = breakdown.setdefault(span.name, {"count": 0, "total_ms": 0.0})
+            item["count"] += 1
+            item["total_ms"] = round(item["total_ms"] + span.duration_ms, 2)
+        return {
+            "trace_id": trace["trace_id"],
+            "name": trace["name"],
+            "attributes": trace["attributes"],
+            "error": trace["error"],
+            "start": trace["start"],
+            "duration_ms": trace["duration_ms"],
+            "span_count": len(trace["spans"]),
+            "breakdown": dict(sorted(breakdown.items(), key=lambda kv: -kv[1]["total_ms"])),
+        }
+
+    def slowest(self, limit: int = 20, minutes: float = None, name: str = None) -> List[Dict[str, Any]]:
+        """最近的 trace 中最慢的幾個"""
+        since = time.time() - minutes * 60 if minutes else 0
+        with self._lock:
+            traces = [t for t in self._recent if t["start"] >= since and (not name or name in t["name"])]
+        traces.sort(key=lambda t: -t["duration_ms"])
+        return [self._summary(t) for t in traces[:limit]]
+
+    def get(self, trace_id: str) -> Optional[Dict[str, Any]]:
+        """單一 trace 的所有 span（依開始時間排序）"""
+        with self._lock:
+            trace = next((t for t in self._recent if t["trace_id"] == trace_id), None)
+        if trace is None:
+            return None
+        return {**self._summary(trace),
+                "spans": [s.to_otlp() for s in sorted(trace["spans"], key=lambda s: s.start_ns)]}
+
+recorder = TraceRecorder()
+
+# ==================== API ====================
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+def start_span(name: str, parent: Optional[Span] = None, kind: str = "internal", **attributes) -> Span:
+    """
+    開始一個不設定為目前 span 的 span（用於開始與結束在不同 callback 的情況，例如 RunHooks）
+    需自行呼叫 end()；未啟用或沒有上層 span 時不寫入 trace
+    """
+    parent = parent or _current_span.get()
+    return Span(name, parent, kind, not TRACE_ENABLED or parent is None, **attributes)
+
+@contextmanager
+def span(name: str, kind: str = "internal", root: bool = True, **attributes):
+    """
+    計時區塊（sync / async 皆可使用，子 span 透過 contextvars 自動找到上層）
+    Args:
+        name: span 名稱
+        kind: server / client / internal
+        root: False 時只在已有 trace 的情況下記錄（例如背景輪詢的資料庫操作不單獨成為 trace）
+    """
+    parent = _current_span.get()
+    current = Span(name, parent, kind, not TRACE_ENABLED or (parent is None and not root), **attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.end(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end()
+
+def traced(name: str = None, kind: str = "internal", root: bool = False):
+    """以 span 包住函數（支援 async 函數）"""
+    def decorator(func: Callable) -> Callable:
+        span_name = name or func.__qualname__
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name, kind, root):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name, kind, root):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def traced_methods(prefix: str, kind: str = "client"):
+    """
+    類別裝飾器：所有公開方法加上 span（名稱為 prefix.方法名稱）
+    用於資料庫管理類別，只在請求的 trace 中寫入 trace（指標仍會統計）
+    """
+    def decorator(cls):
+        for attr, value in list(vars(cls).items()):
+            if attr.startswith("_") or not inspect.isfunction(value):
+                continue
+            setattr(cls, attr, traced(f"{prefix}.{attr}", kind)(value))
+        return cls
+    return decorator
+
+def traced_tool(tool: Any) -> Any:
+    """
+    回傳包上 span 的 FunctionTool 副本（工具內的資料庫與 HTTP 呼叫會成為其子 span）
+    非 FunctionTool（沒有 on_invoke_tool）則原樣回傳
+    """
+    invoke = getattr(tool, "on_invoke_tool", None)
+    if invoke is None or getattr(invoke, "__traced__", False) or not dataclasses.is_dataclass(tool):
+        return tool
+
+    async def on_invoke_tool(ctx, args):
+        with span(f"tool.{tool.name}", root=False, tool=tool.name) as current:
+            result = await invoke(ctx, args)
+            current.set(result_chars=len(str(result)))
+            return result
+
+    on_invoke_tool.__traced__ = True
+    return dataclasses.replace(tool, on_invoke_tool=on_invoke_tool)
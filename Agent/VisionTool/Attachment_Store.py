@@ -0,0 +1,128 @@
+from typing import Any, Dict, Optional
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from State_Store import get_state_store
+import base64
+import mimetypes
+import mmap
+import secrets
+import threading
+import os
+
+ATTACHMENT_MAX_ENTRIES = int(os.getenv("ATTACHMENT_MAX_ENTRIES", "10000"))
+ATTACHMENT_PREFIX = "att_"
+ATTACHMENT_TTL_SECONDS = int(os.getenv("ATTACHMENT_TTL_SECONDS", str(7 * 24 * 3600)))
+# 額外允許讀取的目錄（以 os.pathsep 分隔，本機測試用）；上傳目錄、blob 與頁面快取由各模組以 allow_root() 登記
+ATTACHMENT_ROOTS = [Path(p) for p in os.getenv("ATTACHMENT_ROOTS", "").split(os.pathsep) if p]
+
+class AttachmentStore:
+    """
+    附件參照 - 工具只回傳短 ID，圖片內容在送出視覺請求時才從磁碟 mmap 讀取
+    ID 同時寫入共用狀態，其他 worker / replica 也能解析（本機 LRU 作為快取）
+    """
+
+    def __init__(self, max_entries: int = ATTACHMENT_MAX_ENTRIES, state=None, roots=ATTACHMENT_ROOTS):
+        self.max_entries = max_entries
+        self.state = state or get_state_store()
+        self.roots = [Path(root).resolve() for root in roots]   # 只允許讀取這些目錄下的檔案
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._by_path: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def allow_root(self, root: Path):
+        """允許讀取某個目錄下的檔案（上傳目錄、blob 區、頁面快取）"""
+        root = Path(root).resolve()
+        if root not in self.roots:
+            self.roots.append(root)
+
+    def check_path(self, path: str) -> Path:
+        """路徑必須位於允許的目錄下，否則拋出 ValueError（不讀取伺服器上的任意檔案）"""
+        file_path = Path(path).resolve()
+        if not any(file_path.is_relative_to(root) for root in self.roots):
+            raise ValueError(f"不允許存取的路徑：{path}")
+        return file_path
+
+    def register(self, path: str, name: str = None) -> Dict[str, Any]:
+        """
+        登記檔案並回傳參照資訊（同一路徑重複登記會得到同一個 ID）
+        Args:
+            path: 檔案路徑
+            name: 顯示檔名（內容定址的 blob 沒有副檔名，以原始檔名推測 MIME）
+        """
+        file_path = self.check_path(path)
+        if not file_path.is_file():
+            raise FileNotFoundError(f"找不到檔案：{path}")
+
+        shared_id = None
+        if str(file_path) not in self._by_path:
+            shared_id = self.state.get(f"attachment_path:{file_path}")
+
+        with self._lock:
+            attachment_id = self._by_path.get(str(file_path)) or shared_id
+            if attachment_id is None:
+                attachment_id = ATTACHMENT_PREFIX + secrets.token_hex(6)
+            self._by_path[str(file_path)] = attachment_id
+            self._entries[attachment_id] = {
+                "attachment_id": attachment_id,
+                "path": str(file_path),
+                "name": name or file_path.name,
+                "size": file_path.stat().st_size,
+                "mime": mimetypes.guess_type(name or file_path.name)[0] or "application/octet-stream",
+                "registered_at": datetime.now().isoformat(),
+            }
+            self._entries.move_to_end(attachment_id)
+            while len(self._entries) > self.max_entries:
+                _, old = self._entries.popitem(last=False)
+                self._by_path.pop(old["path"], None)
+            entry = dict(self._entries[attachment_id])
+
+        self.state.set(f"attachment:{attachment_id}", entry, ttl=ATTACHMENT_TTL_SECONDS)
+        self.state.set(f"attachment_path:{file_path}", attachment_id, ttl=ATTACHMENT_TTL_SECONDS)
+        return entry
+
+    def get(self, attachment_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(attachment_id)
+            if entry:
+                return dict(entry)
+        # 由其他 worker 登記的附件
+        return self.state.get(f"attachment:{attachment_id}")
+
+    def resolve(self, ref: str) -> str:
+        """
+        將附件 ID 或路徑轉成檔案路徑
+        路徑（以及附件登記的路徑）必須位於允許的目錄下，否則拋出 ValueError
+        """
+        if ref.startswith(ATTACHMENT_PREFIX):
+            entry = self.get(ref.strip())
+            if entry is None:
+                raise FileNotFoundError(f"找不到附件：{ref}")
+            ref = entry["path"]
+        return str(self.check_path(ref))
+
+attachment_store = AttachmentStore()
+
+@contextmanager
+def map_file(path: str):
+    """唯讀 mmap 檔案內容（空檔案回傳空 bytes）"""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield mm
+
+def encode_file_b64(path: str) -> str:
+    """直接對 mmap 做 base64，避免先把整個檔案讀成 bytes 再複製一次"""
+    with map_file(path) as data:
+        return base64.b64encode(data).decode("ascii")
+
+if __name__ == "__main__":
+    import sys
+
+    path = sys.argv[1] if len(sys.argv) > 1 else __file__
+    info = attachment_store.register(path)
+    print(info)
+    print(len(encode_file_b64(attachment_store.resolve(info["attachment_id"]))))
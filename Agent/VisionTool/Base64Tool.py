@@ -1,30 +1,47 @@
 from agents import function_tool
-from pathlib import Path
-import base64
+from typing import Any, Dict
+from VisionTool.Attachment_Store import attachment_store, encode_file_b64, ATTACHMENT_PREFIX
+from File_Tool.Blob_Store import resolve_source
+import asyncio
 
 @function_tool
+async def Image_Reference(image_path: str) -> Dict[str, Any]:
+    """
+    Register an image file and return a short attachment ID instead of its contents.
+    Pass the attachment_id to Vision_Tool / Vision_Document_Tool as the image path.
+
+    Args:
+        image_path: Path of an image inside the upload folder, or SHA-256 of an uploaded file
+    """
+    def register() -> Dict[str, Any]:
+        # 路徑由模型指定，只接受上傳過的內容
+        source = resolve_source(image_path)
+        return attachment_store.get(source) if source.startswith(ATTACHMENT_PREFIX) else attachment_store.register(source)
+
+    try:
+        info = await asyncio.to_thread(register)  # 讀取檔案資訊為阻塞式 I/O
+    except (FileNotFoundError, ValueError) as e:
+        return {"error": str(e)}
+    return {k: info[k] for k in ("attachment_id", "name", "size", "mime")}
+
 def image_to_base64(image_path: str) -> str:
     """
-    image_to_base64 的 Docstring
-    
-    :param image_path: 說明
+    將圖片（路徑或附件 ID）轉為 base64，僅供組視覺請求使用，不要當成工具結果回傳給 LLM
+
+    :param image_path: 圖片路徑或附件 ID
     :type image_path: str
-    :return: 說明
+    :return: base64 字串
     :rtype: str
     """
-    path = Path(image_path)
-    if not path.exists():
-        raise FileNotFoundError(f"找不到檔案：{path}")
-
-    with open(path, "rb") as f:
-        return base64.b64encode(f.read()).decode("utf-8")
+    return encode_file_b64(attachment_store.resolve(image_path))
 
 if __name__ == "__main__":
     test_image_path = r"E:\CODY\Program\Industry\BEST\Figure\1AE-00166_p001.png"  # 替換成你的測試圖片路徑
     try:
-        b64_string = image_to_base64(test_image_path)
-        print(type(b64_string))
+        info = attachment_store.register(test_image_path)
+        print(info)
+        b64_string = image_to_base64(info["attachment_id"])
         print(len(b64_string))
         print(b64_string[:100] + "...")  # 只打印前100個字元以避免輸出過長
     except FileNotFoundError as e:
-        print(e)
\ No newline at end of file
+        print(e)
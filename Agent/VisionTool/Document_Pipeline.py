@@ -0,0 +1,172 @@
+from typing import Any, Dict, List, Optional
+from pathlib import Path
+from VisionTool.Vision_Client import analyze_image, emit, DeltaCallback, VISION_MAX_CONCURRENCY, vision_stream_sink
+from VisionTool.Image_Preprocess import get_pool
+from VisionTool.Attachment_Store import attachment_store
+from VisionTool.Vision_Cache import sha256_file
+import asyncio
+import shutil
+import uuid
+import re
+import time
+import os
+
+VISION_DOCUMENT_CONCURRENCY = int(os.getenv("VISION_DOCUMENT_CONCURRENCY", str(VISION_MAX_CONCURRENCY)))
+VISION_PDF_DPI = int(os.getenv("VISION_PDF_DPI", "150"))
+# PDF 渲染後的頁面依內容雜湊存放（pages/ab/<sha256>/dpi150/page_p001.png），不寫進 PDF 所在的資料夾
+VISION_PAGE_DIR = Path(os.getenv("VISION_PAGE_DIR", "./vision_cache/pages"))
+attachment_store.allow_root(VISION_PAGE_DIR)
+SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg", ".webp", ".bmp", ".tif", ".tiff"}
+PAGE_PATTERN = re.compile(r"^(?P<stem>.+)_p(?P<page>\d+)$", re.IGNORECASE)
+
+def page_number(path: Path) -> int:
+    match = PAGE_PATTERN.match(path.stem)
+    return int(match.group("page")) if match else 0
+
+def find_page_images(path: Path) -> List[Path]:
+    """
+    找出同一份圖面的所有頁面
+    - xxx_p001.png -> 同資料夾下所有 xxx_pNNN.*
+    - 資料夾 -> 資料夾內所有圖片
+    - 其他圖片 -> 單頁
+    """
+    if path.is_dir():
+        pages = [p for p in path.iterdir() if p.suffix.lower() in IMAGE_SUFFIXES]
+        return sorted(pages, key=lambda p: (page_number(p), p.name))
+
+    match = PAGE_PATTERN.match(path.stem)
+    if not match:
+        return [path]
+    pages = [p for p in path.parent.glob(f"{glob_escape(match.group('stem'))}_p*")
+             if p.suffix.lower() in IMAGE_SUFFIXES and PAGE_PATTERN.match(p.stem)]
+    return sorted(pages, key=page_number)
+
+def is_pdf(path: Path) -> bool:
+    """依副檔名或檔頭判斷 PDF（內容定址的 blob 沒有副檔名）"""
+    if path.suffix.lower() == ".pdf":
+        return True
+    if path.suffix or not path.is_file():
+        return False
+    with open(path, "rb") as f:
+        return f.read(5) == b"%PDF-"
+
+def glob_escape(text: str) -> str:
+    return re.sub(r"([\[\]*?])", r"[\1]", text)
+
+def pdf_page_count(pdf_path: str) -> int:
+    import fitz  # PyMuPDF
+
+    with fitz.open(pdf_path) as doc:
+        return doc.page_count
+
+def render_pdf_page(pdf_path: str, index: int, out_path: str, dpi: int) -> str:
+    """在子行程中渲染單頁；先寫入暫存檔再改名，同時渲染同一份 PDF 也不會讀到寫到一半的檔案"""
+    import fitz  # PyMuPDF
+
+    target = Path(out_path)
+    temp_path = target.with_name(f".{target.stem}.{uuid.uuid4().hex}{target.suffix}")
+    try:
+        with fitz.open(pdf_path) as doc:
+            doc.load_page(index).get_pixmap(dpi=dpi).save(str(temp_path))
+        os.replace(temp_path, target)
+    finally:
+        temp_path.unlink(missing_ok=True)
+    return out_path
+
+def page_cache_dir(sha256: str) -> Path:
+    return VISION_PAGE_DIR / sha256[:2] / sha256
+
+def pdf_digest(pdf_path: Path) -> str:
+    """內容定址的 blob 以檔名為雜湊，其他 PDF 計算內容雜湊"""
+    return pdf_path.name if SHA256_PATTERN.match(pdf_path.name) else sha256_file(str(pdf_path))
+
+def remove_rendered_pages(sha256: str) -> bool:
+    """刪除 PDF 的渲染頁面（blob 刪除時呼叫）"""
+    directory = page_cache_dir(sha256)
+    if not directory.is_dir():
+        return False
+    shutil.rmtree(directory, ignore_errors=True)
+    return True
+
+async def render_pdf(pdf_path: Path, dpi: int = VISION_PDF_DPI) -> List[Path]:
+    """以 process pool 平行渲染 PDF 各頁；頁面依內容雜湊快取，已渲染的頁面直接沿用"""
+    loop = asyncio.get_running_loop()
+    sha256 = await asyncio.to_thread(pdf_digest, pdf_path)
+    count = await loop.run_in_executor(get_pool(), pdf_page_count, str(pdf_path))
+    out_dir = page_cache_dir(sha256) / f"dpi{dpi}"
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    pages, jobs = [], []
+    for index in range(count):
+        out_path = out_dir / f"page_p{index + 1:03d}.png"
+        pages.append(out_path)
+        if not out_path.exists():
+            jobs.append(loop.run_in_executor(get_pool(), render_pdf_page, str(pdf_path), index, str(out_path), dpi))
+    await asyncio.gather(*jobs)
+    return pages
+
+async def analyze_document(prompt: str, path: str, concurrency: Optional[int] = None,
+                           on_delta: Optional[DeltaCallback] = None) -> Dict[str, Any]:
+    """
+    整份圖面的視覺分析：拆頁 -> 並行分析各頁 -> 合併結果
+    Args:
+        prompt: 每一頁使用的問題
+        path: PDF、任一頁圖片（xxx_p001.png）、資料夾或附件 ID
+        concurrency: 同時分析的頁數上限，預設 VISION_DOCUMENT_CONCURRENCY
+        on_delta: 每頁完成時回呼該頁結果，未指定時使用 vision_stream_sink
+    Returns:
+        {"document", "page_count", "pages": [...], "summary", "render_ms", "total_ms"}
+    """
+    start = time.perf_counter()
+    on_delta = on_delta or vision_stream_sink.get()
+    source = Path(attachment_store.resolve(path))
+    if not source.exists():
+        raise FileNotFoundError(f"找不到檔案：{path}")
+
+    if is_pdf(source):
+        pages = await render_pdf(source)
+    else:
+        pages = find_page_images(source)
+    render_ms = round((time.perf_counter() - start) * 1000, 1)
+
+    semaphore = asyncio.Semaphore(max(1, concurrency or VISION_DOCUMENT_CONCURRENCY))
+
+    async def analyze_page(number: int, page: Path) -> Dict[str, Any]:
+        async with semaphore:
+            page_start = time.perf_counter()
+            result = {"page": number, "path": str(page)}
+            try:
+                # 頁面內容不逐字轉送，避免多頁輸出交錯；改為每頁完成時回傳一次
+                result["content"] = await analyze_image(prompt, str(page), on_delta=lambda _: None)
+                await emit(on_delta, f"[第 {number} 頁]\n{result['content']}\n")
+            except Exception as e:
+                result["error"] = str(e)
+            result["latency_ms"] = round((time.perf_counter() - page_start) * 1000, 1)
+            return result
+
+    results = await asyncio.gather(*[
+        analyze_page(page_number(page) or i + 1, page) for i, page in enumerate(pages)
+    ])
+
+    summary = "\n\n".join(
+        f"## 第 {r['page']} 頁\n{r.get('content') or '（分析失敗：' + r.get('error', '') + '）'}" for r in results
+    )
+    return {
+        "document": str(source),
+        "page_count": len(results),
+        "pages": results,
+        "failed_pages": [r["page"] for r in results if "error" in r],
+        "summary": summary,
+        "render_ms": render_ms,
+        "total_ms": round((time.perf_counter() - start) * 1000, 1),
+    }
+
+if __name__ == "__main__":
+    import json
+    import sys
+
+    path = sys.argv[1] if len(sys.argv) > 1 else r"E:\CODY\Program\Industry\BEST\Figure\1AE-00166_p001.png"
+    result = asyncio.run(analyze_document("請問這張圖的內容", path))
+    print(json.dumps({k: v for k, v in result.items() if k != "summary"}, ensure_ascii=False, indent=2))
@@ -0,0 +1,180 @@
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from PIL import Image
+import asyncio
+import base64
+import io
+import math
+import os
+import time
+
+VISION_MAX_SIDE = int(os.getenv("VISION_MAX_SIDE", "1280"))            # 長邊上限（像素）
+VISION_IMAGE_FORMAT = os.getenv("VISION_IMAGE_FORMAT", "PNG").upper()   # PNG / JPEG / WEBP
+VISION_IMAGE_QUALITY = int(os.getenv("VISION_IMAGE_QUALITY", "85"))     # JPEG / WEBP 品質
+VISION_PREPROCESS_WORKERS = int(os.getenv("VISION_PREPROCESS_WORKERS", "2"))
+VISION_PATCH_SIZE = 28  # Qwen-VL 每個視覺 token 對應 28x28 像素，用來估算 token 數
+
+MIME_TYPES = {"PNG": "image/png", "JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=max(1, VISION_PREPROCESS_WORKERS))
+    return _pool
+
+def estimate_vision_tokens(size: Tuple[int, int]) -> int:
+    return math.ceil(size[0] / VISION_PATCH_SIZE) * math.ceil(size[1] / VISION_PATCH_SIZE)
+
+def flatten(img: Image.Image) -> Image.Image:
+    """透明背景補白，轉成 RGB 或 L"""
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        rgba = img.convert("RGBA")
+        background = Image.new("RGB", img.size, "white")
+        background.paste(rgba, mask=rgba.split()[-1])
+        return background
+    if img.mode in ("1", "L"):
+        return img.convert("L")
+    return img.convert("RGB")
+
+def is_monochrome(img: Image.Image, tolerance: int = 16) -> bool:
+    """工程圖多為黑白線稿，抽樣判斷是否可轉灰階"""
+    if img.mode == "L":
+        return True
+    sample = img.resize((32, 32))
+    return all(max(p) - min(p) <= tolerance for p in sample.getdata())
+
+def crop_box(size: Tuple[int, int], crop: Sequence[float]) -> Tuple[int, int, int, int]:
+    """crop 為 (left, top, right, bottom)，數值 <= 1 視為比例，否則為像素"""
+    w, h = size
+    left, top, right, bottom = crop
+    if max(crop) <= 1:
+        left, right = left * w, right * w
+        top, bottom = top * h, bottom * h
+    return (max(0, int(left)), max(0, int(top)), min(w, int(right)), min(h, int(bottom)))
+
+def split_tiles(size: Tuple[int, int], rows: int, cols: int, overlap: float = 0.05) -> List[Tuple[int, int, int, int]]:
+    """切成 rows x cols 區塊（含少量重疊，避免文字剛好被切斷）"""
+    w, h = size
+    tw, th = w / cols, h / rows
+    ow, oh = tw * overlap, th * overlap
+    boxes = []
+    for r in range(rows):
+        for c in range(cols):
+            boxes.append((
+                max(0, int(c * tw - ow)), max(0, int(r * th - oh)),
+                min(w, int((c + 1) * tw + ow)), min(h, int((r + 1) * th + oh)),
+            ))
+    return boxes
+
+def encode(img: Image.Image, fmt: str, quality: int) -> bytes:
+    buf = io.BytesIO()
+    if fmt == "JPEG":
+        img.save(buf, format="JPEG", quality=quality, optimize=True)
+    elif fmt == "WEBP":
+        img.save(buf, format="WEBP", quality=quality, method=4)
+    else:
+        img.save(buf, format="PNG", compress_level=6)
+    return buf.getvalue()
+
+def preprocess_image(img_path: str, max_side: int = VISION_MAX_SIDE, fmt: str = VISION_IMAGE_FORMAT,
+                     quality: int = VISION_IMAGE_QUALITY, crop: Optional[Sequence[float]] = None,
+                     tiles: Optional[Tuple[int, int]] = None, grayscale: Optional[bool] = None) -> Dict[str, Any]:
+    """
+    視覺推論前的圖片前處理：裁切 / 切塊 -> 縮圖 -> 重新編碼
+    Args:
+        img_path: 圖片路徑
+        max_side: 長邊上限（像素）
+        fmt: 輸出格式 PNG / JPEG / WEBP
+        quality: JPEG / WEBP 品質
+        crop: 感興趣區域 (left, top, right, bottom)，比例或像素
+        tiles: 切塊 (rows, cols)，每塊各自縮圖
+        grayscale: 是否轉灰階（None 表示自動偵測）
+    Returns:
+        {"images": [{"b64", "mime", "size", "box"}], "stats": {...}}
+    """
+    start = time.perf_counter()
+    fmt = fmt.upper() if fmt.upper() in MIME_TYPES else "PNG"
+    original_bytes = os.path.getsize(img_path)
+
+    with Image.open(img_path) as src:
+        original_size = src.size
+        if src.format == "JPEG" and not (crop or tiles):
+            src.draft("RGB", (max_side, max_side))  # JPEG 可直接以較低解析度解碼
+        img = flatten(src)
+
+    if grayscale is None:
+        grayscale = is_monochrome(img)
+    if grayscale and img.mode != "L":
+        img = img.convert("L")
+
+    if crop:
+        box = crop_box(img.size, crop)
+        img = img.crop(box)
+        boxes = [box]
+        regions = [img]
+    else:
+        boxes = split_tiles(img.size, *tiles) if tiles else [(0, 0, img.size[0], img.size[1])]
+        regions = [img.crop(b) for b in boxes] if tiles else [img]
+
+    images = []
+    for box, region in zip(boxes, regions):
+        region.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+        data = encode(region, fmt, quality)
+        images.append({
+            "b64": base64.b64encode(data).decode("ascii"),
+            "mime": MIME_TYPES[fmt],
+            "size": region.size,
+            "box": box,
+            "bytes": len(data),
+        })
+
+    output_bytes = sum(i["bytes"] for i in images)
+    tokens_before = estimate_vision_tokens(original_size)
+    tokens_after = sum(estimate_vision_tokens(i["size"]) for i in images)
+    return {
+        "images": images,
+        "stats": {
+            "original_bytes": original_bytes,
+            "output_bytes": output_bytes,
+            "bytes_saved": original_bytes - output_bytes,
+            "original_size": original_size,
+            "output_sizes": [i["size"] for i in images],
+            "grayscale": grayscale,
+            "format": fmt,
+            "est_vision_tokens_before": tokens_before,
+            "est_vision_tokens_after": tokens_after,
+            "est_vision_tokens_saved": tokens_before - tokens_after,
+            "preprocess_ms": round((time.perf_counter() - start) * 1000, 1),
+        },
+    }
+
+async def preprocess_image_async(img_path: str, **kwargs) -> Dict[str, Any]:
+    """在 process pool 中執行 preprocess_image，避免 CPU 密集的縮圖 / 編碼卡住 event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_pool(), partial(preprocess_image, img_path, **kwargs))
+
+def parse_crop(text: str) -> Optional[Tuple[float, ...]]:
+    """解析 "left,top,right,bottom" 字串"""
+    if not text or not text.strip():
+        return None
+    values = tuple(float(v) for v in text.replace("，", ",").split(","))
+    if len(values) != 4:
+        raise ValueError("crop 需為 left,top,right,bottom 四個數值")
+    return values
+
+def parse_tiles(text: str) -> Optional[Tuple[int, int]]:
+    """解析 "2x2" 字串"""
+    if not text or not text.strip():
+        return None
+    rows, cols = text.lower().replace("*", "x").split("x")
+    return int(rows), int(cols)
+
+if __name__ == "__main__":
+    import sys
+
+    path = sys.argv[1] if len(sys.argv) > 1 else r"E:\CODY\Program\Industry\BEST\Figure\1AE-00166_p001.png"
+    result = preprocess_image(path)
+    print(result["stats"])
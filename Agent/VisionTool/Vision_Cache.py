@@ -0,0 +1,154 @@
+from typing import Any, Dict, Optional
+import hashlib
+import sqlite3
+import threading
+import time
+import os
+
+VISION_CACHE_ENABLED = os.getenv("VISION_CACHE_ENABLED", "true").lower() == "true"
+VISION_CACHE_PATH = os.getenv("VISION_CACHE_PATH", "./vision_cache/vision_cache.db")
+VISION_CACHE_MAX_BYTES = int(os.getenv("VISION_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+def sha256_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class VisionCache:
+    """視覺推論結果快取 - 以圖片內容 SHA-256 + prompt + model 為鍵，存於 SQLite，依容量做 LRU 淘汰"""
+
+    def __init__(self, path: str = VISION_CACHE_PATH, max_bytes: int = VISION_CACHE_MAX_BYTES):
+        """
+        初始化快取
+        Args:
+            path: SQLite 檔案路徑
+            max_bytes: 結果總容量上限（超過時淘汰最久未使用的項目）
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS VisionResults (
+            CacheKey TEXT PRIMARY KEY,
+            Result TEXT NOT NULL,
+            Bytes INTEGER NOT NULL,
+            CreatedAt REAL NOT NULL,
+            AccessedAt REAL NOT NULL,
+            Hits INTEGER NOT NULL DEFAULT 0
+        )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON VisionResults (AccessedAt)")
+        # 路徑 + 大小 + 修改時間 -> 內容雜湊；命中時不需要讀取圖片
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS FileDigests (
+            Path TEXT PRIMARY KEY,
+            Size INTEGER NOT NULL,
+            MtimeNs INTEGER NOT NULL,
+            Sha256 TEXT NOT NULL
+        )
+        """)
+        self.conn.commit()
+
+    def file_digest(self, img_path: str) -> str:
+        """取得圖片內容雜湊；檔案未變動時直接使用記錄值"""
+        path = os.path.abspath(img_path)
+        st = os.stat(path)
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT Size, MtimeNs, Sha256 FROM FileDigests WHERE Path = ?", (path,)
+            ).fetchone()
+        if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+            return row[2]
+
+        digest = sha256_file(path)
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO FileDigests (Path, Size, MtimeNs, Sha256) VALUES (?, ?, ?, ?)",
+                (path, st.st_size, st.st_mtime_ns, digest),
+            )
+            self.conn.commit()
+        return digest
+
+    @staticmethod
+    def make_key(image_sha256: str, prompt: str, model: str, options: str = "") -> str:
+        """options 用於區分裁切 / 切塊等會改變輸出的設定"""
+        return hashlib.sha256("\0".join((image_sha256, prompt, model, options)).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self.conn.execute("SELECT Result FROM VisionResults WHERE CacheKey = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.conn.execute(
+                "UPDATE VisionResults SET AccessedAt = ?, Hits = Hits + 1 WHERE CacheKey = ?", (time.time(), key)
+            )
+            self.conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, result: str):
+        size = len(result.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO VisionResults (CacheKey, Result, Bytes, CreatedAt, AccessedAt) VALUES (?, ?, ?, ?, ?)",
+                (key, result, size, now, now),
+            )
+            self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        """總容量超過上限時，依最後存取時間淘汰到 90%"""
+        total = self.conn.execute("SELECT COALESCE(SUM(Bytes), 0) FROM VisionResults").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = self.max_bytes * 0.9
+        for key, size in self.conn.execute("SELECT CacheKey, Bytes FROM VisionResults ORDER BY AccessedAt ASC").fetchall():
+            if total <= target:
+                break
+            self.conn.execute("DELETE FROM VisionResults WHERE CacheKey = ?", (key,))
+            total -= size
+
+    def clear(self):
+        with self._lock:
+            self.conn.execute("DELETE FROM VisionResults")
+            self.conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, total = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(Bytes), 0) FROM VisionResults"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "bytes": total,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+_vision_cache: Optional[VisionCache] = None
+_vision_cache_lock = threading.Lock()
+
+def get_vision_cache() -> Optional[VisionCache]:
+    """延遲建立全域快取（VISION_CACHE_ENABLED=false 時回傳 None）"""
+    global _vision_cache
+    if VISION_CACHE_ENABLED and _vision_cache is None:
+        with _vision_cache_lock:
+            if _vision_cache is None:
+                _vision_cache = VisionCache()
+    return _vision_cache
+
+if __name__ == "__main__":
+    print(get_vision_cache().stats() if get_vision_cache() else "Vision cache disabled")
@@ -0,0 +1,142 @@
+from typing import Awaitable, Callable, List, Optional, Sequence, Tuple, Union
+from contextvars import ContextVar
+from VisionTool.Image_Preprocess import preprocess_image_async
+from VisionTool.Vision_Cache import get_vision_cache
+from VisionTool.Attachment_Store import attachment_store, encode_file_b64
+import asyncio
+import inspect
+import time
+import os
+
+VISION_API_HOST = os.getenv("VISION_API_HOST", "http://127.0.0.1:11434")
+VISION_MODEL = os.getenv("VISION_MODEL", "ollama/qwen3-vl:2b")
+VISION_TIMEOUT = float(os.getenv("VISION_TIMEOUT", "180"))               # 單次推論總時限（秒）
+VISION_MAX_CONCURRENCY = int(os.getenv("VISION_MAX_CONCURRENCY", "2"))   # 同時進行的視覺推論上限
+VISION_PREPROCESS = os.getenv("VISION_PREPROCESS", "true").lower() == "true"
+
+DeltaCallback = Callable[[str], Union[None, Awaitable[None]]]
+
+# 呼叫端可設定此 ContextVar，Vision_Tool 產生的部分輸出會轉送到這裡（/chat/ask/stream 轉為 NDJSON 事件）
+vision_stream_sink: ContextVar[Optional[DeltaCallback]] = ContextVar("vision_stream_sink", default=None)
+
+_semaphore: Optional[asyncio.Semaphore] = None
+
+def get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(max(1, VISION_MAX_CONCURRENCY))
+    return _semaphore
+
+class VisionTimeoutError(TimeoutError):
+    """視覺推論超過時限"""
+
+async def emit(callback: Optional[DeltaCallback], text: str):
+    if callback is None:
+        return
+    result = callback(text)
+    if inspect.isawaitable(result):
+        await result
+
+async def stream_completion(prompt: str, images: List[Tuple[str, str]], model: str,
+                            on_delta: Optional[DeltaCallback]) -> str:
+    """images: [(base64, mime), ...]"""
+    from litellm import acompletion
+
+    content = [{"type": "text", "text": prompt}]
+    for b64, mime in images:
+        content.append({"type": "image_url", "image_url": {"url": f"data:{mime};base64,{b64}"}})
+
+    response = await acompletion(
+        model=model,
+        api_base=VISION_API_HOST,
+        stream=True,
+        messages=[{"role": "user", "content": content}],
+    )
+
+    parts = []
+    async for chunk in response:
+        delta = chunk.choices[0].delta.content
+        if delta:
+            parts.append(delta)
+            await emit(on_delta, delta)
+    return "".join(parts)
+
+async def load_images(img_path: str, preprocess: bool, crop: Optional[Sequence[float]],
+                      tiles: Optional[Tuple[int, int]]) -> List[Tuple[str, str]]:
+    if not preprocess:
+        return [(await asyncio.to_thread(encode_file_b64, img_path), "image/png")]
+
+    result = await preprocess_image_async(img_path, crop=crop, tiles=tiles)
+    stats = result["stats"]
+    print(f"✓ Preprocessed {img_path}: {stats['original_bytes']} -> {stats['output_bytes']} bytes "
+          f"(saved {stats['bytes_saved']}), est. vision tokens {stats['est_vision_tokens_before']} -> "
+          f"{stats['est_vision_tokens_after']}, {stats['preprocess_ms']} ms")
+    return [(i["b64"], i["mime"]) for i in result["images"]]
+
+async def analyze_image(prompt: str, img_path: Optional[str] = None, image_b64: Optional[str] = None,
+                        mime: str = "image/png", on_delta: Optional[DeltaCallback] = None,
+                        timeout: Optional[float] = None, model: Optional[str] = None,
+                        preprocess: Optional[bool] = None, crop: Optional[Sequence[float]] = None,
+                        tiles: Optional[Tuple[int, int]] = None, use_cache: bool = True) -> str:
+    """
+    非同步視覺推論（不阻塞 event loop）
+    Args:
+        prompt: 問題
+        img_path: 圖片路徑或附件 ID（與 image_b64 擇一）
+        image_b64: 已編碼的圖片（不經前處理）
+        mime: image_b64 的 MIME 類型
+        on_delta: 部分輸出回呼（同步或 async 皆可），未指定時使用 vision_stream_sink
+        timeout: 時限（秒，含排隊時間），預設 VISION_TIMEOUT
+        model: 模型名稱，預設 VISION_MODEL
+        preprocess: 是否縮圖 / 重新編碼，預設 VISION_PREPROCESS
+        crop: 感興趣區域 (left, top, right, bottom)
+        tiles: 切塊 (rows, cols)
+        use_cache: 是否使用視覺結果快取（僅 img_path 模式）
+    Returns:
+        完整輸出文字
+    """
+    on_delta = on_delta or vision_stream_sink.get()
+    img_path = attachment_store.resolve(img_path) if img_path else img_path
+    timeout = timeout or VISION_TIMEOUT
+    model = model or VISION_MODEL
+    preprocess = VISION_PREPROCESS if preprocess is None else preprocess
+
+    # 快取命中時只需 stat 檔案，不讀取也不編碼圖片
+    cache = get_vision_cache() if use_cache and img_path else None
+    cache_key = None
+    if cache is not None:
+        options = f"preprocess={preprocess};crop={crop};tiles={tiles}"
+        image_sha = await asyncio.to_thread(cache.file_digest, img_path)
+        cache_key = cache.make_key(image_sha, prompt, model, options)
+        cached = await asyncio.to_thread(cache.get, cache_key)
+        if cached is not None:
+            print(f"✓ Vision cache hit: {img_path}")
+            await emit(on_delta, cached)
+            return cached
+
+    async def run() -> str:
+        # 前處理在 process pool 進行，不佔用推論名額，可與其他圖片的推論重疊
+        if image_b64 is not None:
+            images = [(image_b64, mime)]
+        else:
+            images = await load_images(img_path, preprocess or bool(crop or tiles), crop, tiles)
+        async with get_semaphore():
+            return await stream_completion(prompt, images, model, on_delta)
+
+    start = time.perf_counter()
+    try:
+        result = await asyncio.wait_for(run(), timeout=timeout)
+    except asyncio.TimeoutError:
+        raise VisionTimeoutError(f"視覺推論逾時（{timeout:g}s）：{img_path or 'inline image'}")
+    print(f"✓ Vision inference finished in {(time.perf_counter() - start) * 1000:.0f} ms ({model})")
+
+    if cache_key is not None and result:
+        await asyncio.to_thread(cache.put, cache_key, result)
+    return result
+
+if __name__ == "__main__":
+    import sys
+
+    path = sys.argv[1] if len(sys.argv) > 1 else r"E:\CODY\Program\Industry\BEST\Figure\1AE-00166_p001.png"
+    asyncio.run(analyze_image("請問這張圖的內容", path, on_delta=lambda t: print(t, end="", flush=True)))
+    print()
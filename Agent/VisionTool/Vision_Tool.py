@@ -1,56 +1,67 @@
 from agents import function_tool
-from typing import Dict
-from litellm import completion
-import base64
-
-api_host = "http://127.0.0.1:11434"
-use_model = "ollama/qwen3-vl:2b"
+from VisionTool.Vision_Client import analyze_image, VisionTimeoutError
+from VisionTool.Image_Preprocess import parse_crop, parse_tiles
+from VisionTool.Document_Pipeline import analyze_document
+from File_Tool.Blob_Store import resolve_source
+from typing import Any, Dict
+import asyncio
 
 prompt = "請問這張圖的內容"
 img_path = r"E:\CODY\Program\Industry\BEST\Figure\1AE-00166_p001.png"
 
 @function_tool
-def Vision_Tool(prompt: str, img_path: str):
-    """Vision Tool: Analyze and describe the content of an image."""
-    print("Vision Tool Activated")
-
-    with open(img_path, "rb") as f:
-        img_b64 = base64.b64encode(f.read()).decode("utf-8")
-
-    response = completion(
-        model=use_model,
-        api_base=api_host,
-        stream=True,
-        messages=[
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": prompt},
-                    {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{img_b64}"}},
-                ],
-            }
-        ],
-    )
+async def Vision_Tool(prompt: str, img_path: str, crop: str = "", tiles: str = "") -> str:
+    """
+    Vision Tool: Analyze and describe the content of an image.
 
+    Args:
+        prompt: Question about the image
+        img_path: Attachment ID from Image_Reference, SHA-256 of an uploaded file, or a path inside the upload folder
+        crop: Optional region of interest as "left,top,right,bottom" fractions, e.g. "0.6,0.7,1,1" for the title block
+        tiles: Optional grid such as "2x2" to read dense drawings tile by tile
+    """
+    print("Vision Tool Activated")
     print(f"Question:{prompt}")
 
-    Result = ""
-
-    for chunk in response:
-        delta = chunk["choices"][0]["delta"]
-        if "content" in delta and delta["content"]:
-            print(delta["content"], end="", flush=True)
-            Result += delta["content"]
+    try:
+        # 路徑由模型指定，只接受上傳過的內容，避免讀取伺服器上的任意檔案
+        source = await asyncio.to_thread(resolve_source, img_path)
+        # 部分輸出經由 vision_stream_sink 轉送給呼叫端（/chat/ask/stream），不再 print 到 stdout
+        return await analyze_image(prompt, source, crop=parse_crop(crop), tiles=parse_tiles(tiles))
+    except FileNotFoundError:
+        return f"找不到檔案：{img_path}"
+    except ValueError as e:
+        return f"參數錯誤：{e}"
+    except VisionTimeoutError as e:
+        return str(e)
 
-    return Result
+@function_tool
+async def Vision_Document_Tool(prompt: str, path: str) -> Dict[str, Any]:
+    """
+    Vision Document Tool: Analyze every page of a multi-page drawing in one call.
 
-if __name__ == "__main__":
-    resp = Vision_Tool(prompt, img_path)
+    Args:
+        prompt: Question asked for each page
+        path: Attachment ID, SHA-256 of an uploaded file, or a PDF / page image (xxx_p001.png includes all xxx_pNNN pages) / folder of page images inside the upload folder
+    """
+    print("Vision Document Tool Activated")
+    print(f"Question:{prompt}")
 
-    # 重點：要把串流跑完，才會看到內容
-    for chunk in resp:
-        delta = chunk["choices"][0]["delta"]
-        if "content" in delta and delta["content"]:
-            print(delta["content"], end="", flush=True)
+    try:
+        source = await asyncio.to_thread(resolve_source, path)
+        result = await analyze_document(prompt, source)
+    except FileNotFoundError:
+        return {"error": f"找不到檔案：{path}"}
+    except ValueError as e:
+        return {"error": str(e)}
+    return {
+        "page_count": result["page_count"],
+        "failed_pages": result["failed_pages"],
+        "page_latency_ms": {r["page"]: r["latency_ms"] for r in result["pages"]},
+        "total_ms": result["total_ms"],
+        "summary": result["summary"],
+    }
 
+if __name__ == "__main__":
+    resp = asyncio.run(analyze_image(prompt, img_path, on_delta=lambda t: print(t, end="", flush=True)))
     print()  # 換行
@@ -1,12 +1,32 @@
-from Agent_Core import SystemandLogic, CustomAgent, Agent_
+from Agent_Core import SystemandLogic, CustomAgent, Default_Tool_List, agent_registry, model_catalog, model_warmer
+from Model_Router import ModelRouter
 from Sql_Tool.Calling_Able import MemoryType, UserManager
-from Sql_Tool.MsSQL_Tool import Show_Tables, Query_SQL
-from Rag_Tool.Retrieval import Retrieval_Tool_Text
+from Quote_Tool.Batch_Quote import batch_quote_stream, parse_parts, detect_format, to_ndjson
+from Quote_Tool.Quote_Engine import quote_engine, initialize_price_tables, PRICE_FILE
+from File_Tool.Ingestion import file_ingestor, UPLOAD_DIR
+from File_Tool.Upload_Stream import upload_limit, conversation_usage, UploadTooLargeError, UPLOAD_MAX_FILE_BYTES
+from File_Tool.Blob_Store import receive_upload, commit_blob, discard_temp, delete_blob, blob_path, blob_exists, is_sha256
+from File_Tool.File_Serve import serve_file
+from Sql_Tool.File_Index import FileIndexManager
+from Sql_Tool.Job_Queue import JobQueueManager, JOB_STATUSES, FINISHED_STATUSES, JOB_MAX_ATTEMPTS
+from Sql_Tool.Run_Metrics import RUN_METRICS_GROUPS
+from Tracing import span, recorder as trace_recorder
+from Metrics import registry as metrics_registry, observe_request, cache_family, HTTP_IN_FLIGHT, UPLOAD_BYTES
+from VisionTool.Vision_Cache import get_vision_cache
+from VisionTool.Vision_Client import vision_stream_sink
+from Rag_Tool.Retrieval import retrieval_prefetcher
+from Intent_Router import intent_router
+from Job_Tool.Job_Worker import JobWorkerPool
+from Job_Tool.Job_Handlers import register_default_handlers, validate_payload
 from agents import OpenAIChatCompletionsModel, ModelSettings
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi import UploadFile, File, Form, HTTPException, Depends, Header
+from fastapi.responses import StreamingResponse
+from fastapi import UploadFile, File, Form, HTTPException, Depends, Header, Request
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
+from contextlib import asynccontextmanager
 import asyncio
+import time
 import fastapi
 import uvicorn
 from typing import List, Dict, Optional, Any
@@ -14,24 +34,120 @@ from datetime import datetime, timedelta
 import os
 from pathlib import Path
 
-app = fastapi.FastAPI(title="Agent API", description="多對話 Agent 系統 API")
+# ==================== 服務物件（僅建立物件，連線與建表於啟動階段執行） ====================
 
-# ==================== 文件配置 ====================
+file_index = FileIndexManager()
+job_queue = JobQueueManager()
+job_pool = JobWorkerPool(job_queue)
+register_default_handlers(job_pool)
+user_manager = UserManager()
 
-UPLOAD_DIR = Path("./uploads")
-UPLOAD_DIR.mkdir(exist_ok=True)
+STARTUP_WAIT_SECONDS = float(os.getenv("STARTUP_WAIT_SECONDS", "60"))
 
-# ==================== 用戶管理配置 ====================
+# ==================== 啟動流程 ====================
 
-user_manager = UserManager()
-user_manager.initialize_user_tables()
+startup_report: Dict[str, Any] = {"state": "pending", "steps": {}}
+startup_task: Optional[asyncio.Task] = None
+
+async def run_step(name: str, func, *args):
+    """在執行緒中執行一個啟動步驟並記錄耗時；回傳 False 視為失敗"""
+    step = startup_report["steps"].setdefault(name, {})
+    step["state"] = "running"
+    start = time.perf_counter()
+    try:
+        result = await asyncio.to_thread(func, *args)
+        step["state"] = "failed" if result is False else "ok"
+    except Exception as e:
+        step["state"] = "failed"
+        step["error"] = str(e)
+    step["duration_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    print(f"{'✓' if step['state'] == 'ok' else '✗'} 啟動步驟 {name}: {step['state']} ({step['duration_ms']} ms)")
+    return step["state"] == "ok"
+
+def init_users():
+    if user_manager.initialize_user_tables() is False:
+        return False
+    # 創建默認管理員帳號（如果不存在）
+    try:
+        user_manager.create_user("admin", "admin123", "admin", "admin@example.com")
+        user_manager.create_user("user", "user123", "user", "user@example.com")
+    except:
+        pass  # 用戶可能已存在
+
+def init_file_index():
+    UPLOAD_DIR.mkdir(exist_ok=True)
+    if not file_index.initialize_tables():
+        return False
+    file_index.backfill(UPLOAD_DIR)
+
+def init_quote_prices():
+    # 使用 QUOTE_PRICE_FILE 時不需要資料表；載入失敗（RuntimeError）時估價工具會在第一次使用時重試
+    if not PRICE_FILE and not initialize_price_tables():
+        return False
+    quote_engine.ensure_loaded()
+
+def get_agent(model: str):
+    """由 Agent 快取取得指定模型的 Agent（第一次使用該模型時才建立）"""
+    return agent_registry.get(model, Default_Tool_List, CustomAgent.Model_Set)
+
+def build_agent():
+    get_agent(CustomAgent.model_)
+
+async def start_job_workers():
+    if await run_step("job_queue", job_queue.initialize_tables):
+        job_pool.start()
+
+async def run_startup():
+    """
+    啟動流程
+    - 記憶資料庫需先建立（其他資料表都在這個資料庫中）
+    - 其餘互不相依的步驟並行執行
+    - Agent 建立不需要資料庫，與資料庫步驟同時進行
+    """
+    start = time.perf_counter()
+    startup_report["state"] = "starting"
+
+    async def database_steps():
+        await run_step("memory", SystemandLogic.initialize)
+        await asyncio.gather(
+            run_step("users", init_users),
+            run_step("file_index", init_file_index),
+            run_step("run_metrics", SystemandLogic.run_metrics.initialize_tables),
+            run_step("quote_prices", init_quote_prices),
+            start_job_workers(),
+        )
+
+    await asyncio.gather(database_steps(), run_step("agent", build_agent))
 
-# 創建默認管理員帳號（如果不存在）
-try:
-    user_manager.create_user("admin", "admin123", "admin", "admin@example.com")
-    user_manager.create_user("user", "user123", "user", "user@example.com")
-except:
-    pass  # 用戶可能已存在
+    failed = [name for name, step in startup_report["steps"].items() if step["state"] != "ok"]
+    startup_report["state"] = "degraded" if failed else "ready"
+    startup_report["duration_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    print(f"✓ 啟動完成: {startup_report['state']} ({startup_report['duration_ms']} ms)")
+
+async def wait_until_started():
+    """需要 Agent 的請求在啟動完成前等待（不阻塞其他 API）"""
+    if startup_task is not None and not startup_task.done():
+        await asyncio.wait_for(asyncio.shield(startup_task), timeout=STARTUP_WAIT_SECONDS)
+
+@asynccontextmanager
+async def lifespan(app: fastapi.FastAPI):
+    global startup_task
+    # 於背景執行，伺服器可立即接受請求；/ready 在完成前回傳 503
+    startup_task = asyncio.create_task(run_startup())
+    model_catalog.start_auto_refresh()
+    # 預熱目前的全域模型（立即一次，之後定期），避免閒置後第一個請求遇到冷啟動
+    model_warmer.start_periodic(lambda: [CustomAgent.model_])
+    yield
+    if not startup_task.done():
+        startup_task.cancel()
+    await job_pool.stop()
+    await model_catalog.stop()
+    await model_warmer.stop()
+    quote_engine.stop_auto_refresh()
+    await asyncio.to_thread(trace_recorder.flush)
+    await asyncio.to_thread(SystemandLogic.flush_records)
+
+app = fastapi.FastAPI(title="Agent API", description="多對話 Agent 系統 API", lifespan=lifespan)
 
 # ==================== CORS 配置 ====================
 
@@ -50,6 +166,64 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# ==================== 上傳大小檢查 ====================
+
+UPLOAD_FORM_OVERHEAD = 64 * 1024  # multipart 邊界與其他欄位的額外空間
+
+@app.middleware("http")
+async def reject_oversized_upload(request: Request, call_next):
+    """依 Content-Length 提前拒絕過大的上傳，避免先把整個請求讀完"""
+    if request.method == "POST" and request.url.path == "/files/upload":
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > UPLOAD_MAX_FILE_BYTES + UPLOAD_FORM_OVERHEAD:
+            return JSONResponse(status_code=413, content={"detail": f"檔案過大（上限 {UPLOAD_MAX_FILE_BYTES} bytes）"})
+    return await call_next(request)
+
+# ==================== 請求追蹤與指標 ====================
+
+TRACE_SKIP_PATHS = {"/health", "/ready", "/metrics"}
+_route_paths: Dict[Any, str] = {}
+
+def route_template(request: Request) -> str:
+    """
+    請求對應的路由樣板（例如 /jobs/{job_id}），作為指標標籤以避免路徑參數造成標籤數量爆增
+    """
+    endpoint = request.scope.get("endpoint")
+    if endpoint is None:
+        return "unmatched"
+    if not _route_paths:
+        _route_paths.update({route.endpoint: route.path for route in app.routes if hasattr(route, "endpoint")})
+    return _route_paths.get(endpoint, "unmatched")
+
+@app.middleware("http")
+async def observe_http_request(request: Request, call_next):
+    """
+    - 每個請求建立一個 trace（根 span），Agent 執行、模型呼叫、工具與資料庫操作為其子 span；
+      回應標頭 X-Trace-Id 可用於 /admin/traces/{trace_id} 查詢
+    - 依路由記錄請求數與延遲指標
+    - 串流回應只計算到開始回傳為止
+    """
+    start = time.perf_counter()
+    status_code = 500
+    HTTP_IN_FLIGHT.inc()
+    try:
+        if request.url.path in TRACE_SKIP_PATHS:
+            response = await call_next(request)
+        else:
+            with span(f"{request.method} {request.url.path}", "server", method=request.method,
+                      path=request.url.path) as current:
+                response = await call_next(request)
+                current.set(status_code=response.status_code)
+                if response.status_code >= 500:
+                    current.error = f"HTTP {response.status_code}"
+                if not current.detached:
+                    response.headers["X-Trace-Id"] = current.trace_id
+        status_code = response.status_code
+        return response
+    finally:
+        HTTP_IN_FLIGHT.dec()
+        observe_request(request.method, route_template(request), status_code, time.perf_counter() - start)
+
 # ==================== 請求模型 ====================
 
 class AskRequest(BaseModel):
@@ -57,6 +231,7 @@ class AskRequest(BaseModel):
     user_prompt: str
     conversation_id: Optional[int] = None
     max_turns: Optional[int] = 10
+    model: Optional[str] = None  # 本次使用的模型（未指定時依用戶預設 / 全域預設）
 
 class ConversationSwitchRequest(BaseModel):
     """切換對話請求"""
@@ -76,6 +251,25 @@ class SystemMemoryRequest(BaseModel):
 class SelectModelRequest(BaseModel):
     """選擇模型請求"""
     model_name: str
+    scope: str = "global"  # global：全域預設；user：僅目前登入用戶
+
+class WarmupRequest(BaseModel):
+    """模型預熱請求"""
+    model: Optional[str] = None  # 未指定時使用全域預設模型
+    measure: bool = True         # 預熱後量測第一個 token 延遲
+
+class BatchQuoteRequest(BaseModel):
+    """批次估價請求"""
+    parts: List[Dict[str, Any]]
+    concurrency: Optional[int] = None
+
+class JobSubmitRequest(BaseModel):
+    """背景工作請求"""
+    job_type: str
+    payload: Dict[str, Any]
+    priority: int = 0
+    max_attempts: int = JOB_MAX_ATTEMPTS
+    conversation_id: Optional[int] = None
 
 class LoginRequest(BaseModel):
     """登入請求"""
@@ -117,6 +311,28 @@ def require_auth(current_user: Dict[str, Any] = Depends(get_current_user)) -> Di
         raise HTTPException(status_code=401, detail="未登入")
     return current_user
 
+def require_conversation_access(conversation_id: int, current_user: Dict[str, Any], allow_unclaimed: bool = False):
+    """
+    檢查用戶是否有權存取對話（管理員不限）
+    Args:
+        allow_unclaimed: 尚無任何用戶訊息的新對話是否允許（加入附件時使用）
+    """
+    if current_user.get("role") == "admin":
+        return
+    import pyodbc
+    conn_obj = pyodbc.connect(user_manager.conn_str)
+    cursor = conn_obj.cursor()
+    cursor.execute("""
+        SELECT SUM(CASE WHEN UserId = ? THEN 1 ELSE 0 END) AS own, SUM(CASE WHEN UserId IS NOT NULL THEN 1 ELSE 0 END) AS claimed
+        FROM UnifiedMemory
+        WHERE ConversationId = ?
+    """, (current_user.get("user_id"), conversation_id))
+    row = cursor.fetchone()
+    conn_obj.close()
+    if (row.own or 0) > 0 or (allow_unclaimed and not row.claimed):
+        return
+    raise HTTPException(status_code=403, detail="無權訪問此對話")
+
 # ==================== 根路由 ====================
 
 @app.get("/")
@@ -129,11 +345,123 @@ def read_root():
 
 @app.get("/health")
 def health_check():
-    """健康檢查"""
+    """健康檢查（行程存活即可）"""
     return {"status": "ok", "timestamp": datetime.now().isoformat()}
 
+@app.get("/ready")
+def readiness_check():
+    """就緒檢查 - 所有啟動步驟成功後才回傳 200，並附上各步驟耗時"""
+    body = {**startup_report, "timestamp": datetime.now().isoformat()}
+    if startup_report["state"] != "ready":
+        return JSONResponse(status_code=503, content=body)
+    return body
+
+def collect_runtime_metrics():
+    """抓取時讀取各元件既有的統計（不在請求路徑上計算）"""
+    vision_cache = get_vision_cache()
+    client = CustomAgent.external_client
+    backends = client.stats() if isinstance(client, ModelRouter) else []
+    catalog = model_catalog.stats()
+    prefetch = retrieval_prefetcher.stats()
+    intents = intent_router.stats()
+    return cache_family({
+        "agent_registry": agent_registry.stats(),
+        "retrieval": prefetch,
+        "vision": {"hits": vision_cache.hits, "misses": vision_cache.misses} if vision_cache else None,
+    }) + [
+        ("agent_registry_entries", "gauge", "Cached agents", [({}, agent_registry.stats()["entries"])]),
+        ("model_catalog_models", "gauge", "Models in the catalog", [({}, catalog["models"])]),
+        ("model_catalog_age_seconds", "gauge", "Age of the model catalog", [({}, catalog["age_seconds"])]),
+        ("ollama_backend_latency_seconds", "gauge", "Backend EWMA latency",
+         [({"backend": b["name"]}, b["ewma_ms"] / 1000 if b["ewma_ms"] is not None else None) for b in backends]),
+        ("ollama_backend_inflight", "gauge", "Requests in flight per backend",
+         [({"backend": b["name"]}, b["inflight"]) for b in backends]),
+        ("ollama_backend_healthy", "gauge", "1 if the backend is not ejected",
+         [({"backend": b["name"]}, int(b["healthy"])) for b in backends]),
+        ("ollama_backend_failures_total", "counter", "Failed requests per backend",
+         [({"backend": b["name"]}, b["failures"]) for b in backends]),
+        ("retrieval_prefetch_total", "counter", "Speculative retrievals by outcome",
+         [({"outcome": outcome}, prefetch[outcome]) for outcome in ("prefetched", "used", "wasted")]),
+        ("intent_routes_total", "counter", "Chat turns by detected intent and route",
+         [({"intent": r["intent"], "route": r["route"]}, r["count"]) for r in intents["routes"]]),
+        ("jobs_running", "gauge", "Background jobs running in this process",
+         [({}, len(job_pool.status()["running"]))]),
+        ("startup_ready", "gauge", "1 once all startup steps succeeded",
+         [({}, int(startup_report["state"] == "ready"))]),
+    ]
+
+metrics_registry.add_collector(collect_runtime_metrics)
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """Prometheus 指標（請求延遲、Agent 執行、模型 / 工具 / RAGFlow / 資料庫延遲、快取命中、上傳量）"""
+    return fastapi.Response(metrics_registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # ==================== 對話操作 API ====================
 
+async def prepare_question(request: AskRequest, current_user: Optional[Dict[str, Any]]):
+    """
+    設置對話編號、等待啟動完成並選擇模型（HTTPException 在開始回應前拋出）
+    Returns:
+        (conversation_id, user_id, model)
+    """
+    # 設置對話編號（本次請求固定使用這個編號）
+    conversation_id = request.conversation_id or SystemandLogic.current_conversation_id
+    if request.conversation_id:
+        SystemandLogic.set_conversation_id(request.conversation_id)
+
+    # 依請求 / 用戶 / 全域設定選擇模型
+    await wait_until_started()
+    if request.model and not await model_catalog.validate(request.model):
+        raise HTTPException(status_code=400, detail=f"模型不存在: {request.model}")
+    user_id = current_user.get("user_id") if current_user else None
+    return conversation_id, user_id, CustomAgent.resolve_model(request.model, user_id)
+
+def link_messages_to_user(user_id: int, conversation_id: int):
+    """關聯當前對話的所有未關聯消息到用戶（失敗不影響主流程）"""
+    try:
+        import pyodbc
+        conn_obj = pyodbc.connect(user_manager.conn_str)
+        cursor = conn_obj.cursor()
+
+        cursor.execute("""
+            UPDATE UnifiedMemory
+            SET UserId = ?
+            WHERE ConversationId = ? AND UserId IS NULL
+        """, (user_id, conversation_id))
+
+        conn_obj.commit()
+        conn_obj.close()
+    except:
+        pass  # 如果更新失敗，不影響主流程
+
+async def answer_question(request: AskRequest, current_user: Optional[Dict[str, Any]],
+                          conversation_id: int, user_id: Optional[int], model: str, received_at: float) -> Dict[str, Any]:
+    """執行 Agent 並整理回應（執行失敗時回傳 status=error）"""
+    try:
+        response = await SystemandLogic.main(
+            request.user_prompt, get_agent(model), max_turns=request.max_turns, conversation_id=conversation_id,
+            user_id=user_id, queued_at=received_at
+        )
+
+        # 如果用戶已登入，關聯消息到用戶
+        if current_user:
+            await asyncio.to_thread(link_messages_to_user, user_id, conversation_id)
+
+        return {
+            "status": "success",
+            "conversation_id": conversation_id,
+            "model": model,
+            "response": response,
+            "timestamp": datetime.now().isoformat()
+        }
+    except Exception as e:
+        return {
+            "status": "error",
+            "error": str(e),
+            "timestamp": datetime.now().isoformat()
+        }
+
 @app.post("/chat/ask")
 async def ask_question(
     request: AskRequest,
@@ -145,45 +473,52 @@ async def ask_question(
     - 否則使用當前對話編號
     - 支持可選的用戶認證
     """
+    received_at = time.perf_counter()
     try:
-        # 設置對話編號
-        if request.conversation_id:
-            SystemandLogic.set_conversation_id(request.conversation_id)
-        
-        # 執行 Agent
-        response = await SystemandLogic.main(request.user_prompt, Agent_, max_turns=request.max_turns)
-        
-        # 如果用戶已登入，關聯消息到用戶
-        if current_user:
-            try:
-                import pyodbc
-                conn_obj = pyodbc.connect(user_manager.conn_str)
-                cursor = conn_obj.cursor()
-                
-                # 更新當前對話的所有未關聯消息為當前用戶
-                cursor.execute("""
-                    UPDATE UnifiedMemory
-                    SET UserId = ?
-                    WHERE ConversationId = ? AND UserId IS NULL
-                """, (current_user.get("user_id"), SystemandLogic.current_conversation_id))
-                
-                conn_obj.commit()
-                conn_obj.close()
-            except:
-                pass  # 如果更新失敗，不影響主流程
-        
-        return {
-            "status": "success",
-            "conversation_id": SystemandLogic.current_conversation_id,
-            "response": response,
-            "timestamp": datetime.now().isoformat()
-        }
+        conversation_id, user_id, model = await prepare_question(request, current_user)
+    except HTTPException:
+        raise
     except Exception as e:
         return {
             "status": "error",
             "error": str(e),
             "timestamp": datetime.now().isoformat()
         }
+    return await answer_question(request, current_user, conversation_id, user_id, model, received_at)
+
+@app.post("/chat/ask/stream")
+async def ask_question_stream(
+    request: AskRequest,
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    """
+    提問 API（串流）
+    - 以 NDJSON 逐行回傳：執行期間視覺工具的部分輸出 {"type": "vision_delta", "text"}
+      （Vision_Document_Tool 為每頁完成時一筆），最後一行 {"type": "final", ...} 與 /chat/ask 的回應相同
+    """
+    received_at = time.perf_counter()
+    conversation_id, user_id, model = await prepare_question(request, current_user)
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def run():
+        # 工具在 Runner 建立的 task 中執行，會繼承此 task 的 context，視覺輸出經由 vision_stream_sink 送進佇列
+        vision_stream_sink.set(lambda text: queue.put_nowait({"type": "vision_delta", "text": text}))
+        try:
+            return await answer_question(request, current_user, conversation_id, user_id, model, received_at)
+        finally:
+            queue.put_nowait(None)
+
+    async def stream():
+        task = asyncio.create_task(run())
+        try:
+            while (event := await queue.get()) is not None:
+                yield to_ndjson(event)
+            yield to_ndjson({"type": "final", **(await task)})
+        finally:
+            if not task.done():
+                task.cancel()   # 用戶端中斷連線
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
 
 @app.post("/chat/switch")
 def switch_conversation(
@@ -560,60 +895,67 @@ def delete_system_memory(memory_key: str):
 # ==================== 模型選擇 API ====================
 
 @app.get("/models/list")
-async def list_available_models():
-    """列出所有可用模型"""
-    try:
-        # 嘗試從客戶端獲取模型列表
-        try:
-            if hasattr(CustomAgent.external_client, 'models'):
-                models = await CustomAgent.external_client.models.list()
-                model_list = [m.id async for m in models]
-            else:
-                model_list = [CustomAgent.model_]  # 至少返回當前模型
-        except Exception as e:
-            SystemandLogic.Agent_CAlling_Log.warning(f"無法獲取模型列表: {e}，返回當前模型")
-            model_list = [CustomAgent.model_]  # 失敗時至少返回當前模型
-        
-        return {
-            "status": "success",
-            "models": model_list if model_list else [CustomAgent.model_],
-            "total": len(model_list) if model_list else 1,
-            "current_model": CustomAgent.model_,
-            "timestamp": datetime.now().isoformat()
-        }
-    except Exception as e:
-        SystemandLogic.Agent_CAlling_Log.error(f"list_available_models() 錯誤: {e}")
-        return {
-            "status": "success",
-            "models": [CustomAgent.model_],
-            "total": 1,
-            "current_model": CustomAgent.model_,
-            "timestamp": datetime.now().isoformat()
-        }
+async def list_available_models(refresh: bool = False):
+    """
+    列出所有可用模型（含 context length、參數量、量化方式）
+    - 由模型清單快取回傳；refresh=true 時等待重新取得
+    """
+    if refresh:
+        await model_catalog.refresh()
+    models = await model_catalog.list_models()
+    if not models:
+        models = [{"id": CustomAgent.model_}]  # 清單無法取得時至少返回當前模型
+    
+    return {
+        "status": "success",
+        "models": [m["id"] for m in models],
+        "details": models,
+        "total": len(models),
+        "current_model": CustomAgent.model_,
+        "catalog": model_catalog.stats(),
+        "timestamp": datetime.now().isoformat()
+    }
 
 @app.post("/models/select")
-def select_model(request: SelectModelRequest):
-    """選擇模型"""
+async def select_model(
+    request: SelectModelRequest,
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    """
+    選擇預設模型
+    - scope=global：更新全域預設（影響未指定模型的所有請求）
+    - scope=user：只更新目前登入用戶的預設
+    """
     try:
-        # 更新 CustomAgent 的模型
-        CustomAgent.model_ = request.model_name
+        if not await model_catalog.validate(request.model_name):
+            raise HTTPException(status_code=400, detail=f"模型不存在: {request.model_name}")
         
-        # 重新創建 Agent
-        from Sql_Tool.MsSQL_Tool import Show_Tables, Query_SQL
-        from Rag_Tool.Retrieval import Retrieval_Tool_Text
+        if request.scope == "user":
+            if not current_user:
+                raise HTTPException(status_code=401, detail="設定個人模型需要登入")
+            previous_model = CustomAgent.resolve_model(user_id=current_user["user_id"])
+            CustomAgent.set_user_model(current_user["user_id"], request.model_name)
+        elif request.scope == "global":
+            previous_model = CustomAgent.model_
+            CustomAgent.model_ = request.model_name
+        else:
+            raise HTTPException(status_code=400, detail=f"無效的 scope: {request.scope}")
         
-        global Agent_
-        Agent_ = CustomAgent.Create_Agent(Tool_List=[Show_Tables, Query_SQL, Retrieval_Tool_Text])
+        # 預先建立 Agent（已快取時直接取得）
+        get_agent(request.model_name)
         
-        SystemandLogic.Agent_CAlling_Log.info(f"Model switched to: {request.model_name}")
+        SystemandLogic.Agent_CAlling_Log.info(f"Model switched to: {request.model_name} ({request.scope})")
         
         return {
             "status": "success",
-            "previous_model": CustomAgent.model_,
+            "scope": request.scope,
+            "previous_model": previous_model,
             "new_model": request.model_name,
             "message": f"Model switched to {request.model_name}",
             "timestamp": datetime.now().isoformat()
         }
+    except HTTPException:
+        raise
     except Exception as e:
         return {
             "status": "error",
@@ -621,12 +963,40 @@ def select_model(request: SelectModelRequest):
             "timestamp": datetime.now().isoformat()
         }
 
+@app.get("/models/backends")
+def get_model_backends():
+    """推論服務狀態（設定 OLLAMA_BACKENDS 時為多個 backend 的延遲、負載與健康狀態）"""
+    client = CustomAgent.external_client
+    backends = client.stats() if isinstance(client, ModelRouter) else [{"name": "default", "base_url": CustomAgent.base_url}]
+    return {"status": "success", "backends": backends, "timestamp": datetime.now().isoformat()}
+
+@app.post("/models/warmup")
+async def warmup_model(request: WarmupRequest):
+    """
+    預熱模型並量測延遲
+    - 以正式請求相同的系統提示詞與工具定義呼叫推論服務，載入模型並建立前綴 KV cache
+    - cold_first_call_ms：預熱請求本身的耗時（含模型載入）；first_token_ms：預熱後第一個 token 的延遲
+    """
+    model = request.model or CustomAgent.model_
+    if request.model and not await model_catalog.validate(model):
+        raise HTTPException(status_code=400, detail=f"模型不存在: {model}")
+    report = await model_warmer.warm_and_measure(model, request.measure)
+    return {"status": "success", **report, "timestamp": datetime.now().isoformat()}
+
+@app.get("/models/warmup")
+def get_warmup_status():
+    """各模型最近一次預熱結果與第一個 token 延遲"""
+    return {"status": "success", **model_warmer.stats(), "timestamp": datetime.now().isoformat()}
+
 @app.get("/models/current")
-def get_current_model():
-    """獲取當前模型信息"""
+def get_current_model(current_user: Dict[str, Any] = Depends(get_current_user)):
+    """獲取當前模型信息（登入時包含個人預設模型）"""
     return {
         "status": "success",
         "current_model": CustomAgent.model_,
+        "user_model": CustomAgent.user_model(current_user["user_id"]) if current_user else None,
+        "agent_registry": agent_registry.stats(),
+        "prefix_hash": CustomAgent.prefix_hash,
         "base_url": CustomAgent.base_url,
         "model_settings": CustomAgent.Model_Set,
         "timestamp": datetime.now().isoformat()
@@ -660,60 +1030,196 @@ def get_memory_types():
         "timestamp": datetime.now().isoformat()
     }
 
+# ==================== 估價 API ====================
+
+async def require_quote_prices():
+    """串流開始（回傳 200）前確認價格表已載入，載入失敗時回傳 503 而不是中斷串流"""
+    try:
+        snapshot = await asyncio.to_thread(quote_engine.ensure_loaded)
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"價格表無法載入: {str(e)}")
+    if snapshot.empty:
+        raise HTTPException(status_code=503, detail="價格表尚無資料，請先匯入價格（QUOTE_SEED_FILE）")
+
+@app.post("/quote/batch")
+async def batch_quote(request: BatchQuoteRequest):
+    """
+    批次估價（JSON）
+    - 依輸入順序以 NDJSON 串流回傳每筆結果（含 latency_ms），最後一行為 summary
+    """
+    await require_quote_prices()
+
+    async def stream():
+        async for result in batch_quote_stream(request.parts, request.concurrency):
+            yield to_ndjson(result)
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@app.post("/quote/batch/upload")
+async def batch_quote_upload(file: UploadFile = File(...), concurrency: Optional[int] = Form(None)):
+    """批次估價（上傳 CSV / JSON 檔）"""
+    try:
+        data = (await file.read()).decode("utf-8")
+        parts = parse_parts(data, detect_format(file.filename or "", data))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"無法解析零件列表: {str(e)}")
+    await require_quote_prices()
+
+    async def stream():
+        async for result in batch_quote_stream(parts, concurrency):
+            yield to_ndjson(result)
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
 # ==================== 文件管理 API ====================
 
+class LinkFileRequest(BaseModel):
+    conversation_id: int
+    sha256: str
+    original_name: str
+
+def check_upload_quota(conversation_id: int, declared_size: Optional[int]) -> int:
+    """檢查容量（已知大小時提前拒絕；索引無法使用時改為掃描目錄），回傳本次可寫入的上限"""
+    used_bytes = file_index.conversation_usage(conversation_id)
+    if used_bytes is None:
+        used_bytes = conversation_usage(UPLOAD_DIR / str(conversation_id))
+    return upload_limit(used_bytes, declared_size)
+
+async def attach_blob(conversation_id: int, original_name: str, size: int, sha256: str,
+                      mime_type: Optional[str] = None, ingest: bool = True) -> Dict[str, Any]:
+    """
+    在對話中新增一筆指向 blob 的附件並排入預分析
+    Args:
+        ingest: 是否立即排入預分析；blob 尚未放入 blob 區時為 False，由呼叫端在 commit_blob 後呼叫 ingest_blob
+    """
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    new_filename = f"{timestamp}_{original_name}"
+    added = await asyncio.to_thread(
+        file_index.add_reference, conversation_id, new_filename, original_name, size, sha256, mime_type
+    )
+    if not added:
+        raise HTTPException(status_code=503, detail="附件索引無法使用")
+    
+    if ingest:
+        ingest_blob(conversation_id, sha256, original_name, new_filename)
+    
+    return {
+        "status": "success",
+        "filename": new_filename,
+        "original_name": original_name,
+        "size": size,
+        "sha256": sha256,
+        "conversation_id": conversation_id,
+        "timestamp": datetime.now().isoformat()
+    }
+
+def ingest_blob(conversation_id: int, sha256: str, original_name: str, filename: str):
+    """背景預分析（相同內容已分析過時直接沿用）；blob 必須已存在"""
+    file_ingestor.submit(conversation_id, blob_path(sha256), original_name, filename, sha256)
+
+def can_see_blob(sha256: str, current_user: Optional[Dict[str, Any]]) -> bool:
+    """內容存在且被該用戶的對話引用（管理員不限）；未登入一律視為不存在，避免以雜湊探測其他對話的檔案"""
+    if not current_user or not blob_exists(sha256):
+        return False
+    return file_index.has_blob(sha256, None if current_user.get("role") == "admin" else current_user.get("user_id"))
+
+async def attach_existing_blob(conversation_id: int, original_name: str, sha256: str,
+                               mime_type: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    不重新上傳，直接引用已存在的內容
+    Returns:
+        附件資訊；內容在加入引用前剛好被刪除時撤回引用並回傳 None（由呼叫端改為完整上傳）
+    """
+    size = blob_path(sha256).stat().st_size
+    await asyncio.to_thread(check_upload_quota, conversation_id, size)
+    result = await attach_blob(conversation_id, original_name, size, sha256, mime_type, ingest=False)
+    # 引用數已增加，之後不會再被刪除；若在檢查與加入引用之間被刪除，檔案此時已不存在
+    if not blob_exists(sha256):
+        await asyncio.to_thread(file_index.remove_reference, conversation_id, result["filename"])
+        return None
+    ingest_blob(conversation_id, sha256, original_name, result["filename"])
+    result["deduplicated"] = True
+    return result
+
 @app.post("/files/upload")
-async def upload_file(file: UploadFile = File(...), conversation_id: int = Form(...)):
-    """上傳檔案到特定對話"""
+async def upload_file(
+    file: UploadFile = File(...),
+    conversation_id: int = Form(...),
+    sha256: Optional[str] = Form(None),
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    """
+    上傳檔案到特定對話（內容以 SHA-256 定址去重，含單檔 / 對話容量限制）
+    - 用戶端提供 sha256 且內容已存在於該用戶的對話時，不讀取也不寫入檔案內容
+    - 否則分塊串流寫入暫存檔，計算雜湊後放入 blob 區（已存在則丟棄暫存檔）
+    """
+    temp_path = None
     try:
-        # 創建對話資料夾
-        conv_dir = UPLOAD_DIR / str(conversation_id)
-        conv_dir.mkdir(parents=True, exist_ok=True)
+        original_name = Path(file.filename).name
+        sha256 = sha256.lower() if sha256 else None
         
-        # 生成時間戳前綴的檔名
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        file_ext = Path(file.filename).suffix
-        new_filename = f"{timestamp}_{file.filename}"
-        file_path = conv_dir / new_filename
+        if is_sha256(sha256) and await asyncio.to_thread(can_see_blob, sha256, current_user):
+            result = await attach_existing_blob(conversation_id, original_name, sha256, file.content_type)
+            if result is not None:
+                UPLOAD_BYTES.inc("false", amount=result["size"])
+                return result
         
-        # 保存檔案
-        contents = await file.read()
-        with open(file_path, "wb") as f:
-            f.write(contents)
+        max_bytes = await asyncio.to_thread(check_upload_quota, conversation_id, getattr(file, "size", None))
         
-        return {
-            "status": "success",
-            "filename": new_filename,
-            "original_name": file.filename,
-            "size": len(contents),
-            "conversation_id": conversation_id,
-            "timestamp": datetime.now().isoformat()
-        }
+        # 串流保存到暫存檔（同時計算 SHA-256）
+        saved = await receive_upload(file, max_bytes)
+        temp_path = saved["temp_path"]
+        if sha256 and sha256 != saved["sha256"]:
+            raise HTTPException(status_code=400, detail="檔案雜湊不符")
+        
+        # 先增加引用數再放入 blob，避免同時刪除時被當成孤兒清掉；blob 就位後才排入預分析
+        result = await attach_blob(conversation_id, original_name, saved["size"], saved["sha256"], file.content_type,
+                                   ingest=False)
+        written = await commit_blob(temp_path, saved["sha256"])
+        temp_path = None
+        ingest_blob(conversation_id, saved["sha256"], original_name, result["filename"])
+        result["deduplicated"] = not written
+        UPLOAD_BYTES.inc(str(bool(written)).lower(), amount=saved["size"])
+        return result
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"檔案上傳失敗: {str(e)}")
+    finally:
+        await discard_temp(temp_path)
+
+@app.head("/files/blobs/{sha256}")
+def check_blob(sha256: str, current_user: Dict[str, Any] = Depends(require_auth)):
+    """檢查內容是否已存在於自己的對話中（用戶端可先計算雜湊，存在時改用 /files/link 免上傳）"""
+    sha256 = sha256.lower()
+    if not can_see_blob(sha256, current_user):
+        raise HTTPException(status_code=404, detail="內容不存在")
+    return fastapi.Response(headers={"Content-Length": str(blob_path(sha256).stat().st_size)})
+
+@app.post("/files/link")
+async def link_file(request: LinkFileRequest, current_user: Dict[str, Any] = Depends(require_auth)):
+    """將自己對話中已存在的內容加入對話（不需再次上傳）"""
+    sha256 = request.sha256.lower()
+    await asyncio.to_thread(require_conversation_access, request.conversation_id, current_user, True)
+    if not await asyncio.to_thread(can_see_blob, sha256, current_user):
+        raise HTTPException(status_code=404, detail="內容不存在，請改用 /files/upload 上傳")
+    try:
+        result = await attach_existing_blob(request.conversation_id, Path(request.original_name).name, sha256)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    if result is None:
+        raise HTTPException(status_code=404, detail="內容不存在，請改用 /files/upload 上傳")
+    return result
 
 @app.get("/files/conversation/{conversation_id}")
 def get_conversation_files(conversation_id: int):
-    """獲取特定對話的所有檔案"""
+    """獲取特定對話的所有檔案（由附件索引查詢）"""
     try:
-        conv_dir = UPLOAD_DIR / str(conversation_id)
-        
-        if not conv_dir.exists():
-            return {
-                "status": "success",
-                "conversation_id": conversation_id,
-                "files": []
-            }
-        
-        files = []
-        for file_path in sorted(conv_dir.iterdir()):
-            if file_path.is_file():
-                files.append({
-                    "filename": file_path.name,
-                    "size": file_path.stat().st_size,
-                    "upload_date": datetime.fromtimestamp(file_path.stat().st_mtime).isoformat(),
-                    "original_name": "_".join(file_path.name.split("_")[2:])  # 去掉時間戳
-                })
+        files = file_index.get_files(conversation_id)
+        if files is None:
+            files = scan_conversation_files(conversation_id)
         
         return {
             "status": "success",
@@ -723,9 +1229,95 @@ def get_conversation_files(conversation_id: int):
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"獲取檔案列表失敗: {str(e)}")
 
+def scan_conversation_files(conversation_id: int) -> List[Dict[str, Any]]:
+    """附件索引無法使用時的備援：直接掃描對話資料夾"""
+    conv_dir = UPLOAD_DIR / str(conversation_id)
+    if not conv_dir.exists():
+        return []
+    
+    files = []
+    for entry in sorted(os.scandir(conv_dir), key=lambda e: e.name):
+        if entry.is_file() and not entry.name.endswith(".part"):
+            st = entry.stat()
+            original_name = entry.name.split("_", 2)[2] if entry.name.count("_") >= 2 else entry.name
+            files.append({
+                "filename": entry.name,
+                "size": st.st_size,
+                "upload_date": datetime.fromtimestamp(st.st_mtime).isoformat(),
+                "original_name": original_name
+            })
+    return files
+
+@app.get("/files/status/{conversation_id}")
+def get_conversation_files_status(conversation_id: int):
+    """獲取特定對話所有檔案的預分析狀態"""
+    results = file_ingestor.list_results(conversation_id)
+    return {
+        "status": "success",
+        "conversation_id": conversation_id,
+        "files": [
+            {k: r.get(k) for k in ("filename", "original_name", "status", "kind", "timings_ms", "updated_at")}
+            for r in results
+        ],
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.get("/files/status/{conversation_id}/{filename}")
+def get_file_status(conversation_id: int, filename: str):
+    """獲取特定檔案的預分析狀態與結果"""
+    result = file_ingestor.get_status(conversation_id, filename)
+    if result is None:
+        raise HTTPException(status_code=404, detail="找不到該檔案的分析紀錄")
+    return {
+        "status": "success",
+        "conversation_id": conversation_id,
+        "analysis": result,
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.get("/files/download/{conversation_id}/{filename}")
+@app.head("/files/download/{conversation_id}/{filename}")
+async def download_file(
+    conversation_id: int,
+    filename: str,
+    download: bool = False,
+    range_header: Optional[str] = Header(None, alias="Range"),
+    if_none_match: Optional[str] = Header(None),
+    if_range: Optional[str] = Header(None),
+    current_user: Dict[str, Any] = Depends(require_auth)
+):
+    """
+    下載 / 預覽對話附件（需登入，一般用戶只能下載自己對話的附件）
+    - 支援 Range（206，可分段讀取大型圖面）
+    - 以內容雜湊作為 ETag，If-None-Match 相符時回傳 304
+    """
+    await asyncio.to_thread(require_conversation_access, conversation_id, current_user)
+    record = await asyncio.to_thread(file_index.get_file, conversation_id, filename)
+    sha256 = record.get("sha256") if record else None
+    if sha256 and blob_exists(sha256):
+        file_path = blob_path(sha256)
+    else:
+        # 舊版（去重前）存放在對話資料夾的檔案
+        sha256 = None
+        file_path = UPLOAD_DIR / str(conversation_id) / filename
+        try:
+            file_path.resolve().relative_to(UPLOAD_DIR.resolve())
+        except ValueError:
+            raise HTTPException(status_code=403, detail="不允許的檔案路徑")
+    
+    if not file_path.is_file():
+        raise HTTPException(status_code=404, detail="檔案不存在")
+    
+    original_name = record["original_name"] if record else filename
+    media_type = (record or {}).get("mime_type") or file_index.guess_mime(original_name)
+    return serve_file(
+        file_path, original_name, media_type, sha256,
+        range_header=range_header, if_none_match=if_none_match, if_range=if_range, attachment=download
+    )
+
 @app.delete("/files/{conversation_id}/{filename}")
 def delete_file(conversation_id: int, filename: str):
-    """刪除特定檔案"""
+    """刪除特定檔案（減少內容引用數，歸零時才刪除 blob）"""
     try:
         file_path = UPLOAD_DIR / str(conversation_id) / filename
         
@@ -735,10 +1327,16 @@ def delete_file(conversation_id: int, filename: str):
         except ValueError:
             raise HTTPException(status_code=403, detail="不允許的檔案路徑")
         
-        if not file_path.exists():
+        # 引用數歸零時在同一交易中刪除 blob 檔案，避免同時上傳相同內容的請求沿用即將被刪除的檔案
+        removed = file_index.remove_reference(conversation_id, filename, on_orphaned=delete_blob)
+        if removed is None and not file_path.exists():
             raise HTTPException(status_code=404, detail="檔案不存在")
         
-        file_path.unlink()
+        # 舊版（去重前）存放在對話資料夾的檔案
+        file_path.unlink(missing_ok=True)
+        if removed and removed["orphaned"]:
+            file_ingestor.remove_blob_result(removed["sha256"])
+        file_ingestor.remove(conversation_id, filename)
         
         return {
             "status": "success",
@@ -751,6 +1349,170 @@ def delete_file(conversation_id: int, filename: str):
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"檔案刪除失敗: {str(e)}")
 
+# ==================== 背景工作 API ====================
+
+def job_owner(current_user: Dict[str, Any]) -> Optional[int]:
+    """一般用戶只能存取自己提交的工作；管理員不限制（回傳 None）"""
+    return None if current_user.get("role") == "admin" else current_user.get("user_id")
+
+def get_owned_job(job_id: int, current_user: Dict[str, Any], include_result: bool = False) -> Dict[str, Any]:
+    job = job_queue.get_job(job_id, include_result=include_result)
+    owner = job_owner(current_user)
+    if job is None or (owner is not None and job["user_id"] != owner):
+        raise HTTPException(status_code=404, detail="找不到該工作")
+    return job
+
+@app.post("/jobs")
+async def submit_job(
+    request: JobSubmitRequest,
+    current_user: Dict[str, Any] = Depends(require_auth)
+):
+    """
+    提交背景工作（vision_document / batch_quote / file_ingest）
+    - vision_document 的 path 需為檔案的 SHA-256 或附件 ID
+    - 立即回傳工作編號，以 /jobs/{job_id} 查詢進度（只有提交者與管理員可查詢）
+    """
+    if request.job_type not in job_pool.handlers:
+        raise HTTPException(status_code=400, detail=f"未知的工作類型: {request.job_type}，可用: {sorted(job_pool.handlers)}")
+    try:
+        await asyncio.to_thread(validate_payload, request.job_type, request.payload)
+    except (ValueError, FileNotFoundError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    job_id = await asyncio.to_thread(
+        job_queue.enqueue, request.job_type, request.payload, request.priority, request.max_attempts,
+        current_user.get("user_id"), request.conversation_id
+    )
+    if job_id is None:
+        raise HTTPException(status_code=503, detail="工作佇列無法使用")
+    job_pool.notify()
+    
+    return {
+        "status": "success",
+        "job_id": job_id,
+        "job_status": "queued",
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.get("/jobs")
+def list_jobs(status: Optional[str] = None, limit: int = 50, current_user: Dict[str, Any] = Depends(require_auth)):
+    """列出最近的背景工作（一般用戶只列出自己的工作）"""
+    if status and status not in JOB_STATUSES:
+        raise HTTPException(status_code=400, detail=f"無效的狀態: {status}")
+    return {
+        "status": "success",
+        "jobs": job_queue.list_jobs(status, user_id=job_owner(current_user), limit=max(1, min(limit, 500))),
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.get("/jobs/workers")
+def get_job_workers(current_user: Dict[str, Any] = Depends(require_admin)):
+    """本行程的 worker 狀態（僅管理員）"""
+    return {"status": "success", "workers": job_pool.status(), "timestamp": datetime.now().isoformat()}
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: int, current_user: Dict[str, Any] = Depends(require_auth)):
+    """查詢背景工作狀態與進度"""
+    job = get_owned_job(job_id, current_user)
+    return {"status": "success", "job": job, "timestamp": datetime.now().isoformat()}
+
+@app.get("/jobs/{job_id}/result")
+def get_job_result(job_id: int, current_user: Dict[str, Any] = Depends(require_auth)):
+    """取得背景工作結果（完成後才可取得）"""
+    job = get_owned_job(job_id, current_user, include_result=True)
+    if job["status"] not in FINISHED_STATUSES:
+        raise HTTPException(status_code=409, detail=f"工作尚未完成（{job['status']}）")
+    return {"status": "success", "job": job, "timestamp": datetime.now().isoformat()}
+
+@app.delete("/jobs/{job_id}")
+def cancel_job(job_id: int, current_user: Dict[str, Any] = Depends(require_auth)):
+    """取消尚未完成的背景工作（只能取消自己提交的工作，管理員不限）"""
+    if not job_queue.cancel(job_id, user_id=job_owner(current_user)):
+        raise HTTPException(status_code=404, detail="找不到可取消的工作")
+    return {"status": "success", "job_id": job_id, "message": "工作已取消", "timestamp": datetime.now().isoformat()}
+
+# ==================== 用量統計 API ====================
+
+@app.get("/metrics/runs")
+def get_run_metrics(
+    group_by: str = "model",
+    hours: float = 24,
+    user_id: Optional[int] = None,
+    model: Optional[str] = None,
+    conversation_id: Optional[int] = None,
+    recent: int = 0,
+    current_user: Dict[str, Any] = Depends(require_auth)
+):
+    """
+    Agent 執行用量彙總（tokens、回合數、工具呼叫與耗時、等待時間）
+    - group_by：user / model / conversation
+    - 一般用戶：只統計自己的執行；管理員：全部或指定用戶
+    - recent > 0 時附上最近幾筆執行明細
+    """
+    if group_by not in RUN_METRICS_GROUPS:
+        raise HTTPException(status_code=400, detail=f"無效的 group_by: {group_by}")
+    if current_user.get("role") != "admin":
+        user_id = current_user.get("user_id")
+    
+    hours = max(0.1, min(hours, 24 * 90))
+    report = SystemandLogic.run_metrics.aggregate(group_by, hours, user_id, model, conversation_id)
+    if recent > 0:
+        report["recent"] = SystemandLogic.run_metrics.recent(min(recent, 500), user_id, model, conversation_id, hours)
+    
+    return {
+        "status": "success",
+        "group_by": group_by,
+        "hours": hours,
+        "filters": {"user_id": user_id, "model": model, "conversation_id": conversation_id},
+        **report,
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.get("/metrics/prefetch")
+def get_prefetch_metrics():
+    """
+    檢索預取統計
+    - wasted_ratio：預取後該次執行沒有用到的比例（過高代表觸發詞太寬鬆）
+    - hit_ratio：檢索工具呼叫直接由快取取得的比例
+    """
+    return {"status": "success", **retrieval_prefetcher.stats(), "timestamp": datetime.now().isoformat()}
+
+@app.get("/metrics/intents")
+def get_intent_metrics():
+    """
+    意圖路由統計（本行程啟動後）
+    - shortcut_ratio：不經過大模型的比例（固定回覆、小模型、直接估價）
+    - fallback_reasons：判定為捷徑意圖但仍交給 Agent 的原因；逐筆決策見 log_file
+    """
+    return {"status": "success", **intent_router.stats(), "timestamp": datetime.now().isoformat()}
+
+# ==================== 追蹤 API ====================
+
+@app.get("/admin/traces/slowest")
+def get_slowest_traces(
+    limit: int = 20,
+    minutes: Optional[float] = None,
+    name: Optional[str] = None,
+    current_user: Dict[str, Any] = Depends(require_admin)
+):
+    """
+    最近最慢的請求（每個 trace 附上依 span 名稱彙總的耗時，例如 llm.call / tool.Query_SQL / db.memory.*）
+    - minutes：只看最近幾分鐘；name：依請求名稱篩選（例如 /chat/ask）
+    """
+    return {
+        "status": "success",
+        "traces": trace_recorder.slowest(max(1, min(limit, 200)), minutes, name),
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.get("/admin/traces/{trace_id}")
+def get_trace(trace_id: str, current_user: Dict[str, Any] = Depends(require_admin)):
+    """單一 trace 的完整 span 列表（OTLP JSON 格式）"""
+    trace = trace_recorder.get(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="找不到該 trace（可能已超出保留數量，請查看 logs/traces.jsonl）")
+    return {"status": "success", "trace": trace, "timestamp": datetime.now().isoformat()}
+
 # ==================== 認證 API ====================
 
 @app.post("/auth/login")
@@ -942,5 +1704,7 @@ def get_conversation_messages(
 if __name__ == "__main__":
     import os
     port = int(os.getenv("BACKEND_PORT", 5555))
-    reload = os.getenv("RELOAD", "True").lower() == "true"
-    uvicorn.run("main:app", host="0.0.0.0", port=port, reload=reload)
+    workers = int(os.getenv("UVICORN_WORKERS", "1"))
+    # 多個 worker 時不能使用 reload；共用狀態請設定 STATE_STORE=redis
+    reload = workers == 1 and os.getenv("RELOAD", "True").lower() == "true"
+    uvicorn.run("main:app", host="0.0.0.0", port=port, reload=reload, workers=workers)
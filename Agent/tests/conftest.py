@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# 模組以 Agent 目錄為根匯入（與 main.py 相同）
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,76 @@
+from pathlib import Path
+from Quote_Tool.Quote_Engine import QuoteEngine, load_price_tables_from_file
+import Intent_Router
+import pytest
+
+SAMPLE_PRICES = Path(__file__).resolve().parent.parent / "Quote_Tool" / "price_tables.sample.json"
+
+class QuoteClassifier:
+    """固定判為估價，只測試欄位解析與捷徑判斷"""
+
+    def predict(self, text):
+        return "quote", 1.0
+
+@pytest.fixture
+def router(monkeypatch, tmp_path):
+    engine = QuoteEngine(lambda: load_price_tables_from_file(str(SAMPLE_PRICES)), refresh_seconds=0)
+    engine.ensure_loaded()
+    monkeypatch.setattr(Intent_Router, "quote_engine", engine)
+    return Intent_Router.IntentRouter(classifier=QuoteClassifier(), log_file=tmp_path / "intent.jsonl")
+
+def test_complete_quote_uses_fast_path(router):
+    decision = router.route("SUS316 圓柱 15kg 銑床 3小時 陽極")
+    assert decision.route == "quote"
+    assert decision.details["fields"]["surface_treatment"] == "陽極"
+
+def test_electroless_nickel_is_not_read_as_no_treatment(router):
+    decision = router.route("SUS316 圓柱 15kg 銑床 3小時 表面處理:無電解鎳")
+    assert decision.route == "quote"
+    assert decision.details["fields"]["surface_treatment"] == "無電解鎳"
+    assert "無電解鎳" in decision.reply
+
+@pytest.mark.parametrize("text", [
+    "SUS316 圓柱 15kg 銑床 3小時 表面處理:無",
+    "SUS316 圓柱 15kg 銑床 3小時 表面處理：無，2件",
+    "SUS316 圓柱 15kg 銑床 3小時 無表面處理",
+])
+def test_no_treatment(router, text):
+    decision = router.route(text)
+    assert decision.route == "quote"
+    assert decision.details["fields"]["surface_treatment"] == "無"
+
+@pytest.mark.parametrize("text", [
+    "SUS316 圓柱 15kg 銑床 3小時 不要熱處理",
+    "SUS316 圓柱 15kg 銑床 3小時 不需要陽極",
+    "SUS316 圓柱 15kg 銑床 3小時 免陽極",
+])
+def test_negated_treatment_falls_back(router, text):
+    decision = router.route(text)
+    assert decision.route == "agent"
+    assert decision.reason == "negated_treatment"
+
+@pytest.mark.parametrize("text", [
+    "SUS316 圓柱 總重 15kg 銑床 總工時 30小時 陽極 10件",
+    "SUS316 圓柱 15kg 銑床 3小時 陽極 10件 合計",
+])
+def test_total_values_fall_back(router, text):
+    decision = router.route(text)
+    assert decision.route == "agent"
+    assert decision.reason == "total_values"
+
+@pytest.mark.parametrize("text, reason", [
+    ("SUS316 圓柱 15kg 銑床 3小時 陽極 嗎", "question"),
+    ("SUS316 SUS304 圓柱 15kg 銑床 3小時 陽極", "ambiguous_quote"),
+    ("SUS316 圓柱 15kg 銑床 3小時 熱處理 陽極", "ambiguous_quote"),
+    ("SUS316 圓柱 15kg 銑床 3小時 陽極 無表面處理", "ambiguous_quote"),
+    ("SUS316 圓柱 15kg 銑床 3小時 陽極 0件", "incomplete_quote"),
+])
+def test_unclear_quotes_fall_back(router, text, reason):
+    decision = router.route(text)
+    assert decision.route == "agent"
+    assert decision.reason == reason
+
+def test_longest_equipment_name_is_not_ambiguous(router):
+    decision = router.route("SUS316 圓柱 15kg CNC銑床 3小時 陽極")
+    assert decision.route == "quote"
+    assert decision.details["fields"]["equipment"] == "CNC銑床"